@@ -0,0 +1,687 @@
+/**
+ * @filename  search_worker.js
+ * @author    Simon C, assisted by Dora
+ * @version   1.7
+ * @date      2026-10-17
+ * @aim       Loads the archive data and search indexes and runs every search off the main thread,
+ *            so the page stays responsive while the indexes parse and while long searches run.
+ * @precursor The index loading and search code used to live in app.js.
+ *
+ * When the site is served by search_api.py, /api/status answers and the worker only fetches chat
+ * metadata up front: searches and chat content are requested from the API as they are needed.
+ * Otherwise the data files are fetched and searched here: 'loaded' is sent once the catalog is in, and
+ * each search index is fetched on its first search or in the background. The BM25 table holds a term
+ * frequency per posting, as large as the word index, so it is only fetched by the first word search
+ * that has matches to rank. They are fetched through
+ * asset_manifest.json when the build wrote one: it maps each logical name to a content-hashed
+ * copy under assets/, which the browser may cache forever.
+ *
+ * Message protocol (every request carries an id that its reply repeats):
+ *   app.js -> worker                     worker -> app.js
+ *   {type: 'load'}                       {type: 'loaded', chats, source} | {type: 'error', message}
+ *   {type: 'query', query, mode}         {type: 'results', matchedIds, rankedIds, corrections} | {type: 'cancelled'}
+ *   {type: 'cancel', id}                 (the cancelled query replies 'cancelled')
+ *   {type: 'chat', chatId, query, mode}  {type: 'chat', body: {content, messages}, hits}
+ *   {type: 'snippets', query, mode, chatIds}  {type: 'snippets', snippets: {chatId: snippet}}
+ * A query supersedes every older one: only the latest query ever produces results.
+ * matchedIds is null when the query does not filter (too short); rankedIds holds the best BM25 matches.
+ * Word searches are typo-tolerant: a term missing from the word index stands for the most common terms
+ * one edit away (from search_index_fuzzy.bin), and corrections maps each such term to them.
+ * chats holds metadata only; source is 'api' when search_api.py answers the searches, else 'static'.
+ * hits lists where the query occurs in the chat, in reading order, as {message, start, end} offsets into
+ * the content; for word searches they come from the positional postings, so nothing is scanned. hits is
+ * null if the build has no positions (the chat view then highlights with a regex as before). A snippet
+ * is {message, before, match, after} around the best hit of a chat, or null.
+ */
+let allChats = {};
+let wordIndexLoad = null;    // Promise of the word index, once first needed
+let trigramIndexLoad = null; // Promise of the parsed trigram index, once first needed
+let rankingLoad = null;      // Promise of the BM25 table from search_index_ranking.json, or null (unranked search)
+const RANKED_RESULTS = 50; // Matches ranked by relevance and listed first (BM25_TOP_K in build_database.py).
+const PATTERN_YIELD_EVERY = 16; // pattern search candidates confirmed between checks for newer messages
+const PATTERN_CACHE_SIZE = 8;
+const patternCache = new Map(); // pattern query -> Set of matching chat IDs, oldest first
+
+// With the sharded build layout, allChats comes from catalog.json and holds no content.
+// Shards are fetched when needed; the most recently used ones stay cached.
+const SHARD_CACHE_SIZE = 4;
+const shardCache = new Map(); // shard number -> Promise of {chatId: {content, messages}}, oldest first
+
+let assetManifest = null; // {files: {logical name: hashed path}} from asset_manifest.json, if present
+let latestQueryId = 0;
+let cancelledQueryId = 0;
+
+// Set to the /api/status reply when search_api.py serves the site; null means the static files are used.
+let searchApi = null;
+const API_PAGE_SIZE = 5000; // chat metadata fetched per request (MAX_PAGE_SIZE in search_api.py)
+let queryAbort = null;      // aborts the API request of the latest query when it is cancelled or superseded
+
+const yieldToMessages = () => new Promise(resolve => setTimeout(resolve, 0));
+
+// Without a manifest every file is fetched under its plain name, and any file may exist.
+const assetUrl = (name) => (assetManifest && assetManifest.files[name]) || name;
+const hasAsset = (name) => !assetManifest || name in assetManifest.files;
+const fetchAsset = (name) => (hasAsset(name) ? fetch(assetUrl(name)) : Promise.resolve({ ok: false, status: 404 }));
+
+// --- CHAT CONTENT ---
+const loadShard = (shardNumber) => {
+    let shardPromise = shardCache.get(shardNumber);
+    if (shardPromise) {
+        shardCache.delete(shardNumber); // re-inserted below as the most recently used
+    } else {
+        shardPromise = fetch(assetUrl(`shards/${shardNumber}.json`)).then(res => {
+            if (!res.ok) throw new Error(`Could not load content shard ${shardNumber} (HTTP ${res.status})`);
+            return res.json();
+        });
+        shardPromise.catch(() => shardCache.delete(shardNumber));
+    }
+    shardCache.set(shardNumber, shardPromise);
+    while (shardCache.size > SHARD_CACHE_SIZE) shardCache.delete(shardCache.keys().next().value);
+    return shardPromise;
+};
+
+const loadChatBody = async (chat) => {
+    if (searchApi) {
+        const res = await fetch(`api/chats/${chat.id}`);
+        if (!res.ok) throw new Error(`Could not load chat ${chat.id} (HTTP ${res.status})`);
+        const { content, messages } = await res.json();
+        return { content, messages };
+    }
+    if (chat.content !== undefined) return { content: chat.content, messages: chat.messages }; // single database.json layout
+    const shard = await loadShard(chat.shard);
+    return shard[chat.id] || { content: null, messages: [] };
+};
+
+const loadChatContent = async (chat) => (await loadChatBody(chat)).content;
+
+// --- POSITIONS (see encode_positions_block() and PositionsWriter in build_database.py) ---
+// A positions file holds one block per chat, then a table of (chat ID, block offset) pairs and a footer.
+// The single layout has one file; the sharded layout has shards/<n>.bin next to each content shard.
+const SNIPPET_CONTEXT = 60; // UTF-16 units either side of a snippet's hit (SNIPPET_CONTEXT in build_database.py)
+const positionsCache = new Map(); // file name -> Promise of a parsed positions file (or null), oldest first
+
+const readVarint = (bytes, position) => {
+    let value = 0, shift = 0, byte;
+    do {
+        byte = bytes[position++];
+        value += (byte & 0x7f) * 2 ** shift;
+        shift += 7;
+    } while (byte & 0x80);
+    return [value, position];
+};
+
+const openPositionsFile = (buffer) => {
+    const view = new DataView(buffer);
+    const bytes = new Uint8Array(buffer);
+    const footer = buffer.byteLength - 16;
+    const magic = footer >= 0 ? String.fromCharCode(...bytes.subarray(footer + 8, footer + 12)) : '';
+    if (magic !== 'TSPI' || view.getUint32(footer + 12, true) !== 1) throw new Error('Unsupported positions file.');
+    const tableOffset = view.getUint32(footer, true);
+    const chatCount = view.getUint32(footer + 4, true);
+    const blocks = new Map(); // chat ID -> [block start, block end]
+    for (let i = 0; i < chatCount; i++) {
+        const start = view.getUint32(tableOffset + 8 * i + 4, true);
+        const end = i + 1 < chatCount ? view.getUint32(tableOffset + 8 * (i + 1) + 4, true) : tableOffset;
+        blocks.set(view.getUint32(tableOffset + 8 * i, true), [start, end]);
+    }
+    return { bytes, blocks };
+};
+
+// Decodes the occurrences of the wanted terms in one chat: Map term -> [[message, offset], ...].
+const decodePositions = (file, chatId, wanted) => {
+    const found = new Map();
+    const block = file.blocks.get(chatId);
+    if (!block) return found;
+    const { bytes } = file;
+    const decoder = new TextDecoder();
+    let [termCount, position] = readVarint(bytes, block[0]);
+    for (let t = 0; t < termCount && found.size < wanted.size; t++) {
+        let length, count;
+        [length, position] = readVarint(bytes, position);
+        const term = decoder.decode(bytes.subarray(position, position + length));
+        position += length;
+        [count, position] = readVarint(bytes, position);
+        const occurrences = [];
+        let message = 0, offset = 0;
+        for (let i = 0; i < count; i++) {
+            let messageDelta, value;
+            [messageDelta, position] = readVarint(bytes, position);
+            [value, position] = readVarint(bytes, position);
+            offset = messageDelta === 0 ? offset + value : value;
+            message += messageDelta;
+            occurrences.push([message, offset]);
+        }
+        if (wanted.has(term)) found.set(term, occurrences);
+    }
+    return found;
+};
+
+const loadPositionsFile = (chat) => {
+    const name = chat.content !== undefined ? 'search_index_positions.bin' : `shards/${chat.shard}.bin`;
+    let filePromise = positionsCache.get(name);
+    if (filePromise) {
+        positionsCache.delete(name); // re-inserted below as the most recently used
+    } else {
+        filePromise = fetchAsset(name).then(async res => (res.ok ? openPositionsFile(await res.arrayBuffer()) : null));
+        filePromise.catch(() => positionsCache.delete(name));
+    }
+    positionsCache.set(name, filePromise);
+    while (positionsCache.size > SHARD_CACHE_SIZE) positionsCache.delete(positionsCache.keys().next().value);
+    return filePromise;
+};
+
+// --- HITS AND SNIPPETS (mirror chat_hits() and keyword_in_context() in build_database.py) ---
+const chatHits = async (chat, body, query, mode) => {
+    const hits = [];
+    const { content, messages } = body;
+    if (!query || !content) return hits;
+    if (mode === 'pattern') {
+        messages.forEach((message, number) => {
+            const text = content.slice(message.start, message.end).toLowerCase();
+            for (let index = text.indexOf(query); index !== -1; index = text.indexOf(query, index + query.length)) {
+                hits.push({ message: number, start: message.start + index, end: message.start + index + query.length, term: query });
+            }
+        });
+        return hits;
+    }
+    // Corrected terms are highlighted where their expansions occur.
+    const terms = new Set((await expandTerms(query.split(/\s+/).filter(term => term.length > 1))).flat());
+    if (terms.size === 0) return hits;
+    const file = await loadPositionsFile(chat);
+    if (!file) return null;
+    for (const [term, occurrences] of decodePositions(file, chat.id, terms)) {
+        for (const [number, offset] of occurrences) {
+            const start = messages[number].start + offset;
+            hits.push({ message: number, start, end: start + term.length, term });
+        }
+    }
+    return hits.sort((a, b) => a.start - b.start);
+};
+
+// The first hit of the message with the most distinct terms (the earliest on a tie), with some context.
+const keywordInContext = (content, messages, hits) => {
+    if (!hits || hits.length === 0) return null;
+    const termsByMessage = new Map();
+    for (const hit of hits) {
+        if (!termsByMessage.has(hit.message)) termsByMessage.set(hit.message, new Set());
+        termsByMessage.get(hit.message).add(hit.term);
+    }
+    let best = -1;
+    for (const [number, terms] of termsByMessage) {
+        const bestCount = best === -1 ? -1 : termsByMessage.get(best).size;
+        if (terms.size > bestCount || (terms.size === bestCount && number < best)) best = number;
+    }
+    const hit = hits.find(candidate => candidate.message === best);
+    const message = messages[best];
+    const beforeStart = Math.max(message.start, hit.start - SNIPPET_CONTEXT);
+    const afterEnd = Math.min(message.end, hit.end + SNIPPET_CONTEXT);
+    return {
+        message: best,
+        before: (beforeStart > message.start ? '\u2026' : '') + content.slice(beforeStart, hit.start),
+        match: content.slice(hit.start, hit.end),
+        after: content.slice(hit.end, afterEnd) + (afterEnd < message.end ? '\u2026' : ''),
+    };
+};
+
+const chatSnippets = async (query, mode, chatIds) => {
+    if (searchApi) {
+        const params = new URLSearchParams({ q: query, mode, ids: chatIds.join(',') });
+        const res = await fetch(`api/snippets?${params}`);
+        if (!res.ok) throw new Error(`Could not load snippets (HTTP ${res.status})`);
+        return (await res.json()).snippets;
+    }
+    const snippets = {};
+    for (const chatId of chatIds) {
+        const chat = allChats[chatId];
+        if (!chat) continue;
+        const body = await loadChatBody(chat);
+        snippets[chatId] = keywordInContext(body.content, body.messages, await chatHits(chat, body, query, mode));
+    }
+    return snippets;
+};
+
+const chatWithHits = async (chat, query, mode) => {
+    if (searchApi) {
+        const params = new URLSearchParams({ q: query || '', mode: mode || 'word' });
+        const res = await fetch(`api/chats/${chat.id}?${params}`);
+        if (!res.ok) throw new Error(`Could not load chat ${chat.id} (HTTP ${res.status})`);
+        const { content, messages, hits } = await res.json();
+        return { body: { content, messages }, hits };
+    }
+    const body = await loadChatBody(chat);
+    return { body, hits: await chatHits(chat, body, query, mode) };
+};
+
+// --- WORD INDEX (both formats expose postings(term) -> sorted chat IDs) ---
+const openJsonWordIndex = (index) => ({ postings: (term) => index[term] || [] });
+
+// Reads search_index_word.bin (see encode_word_index() in build_database.py). Only the term
+// dictionary is decoded up front; a term's varint-delta posting list is decoded when queried.
+const openBinaryWordIndex = (buffer) => {
+    const view = new DataView(buffer);
+    const bytes = new Uint8Array(buffer);
+    const magic = String.fromCharCode(...bytes.subarray(0, 4));
+    const version = view.getUint32(4, true);
+    if (magic !== 'TSWI' || version !== 1) throw new Error('Unsupported binary word index.');
+    const termCount = view.getUint32(8, true);
+    const dictionaryBytes = view.getUint32(12, true);
+    const dictionaryStart = 20;
+    const terms = termCount ? new TextDecoder().decode(bytes.subarray(dictionaryStart, dictionaryStart + dictionaryBytes)).split('\n') : [];
+    const termIds = new Map(terms.map((term, termId) => [term, termId]));
+    const offsetsStart = dictionaryStart + dictionaryBytes + ((4 - (dictionaryStart + dictionaryBytes) % 4) % 4);
+    const postingsStart = offsetsStart + 4 * (termCount + 1);
+
+    const postings = (term) => {
+        const termId = termIds.get(term);
+        if (termId === undefined) return [];
+        const end = postingsStart + view.getUint32(offsetsStart + 4 * (termId + 1), true);
+        const chatIds = [];
+        let position = postingsStart + view.getUint32(offsetsStart + 4 * termId, true);
+        let previous = 0, value = 0, shift = 0;
+        while (position < end) {
+            const byte = bytes[position++];
+            value += (byte & 0x7f) * 2 ** shift; // Arithmetic rather than bit ops, so large IDs cannot overflow.
+            if (byte & 0x80) { shift += 7; continue; }
+            previous += value;
+            chatIds.push(previous);
+            value = 0; shift = 0;
+        }
+        return chatIds;
+    };
+    return { postings };
+};
+
+// --- TYPO TOLERANCE (mirrors expand_query_terms() in build_database.py) ---
+// search_index_fuzzy.bin is a symmetric-deletion dictionary of the vocabulary (see encode_fuzzy_index()):
+// the terms one edit away from a query term share one of its one-character deletions, so a lookup probes
+// a bucket per deletion instead of scanning the vocabulary. It is only fetched once a term is missing.
+const FUZZY_MIN_LENGTH = 4;      // shorter query terms are never corrected (FUZZY_* in build_database.py)
+const FUZZY_MAX_TERM_LENGTH = 32;
+const FUZZY_MAX_EXPANSIONS = 3;  // the most common terms one edit away that a misspelled term stands for
+// Not indexed, so neither they nor their misspellings are corrected (STOP_WORDS in build_database.py).
+const STOP_WORDS = new Set(['a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'has', 'he', 'in', 'is', 'it', 'its', 'of', 'on', 'that', 'the', 'to', 'was', 'were', 'will', 'with']);
+let fuzzyIndexLoad = null; // Promise of the parsed fuzzy index (or null), once first needed
+
+const CRC_TABLE = (() => {
+    const table = new Uint32Array(256);
+    for (let n = 0; n < 256; n++) {
+        let c = n;
+        for (let k = 0; k < 8; k++) c = c & 1 ? 0xedb88320 ^ (c >>> 1) : c >>> 1;
+        table[n] = c;
+    }
+    return table;
+})();
+const textEncoder = new TextEncoder();
+// CRC-32 of the UTF-8 text, as zlib.crc32() computes it for fuzzy_hash().
+const crc32 = (text) => {
+    let crc = 0xffffffff;
+    for (const byte of textEncoder.encode(text)) crc = CRC_TABLE[(crc ^ byte) & 0xff] ^ (crc >>> 8);
+    return (crc ^ 0xffffffff) >>> 0;
+};
+
+// Terms are compared as arrays of code points, so lengths and deletions line up with the Python build.
+const isFuzzyTerm = (chars, minLength = FUZZY_MIN_LENGTH) =>
+    chars.length >= minLength && chars.length <= FUZZY_MAX_TERM_LENGTH && !chars.some(char => char >= '0' && char <= '9');
+const deletions = (chars) => new Set(chars.map((_, i) => chars.slice(0, i).concat(chars.slice(i + 1)).join('')));
+
+// True if b is a with one character inserted, deleted or substituted, or two adjacent ones swapped.
+const oneEditApart = (a, b) => {
+    if (Math.abs(a.length - b.length) > 1) return false;
+    let i = 0;
+    while (i < a.length && i < b.length && a[i] === b[i]) i++;
+    const rest = (chars, from) => chars.slice(from).join('');
+    if (a.length !== b.length) return rest(a, i + (a.length > b.length ? 1 : 0)) === rest(b, i + (b.length > a.length ? 1 : 0));
+    if (i === a.length) return false; // the same term
+    if (rest(a, i + 1) === rest(b, i + 1)) return true;
+    return i + 1 < a.length && a[i] === b[i + 1] && a[i + 1] === b[i] && rest(a, i + 2) === rest(b, i + 2);
+};
+
+const openFuzzyIndex = (buffer) => {
+    const view = new DataView(buffer);
+    const bytes = new Uint8Array(buffer);
+    const magic = String.fromCharCode(...bytes.subarray(0, 4));
+    if (magic !== 'TSFI' || view.getUint32(4, true) !== 1) throw new Error('Unsupported fuzzy index.');
+    const termCount = view.getUint32(8, true);
+    const dictionaryBytes = view.getUint32(12, true);
+    const bucketCount = view.getUint32(16, true);
+    const terms = termCount ? new TextDecoder().decode(bytes.subarray(20, 20 + dictionaryBytes)).split('\n') : [];
+    const starts = new Uint32Array(bucketCount + 1); // bucket b holds ids[starts[b]] to ids[starts[b + 1] - 1]
+    let position = 20 + dictionaryBytes, value;
+    for (let bucket = 0; bucket < bucketCount; bucket++) {
+        [value, position] = readVarint(bytes, position);
+        starts[bucket + 1] = starts[bucket] + value;
+    }
+    const ids = new Uint32Array(starts[bucketCount]);
+    for (let bucket = 0; bucket < bucketCount; bucket++) {
+        let previous = 0;
+        for (let i = starts[bucket]; i < starts[bucket + 1]; i++) {
+            [value, position] = readVarint(bytes, position);
+            previous += value;
+            ids[i] = previous;
+        }
+    }
+    return { terms, termIds: new Map(terms.map((term, termId) => [term, termId])), starts, ids };
+};
+
+const loadFuzzyIndex = () => {
+    if (!fuzzyIndexLoad) {
+        fuzzyIndexLoad = fetchAsset('search_index_fuzzy.bin')
+            .then(res => (res.ok ? res.arrayBuffer().then(openFuzzyIndex) : null)).catch(() => null);
+    }
+    return fuzzyIndexLoad;
+};
+
+// The vocabulary terms one edit away from term, in sorted order.
+const fuzzyCandidates = (fuzzy, term) => {
+    const chars = Array.from(term);
+    if (fuzzy.terms.length === 0 || !isFuzzyTerm(chars, FUZZY_MIN_LENGTH - 1)) return [];
+    const found = new Set();
+    for (const probe of [...deletions(chars), term]) {
+        if (fuzzy.termIds.has(probe)) found.add(fuzzy.termIds.get(probe));
+        const bucket = crc32(probe) % (fuzzy.starts.length - 1);
+        for (let i = fuzzy.starts[bucket]; i < fuzzy.starts[bucket + 1]; i++) found.add(fuzzy.ids[i]);
+    }
+    return [...found].sort((a, b) => a - b).map(termId => fuzzy.terms[termId])
+        .filter(candidate => oneEditApart(chars, Array.from(candidate)));
+};
+
+// Returns one list of terms per query term: the term itself when the word index has it, else the
+// terms one edit away that occur in the most chats (ties in term order), or the term if there are none.
+const expandTerms = async (terms) => {
+    const wordIndex = await loadWordIndex();
+    const groups = [];
+    for (const term of terms) {
+        const chars = Array.from(term);
+        if (!isFuzzyTerm(chars) || wordIndex.postings(term).length > 0
+            || [...STOP_WORDS].some(stopWord => stopWord === term || oneEditApart(chars, Array.from(stopWord)))) {
+            groups.push([term]);
+            continue;
+        }
+        const fuzzy = await loadFuzzyIndex();
+        const candidates = fuzzy ? fuzzyCandidates(fuzzy, term) : [];
+        const chatCounts = new Map(candidates.map(candidate => [candidate, wordIndex.postings(candidate).length]));
+        candidates.sort((a, b) => chatCounts.get(b) - chatCounts.get(a));
+        groups.push(candidates.length ? candidates.slice(0, FUZZY_MAX_EXPANSIONS) : [term]);
+    }
+    return groups;
+};
+
+// --- RANKING (mirrors rank_bm25() in build_database.py) ---
+// Keeps the k best [score, id] pairs in a min-heap, so common terms never sort every hit.
+const selectTopK = (scores, k) => {
+    const worse = (a, b) => a[0] < b[0] || (a[0] === b[0] && a[1] > b[1]);
+    const heap = [];
+    const siftDown = (i) => {
+        for (;;) {
+            const left = 2 * i + 1, right = left + 1;
+            let worst = i;
+            if (left < heap.length && worse(heap[left], heap[worst])) worst = left;
+            if (right < heap.length && worse(heap[right], heap[worst])) worst = right;
+            if (worst === i) return;
+            [heap[i], heap[worst]] = [heap[worst], heap[i]];
+            i = worst;
+        }
+    };
+    for (const [id, score] of scores) {
+        const entry = [score, id];
+        if (heap.length < k) {
+            heap.push(entry);
+            for (let i = heap.length - 1; i > 0;) {
+                const parent = (i - 1) >> 1;
+                if (!worse(heap[i], heap[parent])) break;
+                [heap[i], heap[parent]] = [heap[parent], heap[i]];
+                i = parent;
+            }
+        } else if (worse(heap[0], entry)) {
+            heap[0] = entry;
+            siftDown(0);
+        }
+    }
+    return heap.sort((a, b) => (worse(a, b) ? 1 : worse(b, a) ? -1 : 0)).map(entry => entry[1]);
+};
+
+const rankBm25 = (terms, matchedIds, wordIndex, ranking) => {
+    const { k1, b, doc_lengths: docLengths, term_frequencies: termFrequencies } = ranking;
+    const avgLength = ranking.avg_doc_length || 1;
+    const scores = new Map();
+    for (const term of new Set(terms)) {
+        const postings = wordIndex.postings(term);
+        const frequencies = termFrequencies[term] || [];
+        const idf = Math.log(1 + (ranking.docCount - postings.length + 0.5) / (postings.length + 0.5));
+        postings.forEach((id, i) => {
+            if (!matchedIds.has(id)) return;
+            const tf = frequencies[i];
+            const norm = tf + k1 * (1 - b + b * docLengths[id] / avgLength);
+            scores.set(id, (scores.get(id) || 0) + idf * tf * (k1 + 1) / norm);
+        });
+    }
+    return selectTopK(scores, RANKED_RESULTS);
+};
+
+// --- PATTERN SEARCH (mirrors pattern_search() in build_database.py) ---
+const queryTrigrams = (query) => {
+    const chars = Array.from(query); // Code points, so trigrams line up with the Python build.
+    const grams = new Set();
+    for (let i = 0; i + 3 <= chars.length; i++) grams.add(chars.slice(i, i + 3).join(''));
+    return [...grams];
+};
+
+const sortedIncludes = (postings, id) => {
+    let low = 0, high = postings.length - 1;
+    while (low <= high) {
+        const mid = (low + high) >> 1;
+        if (postings[mid] === id) return true;
+        if (postings[mid] < id) low = mid + 1; else high = mid - 1;
+    }
+    return false;
+};
+
+const patternCandidates = (query, trigramIndex) => {
+    const postingLists = queryTrigrams(query).map(gram => trigramIndex[gram] || []).sort((a, b) => a.length - b.length);
+    if (postingLists.length === 0) return [];
+    let candidates = postingLists[0];
+    for (const postings of postingLists.slice(1)) {
+        if (candidates.length === 0) break;
+        candidates = candidates.filter(id => sortedIncludes(postings, id));
+    }
+    return candidates;
+};
+
+// Only the chats that survive the trigram filter are confirmed against their content. A chat that holds
+// the query holds every part of it, so the matches of a recent query contained in this one narrow the
+// candidates further (a repeated query is answered from them outright, and typing a longer query only
+// rechecks the previous matches). In the sharded layout candidates are confirmed shard by shard, the
+// shards still in the cache first, so a search fetches each shard once however many candidates it holds.
+// Every PATTERN_YIELD_EVERY candidates the search yields, so that a cancel or a newer query can arrive;
+// it gives up (returning null) as soon as isStale() says its result is no longer wanted. Matches are
+// returned in chat ID order.
+const patternSearch = async (query, isStale) => {
+    if (patternCache.has(query)) {
+        const cached = patternCache.get(query);
+        patternCache.delete(query); // re-inserted as the most recently used
+        patternCache.set(query, cached);
+        return new Set(cached);
+    }
+    const matches = new Set();
+    let candidates = patternCandidates(query, await loadTrigramIndex());
+    const narrower = [...patternCache.keys()].filter(previous => query.includes(previous))
+        .sort((a, b) => patternCache.get(a).size - patternCache.get(b).size)[0];
+    if (narrower !== undefined) candidates = candidates.filter(id => patternCache.get(narrower).has(id));
+    const chats = candidates.map(id => allChats[id]).filter(Boolean);
+    if (chats.length > 0 && chats[0].shard !== undefined) {
+        const cached = new Set(shardCache.keys());
+        const shardKey = (chat) => (cached.has(chat.shard) ? -1 : chat.shard);
+        chats.sort((a, b) => shardKey(a) - shardKey(b) || a.shard - b.shard); // stable: ID order within a shard
+    }
+    for (let i = 0; i < chats.length; i++) {
+        if (i % PATTERN_YIELD_EVERY === 0) {
+            await yieldToMessages();
+            if (isStale()) return null;
+        }
+        const content = await loadChatContent(chats[i]);
+        if (isStale()) return null;
+        if (content && content.toLowerCase().includes(query)) matches.add(chats[i].id);
+    }
+    const result = new Set(candidates.filter(id => matches.has(id)));
+    patternCache.set(query, result);
+    while (patternCache.size > PATTERN_CACHE_SIZE) patternCache.delete(patternCache.keys().next().value);
+    return new Set(result);
+};
+
+// --- LOADING ---
+// Anything but a valid status reply (a 404 from a static server, a network error) means there is no API.
+const detectSearchApi = () => fetch('api/status', { cache: 'no-store' })
+    .then(res => (res.ok ? res.json() : null))
+    .then(status => (status && status.api === 'thortstream' ? status : null))
+    .catch(() => null);
+
+const loadApiCatalog = async () => {
+    const chats = {};
+    for (let offset = 0; offset === 0 || offset < searchApi.chats; offset += API_PAGE_SIZE) {
+        const res = await fetch(`api/chats?offset=${offset}&limit=${API_PAGE_SIZE}`, { cache: 'no-store' });
+        if (!res.ok) throw new Error(`Could not load the chat list (HTTP ${res.status})`);
+        const page = await res.json();
+        for (const chat of page.chats) chats[chat.id] = chat;
+        if (page.chats.length === 0) break;
+    }
+    return chats;
+};
+
+const loadArchive = async () => {
+    searchApi = await detectSearchApi();
+    if (searchApi) {
+        allChats = await loadApiCatalog();
+        return;
+    }
+    // The manifest itself is always revalidated, so a new build is picked up on the next visit.
+    assetManifest = await fetch('asset_manifest.json', { cache: 'no-cache' })
+        .then(res => (res.ok ? res.json() : null)).catch(() => null);
+    // Prefer the lightweight catalog of a sharded build; fall back to the single database.json.
+    const catalogRes = await fetchAsset('catalog.json');
+    const dbRes = catalogRes.ok ? catalogRes : await fetchAsset('database.json');
+    allChats = await dbRes.json();
+    // The chat list does not wait for the search indexes; they load now while the user reads it.
+    for (const load of [loadWordIndex, loadTrigramIndex]) load().catch(() => {});
+};
+
+// Each search index is fetched once, by whichever comes first: its first search or the background load.
+// A failed fetch is forgotten, so the next search tries again (and reports the error if it fails too).
+const loadWordIndex = () => {
+    if (!wordIndexLoad) {
+        // Prefer the compact binary word index when the build produced one.
+        wordIndexLoad = fetchAsset('search_index_word.bin').then(async res => {
+            if (res.ok) return openBinaryWordIndex(await res.arrayBuffer());
+            const jsonRes = await fetchAsset('search_index_word.json');
+            return openJsonWordIndex(await jsonRes.json());
+        });
+        wordIndexLoad.catch(() => { wordIndexLoad = null; });
+    }
+    return wordIndexLoad;
+};
+
+const loadTrigramIndex = () => {
+    if (!trigramIndexLoad) {
+        trigramIndexLoad = fetchAsset('search_index_trigram.json').then(res => res.json());
+        trigramIndexLoad.catch(() => { trigramIndexLoad = null; });
+    }
+    return trigramIndexLoad;
+};
+
+const loadRanking = () => {
+    if (!rankingLoad) {
+        rankingLoad = fetchAsset('search_index_ranking.json').then(res => (res.ok ? res.json() : null)).catch(() => null)
+            .then(ranking => {
+                if (ranking) ranking.docCount = Object.keys(ranking.doc_lengths).length;
+                return ranking;
+            });
+    }
+    return rankingLoad;
+};
+const archiveLoad = loadArchive();
+archiveLoad.catch(() => {}); // Reported through the 'load' request.
+
+// The chat list only needs metadata; content stays in the worker until a chat is opened.
+const chatMetadata = () => {
+    const chats = {};
+    for (const [id, chat] of Object.entries(allChats)) {
+        const { content, messages, ...metadata } = chat;
+        chats[id] = metadata;
+    }
+    return chats;
+};
+
+// --- QUERIES ---
+// ids=1 returns every match in display order; the ranked ones lead, so the reply maps onto the local one.
+const apiQuery = async (query, mode) => {
+    if (queryAbort) queryAbort.abort();
+    queryAbort = new AbortController();
+    const params = new URLSearchParams({ q: query, mode, limit: 1, ids: 1 });
+    const res = await fetch(`api/search?${params}`, { signal: queryAbort.signal });
+    if (!res.ok) throw new Error(`Search failed (HTTP ${res.status})`);
+    const reply = await res.json();
+    return { matchedIds: reply.ids, rankedIds: reply.ranked, corrections: reply.corrections || {} };
+};
+
+const runQuery = async (id, query, mode) => {
+    latestQueryId = id;
+    const isStale = () => id !== latestQueryId || id === cancelledQueryId;
+    let matchedIds = null;
+    let rankedIds = [];
+    let corrections = {};
+
+    await archiveLoad;
+    if (searchApi) {
+        try {
+            ({ matchedIds, rankedIds, corrections } = await apiQuery(query, mode));
+        } catch (error) {
+            if (isStale()) return { type: 'cancelled' }; // aborted by a newer query or a cancel
+            throw error;
+        }
+    } else if (mode === 'pattern') {
+        if (query.length >= 3) matchedIds = await patternSearch(query, isStale);
+    } else {
+        const terms = query.split(/\s+/).filter(term => term.length > 1);
+        if (terms.length > 0) {
+            const wordIndex = await loadWordIndex();
+            const groups = await expandTerms(terms);
+            const idSets = groups.map(group => new Set(group.flatMap(term => wordIndex.postings(term))));
+            matchedIds = idSets.reduce((a, b) => new Set([...a].filter(x => b.has(x))));
+            const ranking = matchedIds.size > 0 ? await loadRanking() : null;
+            if (ranking) rankedIds = rankBm25(groups.flat(), matchedIds, wordIndex, ranking);
+            terms.forEach((term, i) => { if (groups[i].length !== 1 || groups[i][0] !== term) corrections[term] = groups[i]; });
+        }
+    }
+    if (isStale()) return { type: 'cancelled' };
+    return { type: 'results', matchedIds: matchedIds && [...matchedIds], rankedIds, corrections };
+};
+
+self.onmessage = async (event) => {
+    const { type, id } = event.data;
+    if (type === 'cancel') {
+        cancelledQueryId = id;
+        if (id === latestQueryId && queryAbort) queryAbort.abort();
+        return;
+    }
+    let reply;
+    try {
+        if (type === 'load') {
+            await archiveLoad;
+            reply = { type: 'loaded', chats: chatMetadata(), source: searchApi ? 'api' : 'static' };
+        } else if (type === 'query') {
+            reply = await runQuery(id, event.data.query, event.data.mode);
+        } else if (type === 'chat') {
+            await archiveLoad;
+            const chat = allChats[event.data.chatId];
+            reply = chat ? { type: 'chat', ...await chatWithHits(chat, event.data.query, event.data.mode) }
+                : { type: 'chat', body: { content: null, messages: [] }, hits: [] };
+        } else if (type === 'snippets') {
+            await archiveLoad;
+            reply = { type: 'snippets', snippets: await chatSnippets(event.data.query, event.data.mode, event.data.chatIds) };
+        } else {
+            reply = { type: 'error', message: `Unknown request type '${type}'` };
+        }
+    } catch (error) {
+        reply = { type: 'error', message: String(error) };
+    }
+    self.postMessage({ ...reply, id });
+};
@@ -2,44 +2,88 @@
 """
 Filename:   scrape_chat_content.py
 Author:     Simon C, assisted by Dora
-Version:    1.0
-Date:       2025-08-11
+Version:    1.6
+Date:       2026-10-17
 Description:
     A web scraping script using Selenium to download the content of Google
     Gemini chats. It reads a 'chats.json' file for the list of URLs,
     navigates to each, saves the content, and generates a 'chatAnalysis.txt' log.
     It can also run in a targeted mode using 'rescraping_config.json'.
+    Options:
+        --workers N         browser sessions sharing the queue of chats
+        --min-interval S    minimum seconds between page loads, across workers
+        --base-dir DIR      read chats.json and write under another directory
+        --url-template URL  load chats from a local test server such as
+                            utils/fake_chat_server.py
+        --skip-login, --headless
+        --force             also scrape chats that are already saved
+        --trace, --profile-stage SPAN
 """
 
 import os
+import sys
+import re
 import json
 import time
+import hashlib
+import queue
+import argparse
+import threading
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'common'))
+from instrumentation import span, phase, count, count_written, add_trace_arguments, configure_from_args
+from atomic_write import atomic_open, remove_stale_temp_files, TEMP_SUFFIX
+
 # --- CONFIGURATION ---
 BASE_DIR = r'C:\Users\SimonC\theDen\Projects\007 WebApp Scraper\01_assets'
 CHATS_JSON_PATH = os.path.join(BASE_DIR, 'chats.json')
 RESCAPE_CONFIG_PATH = os.path.join(BASE_DIR, 'rescraping_config.json')
 ALL_CHATS_DIR = os.path.join(BASE_DIR, 'allchats')
 LOG_FILE_PATH = os.path.join(BASE_DIR, 'chatAnalysis.txt')
+SCRAPE_STATE_PATH = os.path.join(BASE_DIR, 'scrape_state.json')
+CHAT_FILE_PATTERN = re.compile(r'^(\d+)_.*\.txt$')
+# What analyze_gemini_chats.py counts as messages, and how this script logs a chat's result.
+MESSAGE_MARKERS = [b'## PROMPT ##', b'## RESPONSE ##']
+LOG_HEADER_PATTERN = re.compile(r'--- Analyzing Chat #(\d+)')
+LOG_RESULT_PATTERN = re.compile(r'\[RESULT\] (?:LONG|SHORT) chat detected \((\d+) messages\)')
 
 # Path to your chromedriver executable
 # Download from: https://chromedriver.chromium.org/downloads
 CHROME_DRIVER_PATH = r'C:\path\to\your\chromedriver.exe'
 
+# Page loads across all workers are at least this many seconds apart.
+DEFAULT_MIN_INTERVAL = 2.0
+# A page counts as settled once its message count and text length are unchanged
+# for STABLE_POLLS polls in a row, POLL_INTERVAL seconds apart (or after SETTLE_TIMEOUT).
+POLL_INTERVAL = 0.25
+STABLE_POLLS = 3
+SETTLE_TIMEOUT = 20
+
 # --- SCRIPT ---
 
-def initialize_driver():
+def configure_paths(base_dir):
+    """Points every input and output path at a different base directory."""
+    global BASE_DIR, CHATS_JSON_PATH, RESCAPE_CONFIG_PATH, ALL_CHATS_DIR, LOG_FILE_PATH, SCRAPE_STATE_PATH
+    BASE_DIR = base_dir
+    CHATS_JSON_PATH = os.path.join(BASE_DIR, 'chats.json')
+    RESCAPE_CONFIG_PATH = os.path.join(BASE_DIR, 'rescraping_config.json')
+    ALL_CHATS_DIR = os.path.join(BASE_DIR, 'allchats')
+    LOG_FILE_PATH = os.path.join(BASE_DIR, 'chatAnalysis.txt')
+    SCRAPE_STATE_PATH = os.path.join(BASE_DIR, 'scrape_state.json')
+
+def initialize_driver(headless=False):
     """Initializes and returns a Selenium WebDriver instance."""
     print("[INFO] Initializing WebDriver...")
     service = Service(executable_path=CHROME_DRIVER_PATH)
     options = webdriver.ChromeOptions()
     # Add any options you need, e.g., headless mode
-    # options.add_argument('--headless')
+    if headless:
+        options.add_argument('--headless=new')
     driver = webdriver.Chrome(service=service, options=options)
     return driver
 
@@ -77,68 +121,388 @@ def get_chats_to_scrape():
     with open(CHATS_JSON_PATH, 'r') as f:
         return json.load(f), False
 
-def main():
-    """Main function to orchestrate the scraping process."""
-    driver = initialize_driver()
-    login_to_google(driver)
+def sha256_of_file(filepath):
+    """Returns the SHA-256 hex digest of a file, or None if it cannot be read."""
+    digest = hashlib.sha256()
+    try:
+        with open(filepath, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+    except OSError:
+        return None
+    return digest.hexdigest()
 
-    chats, is_rescraping = get_chats_to_scrape()
-    total_chats = len(chats)
-    print(f"[INFO] Found {total_chats} chats to process.")
+def find_chat_files(chats_dir):
+    """Returns {chat_id: [path, ...]} for every NNN_*.txt file anywhere under chats_dir."""
+    files = {}
+    for root, _, filenames in os.walk(chats_dir):
+        for filename in filenames:
+            match = CHAT_FILE_PATTERN.match(filename)
+            if match: files.setdefault(int(match.group(1)), []).append(os.path.join(root, filename))
+    return files
+
+def logged_message_counts(log_path):
+    """Returns {chat_id: message count} from the last [RESULT] line logged for each chat."""
+    counts, current = {}, None
+    try:
+        with open(log_path, 'r', encoding='utf-8', errors='ignore') as f:
+            for line in f:
+                header = LOG_HEADER_PATTERN.search(line)
+                if header:
+                    current = int(header.group(1))
+                    continue
+                result = LOG_RESULT_PATTERN.search(line)
+                if result and current is not None:
+                    counts[current] = int(result.group(1))
+                    current = None
+    except FileNotFoundError:
+        pass
+    return counts
+
+def count_messages_in_file(filepath):
+    """Counts the message markers in a saved chat file."""
+    with open(filepath, 'rb') as f:
+        data = f.read()
+    return sum(data.count(marker) for marker in MESSAGE_MARKERS)
+
+class ScrapeState:
+    """
+    Per-chat progress stored in scrape_state.json:
+        {"version": 1, "chats": {"<id>": {"status", "scraped_at", "message_count",
+                                          "classification", "path", "size", "sha256"}}}
+    Status is 'in_progress' while a chat is being scraped, then 'done' or 'failed'.
+    Each update is appended as one JSON line to scrape_state.journal, so it
+    survives a crash mid-run without rewriting the whole state; the journal is
+    folded into scrape_state.json when the state is loaded and when it is closed.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.journal_path = os.path.splitext(path)[0] + '.journal'
+        self._lock = threading.Lock()
+        self.chats = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == self.VERSION:
+                self.chats = data.get('chats', {})
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"[WARNING] Could not read scrape state '{path}': {e}. Starting fresh.")
+        self._replay_journal()
+        self._compact()
+        self._journal = open(self.journal_path, 'a', encoding='utf-8')
+
+    def _replay_journal(self):
+        try:
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # a line cut short by a crash
+                    self.chats.setdefault(str(record.pop('id')), {}).update(record)
+        except FileNotFoundError:
+            pass
+
+    def _compact(self):
+        """Writes the whole state to scrape_state.json, then empties the journal."""
+        with atomic_open(self.path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'version': self.VERSION, 'chats': self.chats}, indent=2, sort_keys=True))
+        open(self.journal_path, 'w').close()
+
+    def reconcile(self, chats_dir, log_path):
+        """
+        Matches the state against the chat files under chats_dir by chat ID and
+        content hash, not by the recorded path, so files that were moved between
+        folders (organize_misplaced_files, consolidation) still count. A chat
+        file with no state entry was saved before scrape_state.json existed, by
+        a scraper that could leave it truncated: it is only recorded as done if
+        it holds at least the message count the log at log_path reports for the
+        chat, and is otherwise left to be scraped again.
+        Returns the set of chat IDs whose file is intact.
+        """
+        intact = set()
+        logged_counts, untrusted = None, 0
+        for chat_id, paths in sorted(find_chat_files(chats_dir).items()):
+            entry = self.chats.get(str(chat_id))
+            if entry is None:
+                if logged_counts is None: logged_counts = logged_message_counts(log_path)
+                path = max(paths, key=os.path.getsize)
+                message_count = count_messages_in_file(path)
+                if chat_id not in logged_counts or message_count < logged_counts[chat_id]:
+                    untrusted += 1
+                    continue
+                self.update(chat_id, status='done', path=path, size=os.path.getsize(path),
+                            message_count=message_count, sha256=sha256_of_file(path))
+                intact.add(chat_id)
+                continue
+            if entry.get('status') != 'done': continue
+            for path in paths:
+                if 'size' in entry and os.path.getsize(path) != entry['size']: continue
+                if sha256_of_file(path) == entry.get('sha256'):
+                    if path != entry.get('path'): self.update(chat_id, path=path, size=os.path.getsize(path))
+                    intact.add(chat_id)
+                    break
+        if untrusted:
+            print(f"[INFO] {untrusted} chat files from before scrape_state.json have fewer messages than the log "
+                  f"reports (or no logged result) and will be scraped again.")
+        return intact
+
+    def update(self, chat_id, **fields):
+        with self._lock:
+            self.chats.setdefault(str(chat_id), {}).update(fields)
+            self._journal.write(json.dumps({'id': chat_id, **fields}) + '\n')
+            self._journal.flush()
+
+    def close(self):
+        with self._lock:
+            self._journal.close()
+            self._compact()
+
+class RateLimiter:
+    """Spaces out page loads across all workers: at most one every min_interval seconds."""
+
+    def __init__(self, min_interval):
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._next_slot = time.monotonic()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.min_interval
+        time.sleep(max(0.0, slot - now))
+
+class LogWriter(threading.Thread):
+    """
+    The only thread that touches chatAnalysis.txt. Workers submit a complete
+    block per chat; blocks are appended whole and flushed, so they never
+    interleave and the log stays parseable by analyze_gemini_chats.py.
+    """
+
+    def __init__(self, log_path):
+        super().__init__(name='log-writer', daemon=True)
+        self.log_path = log_path
+        self._blocks = queue.Queue()
+
+    def submit(self, block, console_lines=()):
+        self._blocks.put((block, list(console_lines)))
+
+    def close(self):
+        self._blocks.put(None)
+        self.join()
+
+    def run(self):
+        with open(self.log_path, 'a', encoding='utf-8') as log_file:
+            while True:
+                item = self._blocks.get()
+                if item is None: break
+                block, console_lines = item
+                log_file.write(block)
+                log_file.flush()
+                print(block.strip('\n'))
+                for line in console_lines: print(line)
+
+def wait_for_stable_content(driver, timeout=SETTLE_TIMEOUT):
+    """
+    Waits until the conversation has finished rendering: the number of messages
+    and the length of the page text must stay the same for a few polls in a row.
+    Returns False if the page was still changing when the timeout ran out.
+    """
+    deadline = time.monotonic() + timeout
+    last_snapshot, stable = None, 0
+    while time.monotonic() < deadline:
+        snapshot = (len(driver.find_elements(By.CSS_SELECTOR, '.message-content')),
+                    driver.execute_script("return document.body ? document.body.textContent.length : 0;"))
+        if snapshot == last_snapshot:
+            stable += 1
+            if stable >= STABLE_POLLS: return True
+        else:
+            last_snapshot, stable = snapshot, 0
+        time.sleep(POLL_INTERVAL)
+    return False
+
+def scrape_chat(driver, chat, position, total_chats, is_rescraping, rate_limiter, url_template=None, state=None):
+    """
+    Scrapes one chat and saves it. The page is read once its content has stopped
+    changing, and the file is written to a temporary name and renamed into place,
+    so a crash never leaves a truncated .txt. Returns (log block, extra console
+    lines); the caller hands both to the LogWriter so only one thread writes the log.
+    """
+    chat_id = chat['id']
+    title = chat['title']
+    url = url_template.format(id=chat_id) if url_template else chat['url']
+
+    block = f"\n--- Analyzing Chat #{chat_id} ({position}/{total_chats}): '{title}' ---\n"
+    console_lines = []
+    try:
+        if state: state.update(chat_id, status='in_progress')
+        with phase('rate_limit_wait'):
+            rate_limiter.wait()
+        with phase('page_load'):
+            driver.get(url)
+            # Wait for the main content area to be present
+            WebDriverWait(driver, 15).until(
+                EC.presence_of_element_located((By.CSS_SELECTOR, '.conversation-container'))
+            )
+        with phase('settle'):
+            settled = wait_for_stable_content(driver)
+        if not settled:
+            console_lines.append(f"[WARNING] Chat #{chat_id} was still changing after {SETTLE_TIMEOUT}s; saving what is there.")
+
+        # Simple classification based on message count
+        messages = driver.find_elements(By.CSS_SELECTOR, '.message-content')
+        msg_count = len(messages)
+        classification = 'LONG' if msg_count >= 18 else 'SHORT'
 
-    with open(LOG_FILE_PATH, 'a', encoding='utf-8') as log_file:
-        for i, chat in enumerate(chats):
-            chat_id = chat['id']
-            title = chat['title']
-            url = chat['url']
+        block += f"[RESULT] {classification} chat detected ({msg_count} messages).\n"
 
-            print(f"\n--- Analyzing Chat #{chat_id} ({i+1}/{total_chats}): '{title}' ---")
-            log_file.write(f"\n--- Analyzing Chat #{chat_id} ({i+1}/{total_chats}): '{title}' ---\n")
+        # Define save path based on classification or if re-scraping
+        if is_rescraping:
+            save_dir = os.path.join(ALL_CHATS_DIR, 'rescraped')
+        else:
+            save_dir = os.path.join(ALL_CHATS_DIR, classification)
 
+        os.makedirs(save_dir, exist_ok=True)
+
+        # Sanitize title for filename
+        safe_title = "".join(c for c in title if c.isalnum() or c in (' ', '.', '_')).rstrip()
+        filename = f"{chat_id:03d}_{safe_title}.txt"
+        filepath = os.path.join(save_dir, filename)
+
+        # Extract and save text content
+        with phase('save'):
+            data = driver.find_element(By.TAG_NAME, 'body').text.encode('utf-8')
+            with atomic_open(filepath, 'wb') as f:
+                f.write(data)
+            content_hash = hashlib.sha256(data).hexdigest()
+        count_written(filepath)
+        count(messages=msg_count)
+        if state:
+            state.update(chat_id, status='done', scraped_at=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                         message_count=msg_count, classification=classification,
+                         path=filepath, size=len(data), sha256=content_hash)
+
+        console_lines.append(f"[SUCCESS] Saved chat to '{filepath}'")
+
+    except Exception as e:
+        block += f"[ERROR] Failed to process chat #{chat_id}: {e}\n"
+        if state:
             try:
-                driver.get(url)
-                # Wait for the main content area to be present
-                WebDriverWait(driver, 15).until(
-                    EC.presence_of_element_located((By.CSS_SELECTOR, '.conversation-container'))
-                )
-                time.sleep(2) # Allow content to settle
-
-                # Simple classification based on message count
-                messages = driver.find_elements(By.CSS_SELECTOR, '.message-content')
-                msg_count = len(messages)
-                classification = 'LONG' if msg_count >= 18 else 'SHORT'
-                
-                print(f"[RESULT] {classification} chat detected ({msg_count} messages).")
-                log_file.write(f"[RESULT] {classification} chat detected ({msg_count} messages).\n")
-
-                # Define save path based on classification or if re-scraping
-                if is_rescraping:
-                    save_dir = os.path.join(ALL_CHATS_DIR, 'rescraped')
-                else:
-                    save_dir = os.path.join(ALL_CHATS_DIR, classification)
-                
-                os.makedirs(save_dir, exist_ok=True)
-                
-                # Sanitize title for filename
-                safe_title = "".join(c for c in title if c.isalnum() or c in (' ', '.', '_')).rstrip()
-                filename = f"{chat_id:03d}_{safe_title}.txt"
-                filepath = os.path.join(save_dir, filename)
-
-                # Extract and save text content
-                page_text = driver.find_element(By.TAG_NAME, 'body').text
-                with open(filepath, 'w', encoding='utf-8') as f:
-                    f.write(page_text)
-                
-                print(f"[SUCCESS] Saved chat to '{filepath}'")
-
-            except Exception as e:
-                print(f"[ERROR] Failed to process chat #{chat_id}: {e}")
-                log_file.write(f"[ERROR] Failed to process chat #{chat_id}: {e}\n")
-
-            time.sleep(2) # Be a good citizen
+                state.update(chat_id, status='failed', scraped_at=time.strftime('%Y-%m-%dT%H:%M:%S'))
+            except OSError as save_error:
+                console_lines.append(f"[WARNING] Could not record chat #{chat_id} as failed: {save_error}")
+
+    return block, console_lines
+
+def scrape_worker(driver, chat_queue, total_chats, is_rescraping, rate_limiter, log_writer, url_template, state):
+    """
+    Takes chats off the shared queue until it is empty, scraping each with this
+    worker's driver. Each chat is recorded as a span, with the rate-limit wait,
+    page load, settling and saving timed as its phases.
+    """
+    while True:
+        try:
+            position, chat = chat_queue.get_nowait()
+        except queue.Empty:
+            return
+        with span('scrape_chat', chat_id=chat['id']):
+            block, console_lines = scrape_chat(driver, chat, position, total_chats, is_rescraping, rate_limiter,
+                                               url_template, state)
+        log_writer.submit(block, console_lines)
+
+def select_pending_chats(chats, state, is_rescraping, force=False):
+    """
+    Drops chats whose file is already saved intact under allchats/. A targeted
+    rescrape or --force always scrapes every listed chat.
+    """
+    if force or is_rescraping or state is None:
+        return chats
+    intact = state.reconcile(ALL_CHATS_DIR, LOG_FILE_PATH)
+    pending = [chat for chat in chats if chat['id'] not in intact]
+    skipped = len(chats) - len(pending)
+    if skipped:
+        print(f"[INFO] Skipping {skipped} chats already saved in '{ALL_CHATS_DIR}' (use --force to scrape them again).")
+    return pending
+
+def run_scrape(drivers, chats, is_rescraping, min_interval=DEFAULT_MIN_INTERVAL, url_template=None, state=None):
+    """Scrapes all chats with one worker thread per driver and a single log writer."""
+    total_chats = len(chats)
+    chat_queue = queue.Queue()
+    for i, chat in enumerate(chats):
+        chat_queue.put((i + 1, chat))
+
+    rate_limiter = RateLimiter(min_interval)
+    log_writer = LogWriter(LOG_FILE_PATH)
+    log_writer.start()
+    workers = [
+        threading.Thread(target=scrape_worker, name=f'scraper-{n + 1}',
+                         args=(driver, chat_queue, total_chats, is_rescraping, rate_limiter, log_writer,
+                               url_template, state))
+        for n, driver in enumerate(drivers)
+    ]
+    for worker in workers: worker.start()
+    for worker in workers: worker.join()
+    log_writer.close()
+
+def main():
+    """Main function to orchestrate the scraping process."""
+    parser = argparse.ArgumentParser(description="Scrapes Gemini chats listed in chats.json.")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Number of browser sessions scraping in parallel (default: 1).")
+    parser.add_argument('--min-interval', type=float, default=DEFAULT_MIN_INTERVAL,
+                        help="Minimum seconds between page loads across all workers.")
+    parser.add_argument('--base-dir', help="Read chats.json and write chats and the log under this directory.")
+    parser.add_argument('--url-template',
+                        help="Load chats from this URL instead of their Gemini URL, e.g. 'http://127.0.0.1:8765/app/{id}'.")
+    parser.add_argument('--skip-login', action='store_true', help="Do not stop for the manual Google login.")
+    parser.add_argument('--headless', action='store_true', help="Run the browsers without a window.")
+    parser.add_argument('--force', action='store_true',
+                        help="Scrape every chat again, even those scrape_state.json records as saved.")
+    add_trace_arguments(parser)
+    args = parser.parse_args()
+    configure_from_args('scrape_chat_content', args)
+    if args.base_dir:
+        configure_paths(args.base_dir)
+
+    if os.path.isdir(ALL_CHATS_DIR):
+        # Left by a killed run: atomic_open's temporary files, and the '.part' files of older versions.
+        removed = remove_stale_temp_files(ALL_CHATS_DIR, (TEMP_SUFFIX, '.part'))
+        if removed: print(f"[INFO] Removed {removed} temporary files left by an interrupted run.")
+    state = ScrapeState(SCRAPE_STATE_PATH)
+    try:
+        chats, is_rescraping = get_chats_to_scrape()
+        chats = select_pending_chats(chats, state, is_rescraping, args.force)
+        if not chats:
+            print("[INFO] Every chat is already saved. Nothing to scrape.")
+            return
+        scrape_chats(chats, is_rescraping, args, state)
+    finally:
+        state.close()
 
     print("\n[INFO] Scraping complete.")
-    driver.quit()
+
+def scrape_chats(chats, is_rescraping, args, state):
+    """Starts the browser sessions, logs in and scrapes the chats."""
+    with span('start_browsers'):
+        drivers = [initialize_driver(args.headless) for _ in range(max(1, min(args.workers, len(chats))))]
+    try:
+        if not args.skip_login:
+            with span('login'):
+                for driver in drivers:
+                    login_to_google(driver)
+
+        print(f"[INFO] Found {len(chats)} chats to process with {len(drivers)} browser session(s).")
+        with span('scrape', chats=len(chats), workers=len(drivers)):
+            run_scrape(drivers, chats, is_rescraping, args.min_interval, args.url_template, state)
+    finally:
+        for driver in drivers:
+            driver.quit()
 
 if __name__ == '__main__':
     main()
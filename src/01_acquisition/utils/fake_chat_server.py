@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Filename:   fake_chat_server.py
+Author:     Simon C, assisted by Dora
+Version:    1.0
+Date:       2026-10-17
+Description:
+    A local stand-in for the Gemini web app, used to exercise
+    scrape_chat_content.py without a Google account. Every '/app/<id>' page
+    has a '.conversation-container' that fills with '.message-content' blocks
+    a few at a time, so the scraper's "wait until the page settles" logic is
+    exercised too. It can also write a matching chats.json.
+
+    Example:
+        python src/01_acquisition/utils/fake_chat_server.py --chats 40 --write-chats-json C:\\temp\\fake\\chats.json
+        python src/01_acquisition/scrape_chat_content.py --base-dir C:\\temp\\fake --workers 4 --skip-login --headless
+"""
+
+import os
+import re
+import json
+import random
+import argparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html><head><meta charset="UTF-8"><title>{title}</title></head>
+<body>
+<div class="conversation-container"></div>
+<script>
+    const messages = {messages};
+    const container = document.querySelector('.conversation-container');
+    let next = 0;
+    const renderSome = () => {{
+        for (let i = 0; i < 3 && next < messages.length; i++, next++) {{
+            const div = document.createElement('div');
+            div.className = 'message-content';
+            div.textContent = messages[next];
+            container.appendChild(div);
+        }}
+        if (next < messages.length) setTimeout(renderSome, {step_ms});
+    }};
+    setTimeout(renderSome, {step_ms});
+</script>
+</body></html>
+"""
+
+def fake_messages(chat_id):
+    """Returns a deterministic list of alternating prompt/response texts for a chat."""
+    rng = random.Random(chat_id)
+    words = ['archive', 'dora', 'windows', 'search', 'index', 'chat', 'python', 'browser', 'stream', 'thort']
+    messages = []
+    for turn in range(rng.randint(1, 15)):
+        messages.append("## PROMPT ##\n" + " ".join(rng.choice(words) for _ in range(rng.randint(5, 30))))
+        messages.append("## RESPONSE ##\n" + " ".join(rng.choice(words) for _ in range(rng.randint(20, 200))))
+    return messages
+
+class FakeChatHandler(BaseHTTPRequestHandler):
+    step_ms = 150
+
+    def do_GET(self):
+        match = re.fullmatch(r'/app/(\d+)', self.path)
+        if not match:
+            self.send_error(404)
+            return
+        chat_id = int(match.group(1))
+        body = PAGE_TEMPLATE.format(title=f"Fake chat {chat_id}", messages=json.dumps(fake_messages(chat_id)),
+                                    step_ms=self.step_ms).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def write_chats_json(path, count, port):
+    """Writes a chats.json listing the fake chats served on this port."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    chats = [{'id': i, 'title': f"Fake chat {i}", 'url': f"http://127.0.0.1:{port}/app/{i}"} for i in range(1, count + 1)]
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(chats, f, indent=2)
+    print(f"[INFO] Wrote {count} fake chats to: {path}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Serves fake Gemini conversation pages for scraper testing.")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--chats', type=int, default=20, help="Number of chats listed in the written chats.json.")
+    parser.add_argument('--step-ms', type=int, default=150, help="Delay between rendering batches of messages.")
+    parser.add_argument('--write-chats-json', help="Also write a chats.json for the fake chats to this path.")
+    args = parser.parse_args()
+
+    if args.write_chats_json:
+        write_chats_json(args.write_chats_json, args.chats, args.port)
+    FakeChatHandler.step_ms = args.step_ms
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), FakeChatHandler)
+    print(f"[INFO] Serving fake chats on http://127.0.0.1:{args.port}/app/<id> (Ctrl+C to stop).")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+if __name__ == '__main__':
+    main()
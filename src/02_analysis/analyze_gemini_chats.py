@@ -2,17 +2,35 @@
 """
 Filename:   analyze_gemini_chats.py
 Author:     Simon C, assisted by Dora
-Version:    2.0
-Date:       2025-08-12
+Version:    2.11
+Date:       2026-10-17
 Description:
     Core analysis engine. Reads raw data and logs to produce reports and
     actionable configs. This version is updated for the new project structure.
+    Options:
+        --parallel          count messages on a process pool (--workers N)
+        --reparse-log       ignore the analysis log checkpoint
+        --pack              also update the chat pack the build scripts read
+        --dedup             mark redundant copies of a chat as DUPLICATE
+        --trace, --profile-stage SPAN
 """
 
 import os
+import sys
 import json
 import csv
 import re
+import hashlib
+import argparse
+import copy
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'common'))
+from instrumentation import span, count, count_written, add_trace_arguments, configure_from_args
+from chat_pack import PACK_DIR, update_pack, ChatPack, decode_chat
+from near_duplicates import (chat_signature, find_duplicate_clusters, assign_copies, load_signature_cache,
+                             save_signature_cache)
+from atomic_write import atomic_open
 
 # --- CONFIGURATION (v2.0 - Updated for new project structure) ---
 # This script assumes it is being run from the root of the '009_thortStream' project.
@@ -28,79 +46,330 @@ OUTPUT_CSV_PATH = os.path.join(BASE_DIR, 'output', 'reports', 'chat_analysis_rep
 RESCAPE_CONFIG_PATH = os.path.join(BASE_DIR, 'output', 'configs', 'rescraping_config.json')
 MISPLACED_FILES_REPORT_PATH = os.path.join(BASE_DIR, 'output', 'reports', 'misplaced_files_report.txt')
 
+# Cache Paths
+ANALYSIS_LOG_CHECKPOINT_PATH = os.path.join(BASE_DIR, 'output', 'cache', 'analysis_log_checkpoint.json')
+
 EXPECTED_FILE_EXTENSIONS = ['.html', '.txt']
+SCAN_FOLDERS = ['consolidated', 'Long', 'Short', 'rescraped']
+CHAT_FILE_PATTERN = re.compile(r'^(\d+)_')
+
+# Message markers are counted over fixed-size binary chunks so memory stays bounded on huge files.
+MESSAGE_MARKERS = [b'## PROMPT ##', b'## RESPONSE ##']
+COUNT_CHUNK_SIZE = 1024 * 1024
+
+# Analysis log grammar. A block is a header line, an optional canvas line and a result line.
+LOG_HEADER_PATTERN = re.compile(r'--- Analyzing Chat #(\d+)')
+LOG_RESULT_PATTERN = re.compile(r'\[RESULT\] (LONG|SHORT) chat detected \((\d+) messages\)')
+LOG_CANVAS_LINE = '[DEBUG] Canvas closed.'
+LOG_CHECKPOINT_VERSION = 2
+# The checkpoint remembers a hash of the bytes just before its offset to detect a rewritten log.
+LOG_CHECKPOINT_TAIL_BYTES = 4096
 
 
+def count_markers_in_stream(stream, markers, chunk_size=COUNT_CHUNK_SIZE):
+    """
+    Counts non-overlapping occurrences of each marker in a binary stream, reading
+    it chunk by chunk. The unmatched tail of every chunk is carried into the next
+    one, so markers split across a chunk boundary are still counted exactly once.
+    """
+    counts = [0] * len(markers)
+    tails = [b''] * len(markers)
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk: break
+        for i, marker in enumerate(markers):
+            buffer = tails[i] + chunk
+            position = buffer.find(marker)
+            consumed = 0
+            while position != -1:
+                counts[i] += 1
+                consumed = position + len(marker)
+                position = buffer.find(marker, consumed)
+            tails[i] = buffer[max(consumed, len(buffer) - len(marker) + 1):]
+    return counts
+
 def count_messages_in_file(filepath):
     """Opens a chat file and counts the actual number of messages."""
     try:
-        with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
-            content = f.read()
-        prompts = content.count('## PROMPT ##')
-        responses = content.count('## RESPONSE ##')
-        return prompts + responses
+        with open(filepath, 'rb') as f:
+            return sum(count_markers_in_stream(f, MESSAGE_MARKERS))
     except Exception as e:
         print(f"[ERROR] Could not read or process file {filepath}: {e}")
         return None
 
-def parse_analysis_log(log_path):
-    """Parses the chatAnalysis.txt log file to extract metadata for each chat."""
-    print(f"[INFO] Parsing analysis log: {log_path}")
-    chat_data = {}
+class AnalysisLogParser:
+    """
+    Line-oriented state machine for chatAnalysis.txt. It yields exactly what the
+    previous whole-file regex did, including how it treated headers that the
+    console wrapped over several lines:
+
+        --- Analyzing Chat #<id> ... '<title>' ... ---      (the '---' ends a line)
+        [DEBUG] Canvas closed.                              (optional)
+        [RESULT] <LONG|SHORT> chat detected (<n> messages)
+
+    A block whose header end is not followed by a result (an [ERROR] entry, say)
+    stays open until the next line ending in '---' that is. A block still open
+    at the end of the log is dropped (see finish()). Every line is looked at a
+    bounded number of times, so parsing is linear in the size of the log, and
+    the whole state is JSON-serialisable, which is what makes checkpoints possible.
+    """
+
+    def __init__(self, chat_data=None, pending=None):
+        self.chat_data = chat_data if chat_data is not None else {}
+        # The open block: chat id, title parts, stage and canvas flag.
+        self.pending = pending
+
+    def state(self):
+        """Returns the parser state as plain JSON-compatible data."""
+        return {
+            'chat_data': [[chat_id, entry] for chat_id, entry in self.chat_data.items()],
+            'pending': self.pending
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        """Rebuilds a parser from state()."""
+        chat_data = {int(chat_id): entry for chat_id, entry in state['chat_data']}
+        return cls(chat_data, state['pending'])
+
+    def feed(self, text, terminated=True):
+        """Feeds one line of the log (without its newline; terminated says whether it had one)."""
+        position = 0
+        while True:
+            block = self.pending
+            if block is None:
+                match = LOG_HEADER_PATTERN.search(text, position)
+                if not match: return
+                self.pending = block = {'id': int(match.group(1)), 'stage': 'title_open', 'title': '',
+                                        'canvas': LOG_CANVAS_LINE in text[match.start():]}
+                position = match.end()
+            elif position == 0 and LOG_CANVAS_LINE in text and block['stage'] not in ('after_header', 'after_canvas'):
+                block['canvas'] = True
+
+            stage = block['stage']
+            if stage == 'title_open':
+                quote = text.find("'", position)
+                if quote == -1: return
+                block['stage'], position = 'title', quote + 1
+            elif stage == 'title':
+                quote = text.find("'", position)
+                if quote == -1:
+                    block['title'] += text[position:] + ('\n' if terminated else '')
+                    return
+                block['title'] += text[position:quote]
+                block['stage'], position = 'header_end', quote + 1
+            elif stage == 'header_end':
+                if terminated and text[position:].rstrip().endswith('---'):
+                    block['stage'] = 'after_header'
+                return
+            else:
+                # After a header end only blank lines, one optional canvas line and the result may follow.
+                if not text.strip(): return
+                if (stage == 'after_header' and terminated and text.startswith(LOG_CANVAS_LINE)
+                        and not text[len(LOG_CANVAS_LINE):].strip()):
+                    block['stage'], block['canvas'] = 'after_canvas', True
+                    return
+                match = LOG_RESULT_PATTERN.match(text)
+                if match:
+                    self._emit(block, match)
+                    position = match.end()
+                    continue
+                # Not a result: keep looking for a later header end, starting with this very line.
+                block['stage'] = 'header_end'
+                if LOG_CANVAS_LINE in text: block['canvas'] = True
+
+    def _emit(self, block, match):
+        chat_id = block['id']
+        self.chat_data[chat_id] = {
+            'id': chat_id, 'title_from_log': block['title'],
+            'logged_message_count': int(match.group(2)),
+            'analysis_classification': match.group(1),
+            'canvas_used': block['canvas'],
+            'anomaly_notes': []
+        }
+        self.pending = None
+
+    def finish(self):
+        """
+        Returns the final chat_data; the parser itself is left untouched. The
+        regex retried the search after the start of a block still open at the
+        end of the log, but that can never find one: any later header closes its
+        title at or after the open block did, and from there every header end
+        and result that would complete it completes the open block first. So the
+        open block is simply dropped.
+        """
+        return dict(self.chat_data)
+
+def load_log_checkpoint(checkpoint_path, log_path):
+    """Returns (offset, parser) from a checkpoint that still matches the log, or (0, None)."""
     try:
-        with open(log_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-    except FileNotFoundError:
+        with open(checkpoint_path, 'r', encoding='utf-8') as f:
+            checkpoint = json.load(f)
+        if checkpoint.get('version') != LOG_CHECKPOINT_VERSION or checkpoint.get('log_path') != os.path.abspath(log_path):
+            return 0, None
+        offset = checkpoint['offset']
+        with open(log_path, 'rb') as f:
+            f.seek(max(0, offset - LOG_CHECKPOINT_TAIL_BYTES))
+            tail = f.read(min(offset, LOG_CHECKPOINT_TAIL_BYTES))
+        if len(tail) != min(offset, LOG_CHECKPOINT_TAIL_BYTES) or hashlib.sha256(tail).hexdigest() != checkpoint['tail_sha256']:
+            print("[INFO] Analysis log was rewritten since the last checkpoint. Parsing it from the start.")
+            return 0, None
+        return offset, AnalysisLogParser.from_state(checkpoint['state'])
+    except (FileNotFoundError, json.JSONDecodeError, KeyError, TypeError, ValueError):
+        return 0, None
+
+def save_log_checkpoint(checkpoint_path, log_path, offset, parser):
+    """Records the parser state after the last complete line of the log."""
+    with open(log_path, 'rb') as f:
+        f.seek(max(0, offset - LOG_CHECKPOINT_TAIL_BYTES))
+        tail = f.read(min(offset, LOG_CHECKPOINT_TAIL_BYTES))
+    os.makedirs(os.path.dirname(checkpoint_path), exist_ok=True)
+    with atomic_open(checkpoint_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': LOG_CHECKPOINT_VERSION, 'log_path': os.path.abspath(log_path), 'offset': offset,
+                   'tail_sha256': hashlib.sha256(tail).hexdigest(), 'state': parser.state()}, f)
+
+def parse_analysis_log(log_path, checkpoint_path=None):
+    """
+    Parses the chatAnalysis.txt log file to extract metadata for each chat.
+    With a checkpoint_path, parsing resumes after the bytes an earlier run
+    already parsed, and the checkpoint is moved forward afterwards.
+    """
+    print(f"[INFO] Parsing analysis log: {log_path}")
+    if not os.path.isfile(log_path):
         print(f"[ERROR] Analysis log not found at: {log_path}")
         return {}
-    pattern = re.compile(
-        r"--- Analyzing Chat #(\d+).*?'(.*?)'.*?---\s*\n"
-        r"(?:\[DEBUG\] Canvas closed\.\s*\n)?"
-        r"\[RESULT\] (LONG|SHORT) chat detected \((\d+) messages\)",
-        re.DOTALL
-    )
-    matches = pattern.finditer(content)
-    for match in matches:
-        chat_id = int(match.group(1))
-        chat_data[chat_id] = {
-            'id': chat_id, 'title_from_log': match.group(2),
-            'logged_message_count': int(match.group(4)),
-            'analysis_classification': match.group(3),
-            'canvas_used': "[DEBUG] Canvas closed." in match.group(0),
-            'anomaly_notes': []
-        }
+    offset, parser = load_log_checkpoint(checkpoint_path, log_path) if checkpoint_path else (0, None)
+    if parser is None:
+        offset, parser = 0, AnalysisLogParser()
+    elif offset:
+        print(f"[INFO] Resuming analysis log from byte {offset:,} (checkpoint).")
+    start_offset = offset
+    with open(log_path, 'rb') as f:
+        f.seek(offset)
+        for raw_line in f:
+            terminated = raw_line.endswith(b'\n')
+            if not terminated:
+                # A partial last line (the scraper may still be writing it) is parsed
+                # on a copy, so the checkpoint never includes it.
+                tail_parser = AnalysisLogParser.from_state(json.loads(json.dumps(parser.state())))
+                tail_parser.feed(raw_line.decode('utf-8', errors='replace'), terminated=False)
+                break
+            parser.feed(raw_line.rstrip(b'\r\n').decode('utf-8', errors='replace'))
+            offset += len(raw_line)
+        else:
+            tail_parser = parser
+        count(bytes_read=f.tell() - start_offset, files_read=1)
+    if checkpoint_path:
+        save_log_checkpoint(checkpoint_path, log_path, offset, parser)
+    # Entries are copied so that later stages can annotate them without touching the checkpoint.
+    chat_data = json.loads(json.dumps([[chat_id, entry] for chat_id, entry in tail_parser.finish().items()]))
+    chat_data = {chat_id: entry for chat_id, entry in chat_data}
     print(f"[DEBUG] Parsed {len(chat_data)} entries from analysis log.")
     return chat_data
 
-def scan_and_integrate_files(chat_data, chats_dir):
-    """Scans directories, updates existing chat_data entries, and adds new entries for any "orphan" files."""
+def chat_file_id(filename):
+    """
+    Returns the chat ID of a chat file name ('NNN_title.txt'), or None for any
+    other file: hidden files (atomic_open's temporary files) and extensions
+    outside EXPECTED_FILE_EXTENSIONS never count as a copy of a chat.
+    """
+    if filename.startswith('.') or os.path.splitext(filename)[1].lower() not in EXPECTED_FILE_EXTENSIONS: return None
+    match = CHAT_FILE_PATTERN.match(filename)
+    return int(match.group(1)) if match else None
+
+def scan_chat_copies(chats_dir):
+    """Returns {chat_id: {(folder_name, filename): filesize}} for every chat file in SCAN_FOLDERS, from os.stat sizes."""
+    copies = {}
+    # We will look in the 'consolidated' folder where all chats were moved.
+    for folder_name in SCAN_FOLDERS:
+        folder_path = os.path.join(chats_dir, folder_name)
+        if not os.path.isdir(folder_path): continue
+        with os.scandir(folder_path) as entries:
+            for entry in entries:
+                file_id = chat_file_id(entry.name)
+                if file_id is None: continue
+                copies.setdefault(file_id, {})[(folder_name, entry.name)] = entry.stat().st_size
+    return copies
+
+def pick_winner(chats_dir, copies):
+    """
+    Picks the winning copy of one chat from {(folder_name, filename): filesize}.
+    Copies are visited folder by folder (by name within a folder); a later copy
+    only wins if it is strictly larger. Returns (filesize, folder_name, filename, full_path).
+    """
+    winner = None
+    for folder_name, filename in sorted(copies, key=lambda key: (SCAN_FOLDERS.index(key[0]), key[1])):
+        filesize = copies[(folder_name, filename)]
+        if winner is None or filesize > winner[0]:
+            winner = (filesize, folder_name, filename, os.path.join(chats_dir, folder_name, filename))
+    return winner
+
+def select_chat_files(chats_dir):
+    """
+    Finds the winning file for every chat ID using only os.stat sizes, so only
+    the winners are read and counted afterwards.
+    Returns {chat_id: (filesize, folder_name, filename, full_path)}.
+    """
+    return {file_id: pick_winner(chats_dir, copies) for file_id, copies in scan_chat_copies(chats_dir).items()}
+
+def count_messages_in_files(filepaths, workers=1):
+    """Counts messages in many files, on a process pool when workers > 1. Results keep the input order."""
+    if workers <= 1 or len(filepaths) < 2:
+        return [count_messages_in_file(path) for path in filepaths]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(count_messages_in_file, filepaths, chunksize=max(1, len(filepaths) // (workers * 4))))
+
+def count_messages_with_pack(winners, pack_dir, changed_ids=None):
+    """
+    Brings the chat pack up to date with the winning files and returns their
+    message counts (None for a file that could not be read) from its index.
+    With changed_ids, only those chats are looked at on disk.
+    """
+    with span('update_pack'):
+        stats = update_pack({file_id: (os.path.join(folder_name, filename), path)
+                             for file_id, (_, folder_name, filename, path) in winners.items()}, pack_dir, changed_ids)
+    print(f"[INFO] Chat pack updated: {stats['appended']} files appended ({stats['bytes_appended']:,} bytes), "
+          f"{stats['relinked']} relinked, {stats['unchanged']} unchanged, {stats['removed']} removed.")
+    if 'compacted_bytes' in stats:
+        print(f"[INFO] Chat pack compacted ({stats['compacted_bytes']:,} bytes of replaced copies dropped).")
+    with ChatPack(pack_dir) as pack:
+        return [pack.message_count(file_id) if file_id in pack else None for file_id in winners]
+
+def scan_and_integrate_files(chat_data, chats_dir, workers=1, pack_dir=None):
+    """
+    Scans directories, updates existing chat_data entries, and adds new entries for any "orphan" files.
+    With a pack_dir, messages are counted through the chat pack instead of by reading every file.
+    """
     print(f"[INFO] Scanning and integrating files from: {chats_dir}")
     if not os.path.isdir(chats_dir):
         print(f"[ERROR] '{os.path.basename(chats_dir)}' directory not found.")
         return
-    id_pattern = re.compile(r'^(\d+)_')
-    # We will look in the 'consolidated' folder where all chats were moved.
-    for folder_name in ['consolidated', 'Long', 'Short', 'rescraped']:
-        folder_path = os.path.join(chats_dir, folder_name)
-        if not os.path.isdir(folder_path): continue
-        for filename in os.listdir(folder_path):
-            match = id_pattern.match(filename)
-            if not match: continue
-            file_id = int(match.group(1))
-            full_path = os.path.join(folder_path, filename)
-            new_filesize = os.path.getsize(full_path)
-            if file_id in chat_data:
-                if 'matched_filename' not in chat_data[file_id] or new_filesize > chat_data[file_id].get('filesize', 0):
-                    chat_data[file_id].update({
-                        'filesize': new_filesize, 'actual_folder': folder_name,
-                        'matched_filename': filename, 'actual_message_count': count_messages_in_file(full_path)
-                    })
-            else:
-                chat_data[file_id] = {
-                    'id': file_id, 'filesize': new_filesize, 'actual_folder': folder_name,
-                    'matched_filename': filename, 'actual_message_count': count_messages_in_file(full_path),
-                    'anomaly_notes': ['ORPHAN_FILE: File found on disk but not in analysis log.']
-                }
+    winners = select_chat_files(chats_dir)
+    file_ids = list(winners)
+    if pack_dir:
+        message_counts = count_messages_with_pack(winners, pack_dir)
+    else:
+        if workers > 1:
+            print(f"[INFO] Counting messages in {len(file_ids)} files with {workers} worker processes.")
+        message_counts = count_messages_in_files([winners[file_id][3] for file_id in file_ids], workers)
+        count(files_read=len(file_ids), bytes_read=sum(winner[0] for winner in winners.values()))
+    integrate_winners(chat_data, winners, message_counts)
+
+def integrate_winners(chat_data, winners, message_counts):
+    """Records each winning file and its message count (in winners order) in chat_data; unknown IDs become orphans."""
+    for file_id, message_count in zip(winners, message_counts):
+        filesize, folder_name, filename, _ = winners[file_id]
+        if file_id in chat_data:
+            chat_data[file_id].update({
+                'filesize': filesize, 'actual_folder': folder_name,
+                'matched_filename': filename, 'actual_message_count': message_count
+            })
+        else:
+            chat_data[file_id] = {
+                'id': file_id, 'filesize': filesize, 'actual_folder': folder_name,
+                'matched_filename': filename, 'actual_message_count': message_count,
+                'anomaly_notes': ['ORPHAN_FILE: File found on disk but not in analysis log.']
+            }
 
 def add_json_data(chat_data, json_path):
     """Reads chats.json and adds the canonical title to the chat data."""
@@ -125,15 +394,85 @@ def analyze_anomalies(chat_data):
         if classification and folder and classification != 'N/A' and classification.lower() != folder.lower():
             data.setdefault('anomaly_notes', []).append(f"MISCLASSIFIED: Log says '{classification}' but file is in '{folder}' folder.")
 
+def chat_signatures(chat_data, chats_dir, signature_cache, pack_dir=None):
+    """
+    Returns ({chat_id: (sha256, (shingle count, signature))} for every chat
+    with a file, number of signatures computed). Content hashes come from the
+    chat pack when given; only chats whose content hash is not in
+    signature_cache, {sha256: (shingle count, signature)}, are shingled.
+    """
+    signatures, computed = {}, 0
+    pack = ChatPack(pack_dir) if pack_dir else None
+    try:
+        for chat_id, data in chat_data.items():
+            if 'matched_filename' not in data: continue
+            entry = pack.entry(chat_id) if pack is not None else None
+            raw = None
+            if entry is not None:
+                digest = entry.sha256
+            else:
+                try:
+                    with open(os.path.join(chats_dir, data['actual_folder'], data['matched_filename']), 'rb') as f:
+                        raw = f.read()
+                except OSError:
+                    continue
+                count(bytes_read=len(raw), files_read=1)
+                digest = hashlib.sha256(raw).hexdigest()
+            if digest not in signature_cache:
+                signature_cache[digest] = chat_signature(decode_chat(raw if raw is not None else pack.get(entry)))
+                computed += 1
+            signatures[chat_id] = (digest, signature_cache[digest])
+    finally:
+        if pack is not None: pack.close()
+    count(signatures_computed=computed)
+    return signatures, computed
+
+def find_duplicates(chat_data, chats_dir, pack_dir=None, signature_cache=None):
+    """
+    Groups the chats whose files hold the same or nearly the same conversation
+    and returns {chat_id: anomaly note} for every redundant copy. The chat kept
+    from each group is the one with the most messages, then the largest file,
+    then the lowest ID; only chats that are copies of the kept chat itself
+    (near_duplicates.assign_copies) are marked. The signature cache is read
+    from and saved to disk unless one is passed in.
+    """
+    cache = load_signature_cache() if signature_cache is None else signature_cache
+    signatures, computed = chat_signatures(chat_data, chats_dir, cache, pack_dir)
+    used = {digest for digest, _ in signatures.values()}
+    if computed or used != cache.keys():
+        for digest in cache.keys() - used: del cache[digest]
+        save_signature_cache(cache)
+    def rank(chat_id):
+        return (-(chat_data[chat_id].get('actual_message_count') or 0), -chat_data[chat_id].get('filesize', 0), chat_id)
+    notes, keepers = {}, set()
+    for members in find_duplicate_clusters(signatures):
+        for keeper, chat_id, score in assign_copies(members, signatures, rank):
+            if signatures[chat_id][0] == signatures[keeper][0]: match = "identical file"
+            else: match = f"about {int(score * 100)}% similar"
+            notes[chat_id] = f"DUPLICATE: Redundant copy of chat #{keeper} ({match})."
+            keepers.add(keeper)
+    print(f"[INFO] Checked {len(signatures)} chats for duplicates ({computed} signatures computed): "
+          f"{len(keepers)} groups, {len(notes)} redundant copies.")
+    return notes
+
+def mark_duplicates(chat_data, notes):
+    """Adds the DUPLICATE notes to copies of the entries, so entries shared with a LiveAnalysis stay untouched."""
+    for chat_id, note in notes.items():
+        entry = chat_data[chat_id]
+        chat_data[chat_id] = dict(entry, anomaly_notes=entry.get('anomaly_notes', []) + [note])
+
 def write_reports(chat_data):
-    """Generates all output files (CSV, JSON config, TXT report)."""
+    """
+    Generates all output files (CSV, JSON config, TXT report). Each is written
+    atomically (common/atomic_write.py), so a reader never sees half a CSV.
+    """
     # Ensure output directories exist
     os.makedirs(os.path.dirname(OUTPUT_CSV_PATH), exist_ok=True)
     os.makedirs(os.path.dirname(RESCAPE_CONFIG_PATH), exist_ok=True)
     
     sorted_data = sorted(chat_data.values(), key=lambda x: x['id'])
     header = ['Chat ID', 'Title', 'Logged Msg Count', 'Actual Msg Count', 'Filesize (bytes)', 'Canvas Used', 'Log Classification', 'Actual Folder', 'Matched Filename', 'Anomalies']
-    with open(OUTPUT_CSV_PATH, 'w', newline='', encoding='utf-8') as f:
+    with atomic_open(OUTPUT_CSV_PATH, 'w', newline='', encoding='utf-8') as f:
         writer = csv.writer(f)
         writer.writerow(header)
         for data in sorted_data:
@@ -147,28 +486,159 @@ def write_reports(chat_data):
     print(f"[SUCCESS] Master report generated: {OUTPUT_CSV_PATH}")
 
     missing_ids = sorted([str(d['id']) for d in chat_data.values() if any("MISSING_FILE" in n for n in d.get('anomaly_notes', []))], key=int)
-    with open(RESCAPE_CONFIG_PATH, 'w', encoding='utf-8') as f:
+    with atomic_open(RESCAPE_CONFIG_PATH, 'w', encoding='utf-8') as f:
         json.dump({"automation_mode": "hybrid", "chat_ids_to_scrape": ",".join(missing_ids), "delay_seconds": 3}, f, indent=4)
+    count_written(OUTPUT_CSV_PATH, RESCAPE_CONFIG_PATH)
     print(f"[SUCCESS] Rescrape config generated: {RESCAPE_CONFIG_PATH} ({len(missing_ids)} IDs)")
 
     misplaced_files = [d for d in chat_data.values() if any("MISCLASSIFIED" in n for n in d.get('anomaly_notes', []))]
-    with open(MISPLACED_FILES_REPORT_PATH, 'w', encoding='utf-8') as f:
+    with atomic_open(MISPLACED_FILES_REPORT_PATH, 'w', encoding='utf-8') as f:
         f.write("--- Misplaced Files Report ---\n\n")
         if not misplaced_files:
             f.write("No misclassified files were found.\n")
         else:
             for data in misplaced_files:
                 f.write(f"Move '{data['matched_filename']}' from '{data['actual_folder']}' to '{data['analysis_classification']}'.\n")
+    count_written(MISPLACED_FILES_REPORT_PATH)
     print(f"[SUCCESS] Misplaced files report generated: {MISPLACED_FILES_REPORT_PATH} ({len(misplaced_files)} files)")
 
+class LiveAnalysis:
+    """
+    The analysis kept in memory between changes, for run_pipeline.py --watch.
+    It starts from the same steps as main() (with the chat pack); update()
+    then takes the paths that changed, works out which chat IDs they touch,
+    re-derives just those entries the way a full run would, and rewrites the
+    reports. The reports always match what a fresh full run would write.
+    With dedup, duplicate groups are found again over every chat after each
+    update (from cached signatures, so only changed chats are shingled).
+    """
+
+    def __init__(self, chats_dir=ALL_CHATS_DIR, log_path=ANALYSIS_LOG_PATH, json_path=CHATS_JSON_PATH, pack_dir=PACK_DIR,
+                 dedup=False):
+        self.chats_dir, self.log_path, self.json_path, self.pack_dir = chats_dir, log_path, json_path, pack_dir
+        self.signature_cache = load_signature_cache() if dedup else None
+        self.chat_data = {}
+        self.rescan()
+
+    def rescan(self):
+        """Rebuilds everything from disk (the log is still read from its checkpoint)."""
+        with span('parse_log'):
+            self.log_entries = parse_analysis_log(self.log_path, ANALYSIS_LOG_CHECKPOINT_PATH)
+        with span('scan_files'):
+            self.copies = scan_chat_copies(self.chats_dir) if os.path.isdir(self.chats_dir) else {}
+        self.entries = self.derive(set(self.log_entries) | set(self.copies), full=True)
+        self.chat_data = self.with_duplicates()
+
+    def with_duplicates(self):
+        """Returns the derived entries with the DUPLICATE notes of the current duplicate groups added."""
+        chat_data = dict(self.entries)
+        if self.signature_cache is not None:
+            with span('find_duplicates'):
+                mark_duplicates(chat_data, find_duplicates(chat_data, self.chats_dir, self.pack_dir, self.signature_cache))
+        return chat_data
+
+    def derive(self, chat_ids, full=False):
+        """Builds fresh chat_data entries for chat_ids from the log entries, the file copies and chats.json."""
+        chat_data = {chat_id: copy.deepcopy(self.log_entries[chat_id]) for chat_id in chat_ids if chat_id in self.log_entries}
+        winners = {chat_id: pick_winner(self.chats_dir, self.copies[chat_id])
+                   for chat_id in sorted(chat_ids) if self.copies.get(chat_id)}
+        with span('scan_files'):
+            all_winners = {chat_id: pick_winner(self.chats_dir, copies) for chat_id, copies in self.copies.items() if copies}
+            counts = dict(zip(all_winners, count_messages_with_pack(all_winners, self.pack_dir, None if full else set(winners))))
+            integrate_winners(chat_data, winners, [counts[chat_id] for chat_id in winners])
+        with span('add_json_data'):
+            add_json_data(chat_data, self.json_path)
+        with span('analyze_anomalies'):
+            analyze_anomalies(chat_data)
+        return chat_data
+
+    def changed_chat_ids(self, paths):
+        """Applies the changed paths to the log entries and file copies and returns the chat IDs they affect."""
+        affected = set()
+        paths = {os.path.abspath(path) for path in paths}
+        if os.path.abspath(self.json_path) in paths:
+            affected |= set(self.chat_data)
+        if os.path.abspath(self.log_path) in paths:
+            with span('parse_log'):
+                log_entries = parse_analysis_log(self.log_path, ANALYSIS_LOG_CHECKPOINT_PATH)
+            affected |= {chat_id for chat_id in log_entries.keys() | self.log_entries.keys()
+                         if log_entries.get(chat_id) != self.log_entries.get(chat_id)}
+            self.log_entries = log_entries
+        chats_dir = os.path.abspath(self.chats_dir)
+        for path in paths:
+            parts = os.path.relpath(path, chats_dir).split(os.sep)
+            if len(parts) != 2 or parts[0] not in SCAN_FOLDERS: continue
+            chat_id = chat_file_id(parts[1])
+            if chat_id is None: continue
+            copies = self.copies.setdefault(chat_id, {})
+            try:
+                copies[tuple(parts)] = os.stat(path).st_size
+            except FileNotFoundError:
+                copies.pop(tuple(parts), None)
+            if not copies: del self.copies[chat_id]
+            affected.add(chat_id)
+        return affected
+
+    def update(self, changes):
+        """
+        Takes a batch of changed paths (or RESCAN from file_watcher), brings
+        chat_data up to date and rewrites the reports. Returns the chat IDs
+        whose report rows changed; None means everything may have changed.
+        """
+        if not isinstance(changes, (set, frozenset)):
+            self.rescan()
+            write_reports(self.chat_data)
+            return None
+        affected = self.changed_chat_ids(changes)
+        if not affected: return set()
+        fresh = self.derive(affected)
+        for chat_id in affected:
+            if chat_id in fresh: self.entries[chat_id] = fresh[chat_id]
+            else: self.entries.pop(chat_id, None)
+        chat_data = self.with_duplicates()
+        changed = {chat_id for chat_id in chat_data.keys() | self.chat_data.keys()
+                   if chat_data.get(chat_id) != self.chat_data.get(chat_id)}
+        self.chat_data = chat_data
+        if changed:
+            with span('write_reports'):
+                write_reports(self.chat_data)
+        return changed
+
 def main():
     """Main function to orchestrate the analysis and reporting process."""
+    parser = argparse.ArgumentParser(description="Analyzes the scraped chats and writes the master report.")
+    parser.add_argument('--parallel', action='store_true',
+                        help="Count messages on a process pool instead of one file at a time.")
+    parser.add_argument('--reparse-log', action='store_true',
+                        help="Ignore the analysis log checkpoint and parse the whole log again.")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="Number of worker processes used with --parallel (default: all cores).")
+    parser.add_argument('--dedup', action='store_true',
+                        help="Mark chats that are copies or near-copies of another chat as DUPLICATE; the builders skip them.")
+    parser.add_argument('--pack', action='store_true',
+                        help="Also update the chat pack the build scripts read from (output/cache/chat_pack/); "
+                             "only new or changed files are read. --parallel does not apply.")
+    add_trace_arguments(parser)
+    args = parser.parse_args()
+    configure_from_args('analyze_gemini_chats', args)
+
     print("--- Starting Gemini Chat Analysis ---")
-    chat_data = parse_analysis_log(ANALYSIS_LOG_PATH)
-    scan_and_integrate_files(chat_data, ALL_CHATS_DIR)
-    add_json_data(chat_data, CHATS_JSON_PATH)
-    analyze_anomalies(chat_data)
-    write_reports(chat_data)
+    if args.reparse_log and os.path.exists(ANALYSIS_LOG_CHECKPOINT_PATH):
+        os.remove(ANALYSIS_LOG_CHECKPOINT_PATH)
+    with span('parse_log'):
+        chat_data = parse_analysis_log(ANALYSIS_LOG_PATH, ANALYSIS_LOG_CHECKPOINT_PATH)
+    workers = args.workers if args.parallel else 1
+    with span('scan_files', workers=workers):
+        scan_and_integrate_files(chat_data, ALL_CHATS_DIR, workers=workers, pack_dir=PACK_DIR if args.pack else None)
+    with span('add_json_data'):
+        add_json_data(chat_data, CHATS_JSON_PATH)
+    with span('analyze_anomalies'):
+        analyze_anomalies(chat_data)
+    if args.dedup:
+        with span('find_duplicates'):
+            mark_duplicates(chat_data, find_duplicates(chat_data, ALL_CHATS_DIR, PACK_DIR if args.pack else None))
+    with span('write_reports'):
+        write_reports(chat_data)
     print("--- Analysis Complete ---")
 
 if __name__ == '__main__':
@@ -2,19 +2,60 @@
 """
 Filename:   build_database.py
 Author:     Simon C, assisted by Dora
-Version:    1.1
-Date:       2025-08-12
+Version:    2.10
+Date:       2026-10-17
 Aim:        Generates the JSON data files required by the thortStream SPA.
             This script reads the master CSV report and all chat content,
-            then outputs the consolidated database and search indexes.
+            then outputs the consolidated database and search indexes
+            (word, trigram, positions, fuzzy and BM25 ranking), and publishes
+            content-hashed, precompressed copies of them under public/assets/.
+            Options:
+                --incremental       only re-process chats added, changed or
+                                    deleted since the previous build
+                --layout sharded    catalog.json plus lazily loaded content
+                                    shards instead of one database.json
+                --word-index-format binary
+                                    the word index as search_index_word.bin
+                --streaming         a full build in bounded memory
+                                    (--max-postings sets the spill size)
+                --self-test         check pattern search, positions and the
+                                    fuzzy index against linear scans
+                --no-pack           read chats from their files, not the pack
+                --keep-duplicates   also build chats marked DUPLICATE
+                --trace, --profile-stage SPAN
 Precursor:  Evolved from the 'build_website_content.py' script after the
             project architecture was refactored to a Single-Page Application.
 """
 
 import os
+import sys
 import csv
 import re
 import json
+import bisect
+import time
+import struct
+import heapq
+import math
+import hashlib
+import glob
+import gzip
+import shutil
+import argparse
+import io
+import zlib
+from collections import Counter
+from operator import itemgetter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'common'))
+from instrumentation import span, phase, count, count_written, add_trace_arguments, configure_from_args
+from chat_pack import open_chat_pack, decode_chat
+from atomic_write import atomic_open
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 # --- CONFIGURATION ---
 BASE_DIR = os.getcwd()
@@ -22,85 +63,1509 @@ BASE_DIR = os.getcwd()
 # Input Paths
 CSV_REPORT_PATH = os.path.join(BASE_DIR, 'output', 'reports', 'chat_analysis_report.csv')
 ALL_CHATS_DIR = os.path.join(BASE_DIR, 'data', 'allchats')
+# Anomaly that analyze_gemini_chats.py --dedup gives a redundant copy of another chat.
+DUPLICATE_ANOMALY = 'DUPLICATE:'
 
 # Output Path (directly into the live website folder)
 WEBSITE_DATA_DIR = os.path.join(BASE_DIR, 'public')
 
+# Build manifest used by incremental mode (kept out of 'public' so it is never served)
+MANIFEST_PATH = os.path.join(BASE_DIR, 'output', 'cache', 'build_manifest.json')
+# Bump this whenever tokenization or the output layout changes; an old manifest then forces a full rebuild.
+MANIFEST_VERSION = 7
+
+# Output layouts: 'single' writes one database.json with all content; 'sharded' writes
+# catalog.json (list view metadata) plus shards/<n>.json holding the chat contents.
+OUTPUT_LAYOUTS = ['single', 'sharded']
+SHARD_DIR_NAME = 'shards'
+# Chats are packed in ID order into shards of roughly this many bytes of content.
+# A single chat larger than this gets a shard of its own.
+SHARD_MAX_BYTES = 512 * 1024
+
+# Word index formats: 'json' writes search_index_word.json; 'binary' writes search_index_word.bin
+# (see encode_word_index() for the layout), which search_worker.js queries without parsing every list.
+WORD_INDEX_FORMATS = ['json', 'binary']
+WORD_INDEX_MAGIC = b'TSWI'
+WORD_INDEX_VERSION = 1
+WORD_INDEX_HEADER = struct.Struct('<4sIIII')  # magic, version, term count, dictionary bytes, postings bytes
+
+STOP_WORDS = set(['a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'has', 'he', 'in', 'is', 'it', 'its', 'of', 'on', 'that', 'the', 'to', 'was', 'were', 'will', 'with'])
+TOKEN_PATTERN = re.compile(r'\b\w{2,}\b')
+# Characters outside the BMP: each is two UTF-16 code units, every other character one.
+ASTRAL_PATTERN = re.compile('[\U00010000-\U0010ffff]')
+# Pattern search needs at least one full trigram; shorter queries match every chat (as in search_worker.js).
+TRIGRAM_LENGTH = 3
+
+# Typo tolerance: search_index_fuzzy.bin is a symmetric-deletion dictionary over the word index
+# vocabulary (see encode_fuzzy_index()). A query term of FUZZY_MIN_LENGTH or more characters that is
+# not in the word index is expanded to the (at most FUZZY_MAX_EXPANSIONS) most common terms one edit
+# away. Terms with digits are never corrected. The same constants are in search_worker.js.
+FUZZY_FILE_NAME = 'search_index_fuzzy.bin'
+FUZZY_MAGIC = b'TSFI'
+FUZZY_VERSION = 1
+FUZZY_HEADER = struct.Struct('<4sIIII')  # magic, version, term count, dictionary bytes, bucket count
+FUZZY_MIN_LENGTH = 4
+FUZZY_MAX_TERM_LENGTH = 32
+FUZZY_MAX_EXPANSIONS = 3
+FUZZY_BUCKET_LOAD = 4  # deletions per hash bucket, on average
+
+# Message markers written by the scraper, and the role each one starts.
+MESSAGE_MARKERS = {'## PROMPT ##': 'prompt', '## RESPONSE ##': 'response'}
+# The characters JavaScript's String.prototype.trim() removes, so message bounds match what the SPA used to show.
+JS_WHITESPACE = frozenset('\t\n\v\f\r \u00a0\u1680\u2000\u2001\u2002\u2003\u2004\u2005\u2006\u2007\u2008'
+                          '\u2009\u200a\u2028\u2029\u202f\u205f\u3000\ufeff')
+
+# Positional postings: per chat, per term, the (message number, UTF-16 offset within the message) of
+# every occurrence (see encode_positions_block()). Chat blocks are followed by a table of chat IDs and
+# block offsets and a fixed-size footer, so a positions file is written in a single pass.
+POSITIONS_FILE_NAME = 'search_index_positions.bin'
+POSITIONS_MAGIC = b'TSPI'
+POSITIONS_VERSION = 1
+POSITIONS_FOOTER = struct.Struct('<II4sI')  # table offset, chat count, magic, version
+# Characters of context on either side of the hit in a keyword-in-context snippet (SNIPPET_CONTEXT in search_worker.js).
+SNIPPET_CONTEXT = 60
+
+# BM25 parameters shared with search_worker.js (written into search_index_ranking.json) and the number
+# of top-ranked chats that are selected with a heap instead of sorting every hit.
+BM25_K1 = 1.2
+BM25_B = 0.75
+BM25_TOP_K = 50
+
+# Content-hashed copies of the data files (never change, so they can be cached forever) and the
+# manifest that maps each logical name, e.g. 'catalog.json', to its current hashed copy.
+ASSET_DIR_NAME = 'assets'
+ASSET_MANIFEST_NAME = 'asset_manifest.json'
+ASSET_HASH_LENGTH = 16
+DATA_FILE_NAMES = ['database.json', 'catalog.json', 'search_index_word.json', 'search_index_word.bin',
+                   'search_index_trigram.json', 'search_index_ranking.json', POSITIONS_FILE_NAME, FUZZY_FILE_NAME]
+# Brotli quality 9 gets most of quality 11's ratio in a fraction of the time on the large JSON files.
+BROTLI_QUALITY = 9
+# Files are hashed and compressed in chunks of this size, so publishing never holds a whole file.
+PUBLISH_CHUNK_SIZE = 1024 * 1024
+
+# Streaming builds (--streaming) buffer at most this many postings per index before spilling
+# a sorted run to RUN_DIR; the runs are merged into the final index files at the end.
+STREAM_MAX_POSTINGS = 1000000
+RUN_DIR = os.path.join(BASE_DIR, 'output', 'cache', 'build_runs')
+
 def read_csv_data(filepath):
     """Reads the master CSV report into a list of dictionaries."""
     print(f"[INFO] Reading master report from: {filepath}")
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            return [row for row in csv.DictReader(f)]
+        with span('read_csv'), open(filepath, 'r', encoding='utf-8') as f:
+            rows = [row for row in csv.DictReader(f)]
+            count(bytes_read=f.tell(), files_read=1)
+            return rows
     except FileNotFoundError:
         print(f"[FATAL] Master CSV report not found at '{filepath}'. Cannot continue.")
         print("[INFO] Please run the analysis script first: python src/02_analysis/analyze_gemini_chats.py")
         return None
 
-def create_database_and_indexes(chat_data, output_dir):
+def token_counts(lower_content):
+    """Returns {token: term frequency} for the indexable tokens of an already lowercased text, sorted by token."""
+    counts = Counter(token for token in TOKEN_PATTERN.findall(lower_content) if token not in STOP_WORDS)
+    return dict(sorted(counts.items()))
+
+def trigrams(lower_content):
+    """Returns the set of character trigrams in an already lowercased text."""
+    return set(map(''.join, zip(*(lower_content[i:] for i in range(TRIGRAM_LENGTH)))))
+
+def add_posting(index, key, chat_id):
+    """Adds chat_id to the sorted posting list of key."""
+    bisect.insort(index.setdefault(key, []), chat_id)
+
+def remove_posting(index, key, chat_id):
+    """Removes chat_id from the sorted posting list of key, dropping the key once it is empty."""
+    postings = index.get(key)
+    if not postings: return
+    position = bisect.bisect_left(postings, chat_id)
+    if position < len(postings) and postings[position] == chat_id:
+        del postings[position]
+    if not postings: del index[key]
+
+def intersect_postings(posting_lists):
+    """Intersects sorted posting lists, probing the longer lists with binary search."""
+    if not posting_lists: return []
+    posting_lists = sorted(posting_lists, key=len)
+    result = posting_lists[0]
+    for postings in posting_lists[1:]:
+        if not result: break
+        kept = []
+        for chat_id in result:
+            position = bisect.bisect_left(postings, chat_id)
+            if position < len(postings) and postings[position] == chat_id: kept.append(chat_id)
+        result = kept
+    return list(result)
+
+def build_ranking(word_index, manifest_files):
     """
-    Creates three JSON files: database.json, search_index_word.json,
-    and search_index_full_text.json.
+    Builds the BM25 side table for the word index: document lengths (indexed
+    tokens per chat) and, per term, the term frequencies aligned with its
+    posting list. Everything comes from the manifest, so no chat is re-read.
     """
-    print("[INFO] Creating JSON database and search indexes...")
-    database = {}
-    word_index = {}
-    full_text_index = {}
-    stop_words = set(['a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'has', 'he', 'in', 'is', 'it', 'its', 'of', 'on', 'that', 'the', 'to', 'was', 'were', 'will', 'with'])
-    
+    doc_lengths = {chat_id: sum(entry['tokens'].values()) for chat_id, entry in manifest_files.items()}
+    term_frequencies = {term: [manifest_files[chat_id]['tokens'][term] for chat_id in postings]
+                        for term, postings in word_index.items()}
+    return {
+        'k1': BM25_K1, 'b': BM25_B,
+        'avg_doc_length': sum(doc_lengths.values()) / len(doc_lengths) if doc_lengths else 0,
+        'doc_lengths': doc_lengths,
+        'term_frequencies': term_frequencies
+    }
+
+def rank_bm25(word_index, ranking, terms, top_k=BM25_TOP_K):
+    """
+    Python twin of the SPA's ranked word search. Chats must contain every term
+    (as in the boolean search); they are scored with BM25 and the top_k best
+    are returned as [(chat_id, score)], best first, ties broken by lower ID.
+    A term may also be a list of alternatives (a corrected term's expansions, see
+    expand_query_terms()): chats then need one of them, and each one scores.
+    """
+    groups = [[term] if isinstance(term, str) else term for term in terms]
+    groups = [[term for term in group if len(term) > 1] for group in groups]
+    groups = [group for group in groups if group]
+    if not groups: return []
+    doc_count = len(ranking['doc_lengths'])
+    avg_length = ranking['avg_doc_length'] or 1
+    k1, b = ranking['k1'], ranking['b']
+    matched = set(intersect_postings([sorted(set().union(*[word_index.get(term, []) for term in group]))
+                                      for group in groups]))
+    scores = {}
+    for term in {term for group in groups for term in group}:
+        postings = word_index.get(term, [])
+        frequencies = ranking['term_frequencies'].get(term, [])
+        idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+        for chat_id, tf in zip(postings, frequencies):
+            if chat_id not in matched: continue
+            length = ranking['doc_lengths'][chat_id]
+            scores[chat_id] = scores.get(chat_id, 0) + idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / avg_length))
+    return heapq.nlargest(top_k, scores.items(), key=lambda item: (item[1], -item[0]))
+
+def pattern_search(trigram_index, texts, query):
+    """
+    Python twin of the SPA's Pattern Search. Returns the sorted IDs of chats whose
+    lowercased content contains the lowercased query. Candidates come from the
+    trigram index; only those are confirmed against texts (chat ID -> content).
+    """
+    query = query.lower().strip()
+    if len(query) < TRIGRAM_LENGTH: return sorted(texts)
+    candidates = intersect_postings([trigram_index.get(gram, []) for gram in trigrams(query)])
+    return [chat_id for chat_id in candidates if chat_id in texts and query in texts[chat_id].lower()]
+
+def self_test_pattern_search(trigram_index, database, sample_size=25):
+    """Checks pattern_search() against a linear scan for substrings sampled from the corpus."""
+    texts = {chat_id: record['content'] for chat_id, record in database.items()}
+    queries = ['zzqx no such pattern', 'ab']
+    for chat_id in sorted(texts)[::max(1, len(texts) // sample_size)]:
+        text = texts[chat_id]
+        middle = len(text) // 2
+        queries.append(text[middle:middle + 7])
+        queries.append(database[chat_id]['title'][:5])
+    failures = 0
+    for query in queries:
+        expected = sorted(chat_id for chat_id, text in texts.items() if len(query.strip()) < TRIGRAM_LENGTH
+                          or query.lower().strip() in text.lower())
+        if pattern_search(trigram_index, texts, query) != expected:
+            failures += 1
+            print(f"[ERROR] Pattern search self-test mismatch for query {query!r}.")
+    if failures:
+        print(f"[ERROR] Pattern search self-test failed ({failures}/{len(queries)} queries).")
+    else:
+        print(f"[SUCCESS] Pattern search self-test passed ({len(queries)} queries).")
+    return failures == 0
+
+def encode_varint(value, out):
+    """Appends value to the bytearray out as an unsigned LEB128 varint."""
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def decode_varints(data, start, end):
+    """Decodes the unsigned LEB128 varints in data[start:end]."""
+    values, value, shift = [], 0, 0
+    for byte in data[start:end]:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(value)
+            value, shift = 0, 0
+    return values
+
+def encode_word_index(word_index):
+    """
+    Encodes a word index (token -> sorted chat IDs) into the binary posting format:
+
+        header      magic 'TSWI', version, term count, dictionary bytes, postings bytes (5 x little-endian uint32)
+        dictionary  the terms in sorted order, UTF-8, separated by '\n'; a term's position is its term ID
+        padding     zero bytes up to a multiple of 4
+        offsets     (term count + 1) little-endian uint32 byte offsets into the postings blob
+        postings    per term, its chat IDs as varint deltas (the first ID is stored as-is)
+    """
+    terms = sorted(word_index)
+    offsets, postings = [0], bytearray()
+    for term in terms:
+        encode_posting_list(word_index[term], postings)
+        offsets.append(len(postings))
+    return encode_word_index_head(terms, offsets) + bytes(postings)
+
+def encode_posting_list(chat_ids, out):
+    """Appends a sorted posting list to out as varint deltas."""
+    previous = 0
+    for chat_id in chat_ids:
+        encode_varint(chat_id - previous, out)
+        previous = chat_id
+
+def encode_word_index_head(terms, offsets):
+    """Returns everything of an encoded word index that precedes the postings blob."""
+    dictionary = '\n'.join(terms).encode('utf-8')
+    padding = b'\0' * (-(WORD_INDEX_HEADER.size + len(dictionary)) % 4)
+    header = WORD_INDEX_HEADER.pack(WORD_INDEX_MAGIC, WORD_INDEX_VERSION, len(terms), len(dictionary), offsets[-1])
+    return header + dictionary + padding + struct.pack(f'<{len(offsets)}I', *offsets)
+
+def read_word_index_dictionary(data):
+    """
+    Parses the header and term dictionary of an encoded word index. Returns
+    (term -> term ID, offsets, postings start) without decoding any posting list.
+    """
+    magic, version, term_count, dictionary_bytes, _ = WORD_INDEX_HEADER.unpack_from(data)
+    if magic != WORD_INDEX_MAGIC or version != WORD_INDEX_VERSION:
+        raise ValueError("Not a thortStream binary word index (or an unsupported version).")
+    start = WORD_INDEX_HEADER.size
+    dictionary = bytes(data[start:start + dictionary_bytes]).decode('utf-8')
+    term_ids = {term: term_id for term_id, term in enumerate(dictionary.split('\n'))} if term_count else {}
+    offsets_start = start + dictionary_bytes + (-(start + dictionary_bytes) % 4)
+    offsets = struct.unpack_from(f'<{term_count + 1}I', data, offsets_start)
+    return term_ids, offsets, offsets_start + 4 * (term_count + 1)
+
+def lookup_word_postings(data, dictionary, term):
+    """Decodes the posting list of a single term from an encoded word index."""
+    term_ids, offsets, postings_start = dictionary
+    term_id = term_ids.get(term)
+    if term_id is None: return []
+    chat_ids, previous = [], 0
+    for delta in decode_varints(data, postings_start + offsets[term_id], postings_start + offsets[term_id + 1]):
+        previous += delta
+        chat_ids.append(previous)
+    return chat_ids
+
+def decode_word_index(data):
+    """Decodes a complete binary word index back into a dict of token -> sorted chat IDs."""
+    dictionary = read_word_index_dictionary(data)
+    return {term: lookup_word_postings(data, dictionary, term) for term in dictionary[0]}
+
+def report_word_index_formats(word_index, encoded):
+    """Prints the size and load-time difference between the JSON and binary word index."""
+    json_bytes = json.dumps(word_index, sort_keys=True).encode('utf-8')
+    started = time.perf_counter()
+    json.loads(json_bytes)
+    json_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    read_word_index_dictionary(encoded)
+    binary_seconds = time.perf_counter() - started
+    print(f"[INFO] Word index size: JSON {len(json_bytes):,} bytes, binary {len(encoded):,} bytes "
+          f"({len(encoded) / max(1, len(json_bytes)):.0%} of JSON).")
+    print(f"[INFO] Word index load time: JSON parse {json_seconds * 1000:.1f} ms, "
+          f"binary dictionary {binary_seconds * 1000:.1f} ms (postings are decoded per query).")
+
+def is_fuzzy_term(term, min_length=FUZZY_MIN_LENGTH):
+    """Returns True if term may be corrected (as a query term) or suggested (as a vocabulary term)."""
+    return min_length <= len(term) <= FUZZY_MAX_TERM_LENGTH and not re.search(r'[0-9]', term)
+
+def fuzzy_deletions(term):
+    """Returns the distinct strings made by deleting one character of term."""
+    return {term[:i] + term[i + 1:] for i in range(len(term))}
+
+def fuzzy_hash(text):
+    """CRC-32 of the UTF-8 text; crc32() in search_worker.js computes the same."""
+    return zlib.crc32(text.encode('utf-8'))
+
+def encode_fuzzy_index(terms):
+    """
+    Encodes the symmetric-deletion dictionary of a vocabulary. Every term of 3 to
+    FUZZY_MAX_TERM_LENGTH characters without digits is listed, and each of its
+    one-character deletions is hashed into a bucket that holds the term's ID.
+    Terms one edit away from a query share a deletion with it, are a deletion of it,
+    or have it as a deletion, so a lookup probes a handful of buckets instead of
+    scanning the vocabulary. Layout:
+
+        header      magic 'TSFI', version, term count, dictionary bytes, bucket count (5 x little-endian uint32)
+        dictionary  the terms in sorted order, UTF-8, separated by '\n'; a term's position is its term ID
+        sizes       per bucket, the number of term IDs in it (varints)
+        buckets     per bucket, its sorted term IDs as varint deltas (the first ID is stored as-is)
+
+    A deletion's bucket is fuzzy_hash(deletion) % bucket count.
+    """
+    terms = sorted(term for term in terms if is_fuzzy_term(term, FUZZY_MIN_LENGTH - 1))
+    deletions = [(fuzzy_hash(deletion), term_id) for term_id, term in enumerate(terms) for deletion in fuzzy_deletions(term)]
+    bucket_count = max(1, len(deletions) // FUZZY_BUCKET_LOAD)
+    buckets = [set() for _ in range(bucket_count)]
+    for digest, term_id in deletions: buckets[digest % bucket_count].add(term_id)
+    sizes, ids = bytearray(), bytearray()
+    for bucket in buckets:
+        encode_varint(len(bucket), sizes)
+        encode_posting_list(sorted(bucket), ids)
+    dictionary = '\n'.join(terms).encode('utf-8')
+    return FUZZY_HEADER.pack(FUZZY_MAGIC, FUZZY_VERSION, len(terms), len(dictionary), bucket_count) + \
+        dictionary + bytes(sizes) + bytes(ids)
+
+def read_fuzzy_index(data):
+    """
+    Decodes an encoded symmetric-deletion dictionary into (terms, term -> term ID,
+    bucket starts, term IDs): bucket b holds term IDs[bucket starts[b]:bucket starts[b + 1]].
+    """
+    magic, version, term_count, dictionary_bytes, bucket_count = FUZZY_HEADER.unpack_from(data)
+    if magic != FUZZY_MAGIC or version != FUZZY_VERSION:
+        raise ValueError("Not a thortStream fuzzy index (or an unsupported version).")
+    start = FUZZY_HEADER.size
+    terms = bytes(data[start:start + dictionary_bytes]).decode('utf-8').split('\n') if term_count else []
+    values = decode_varints(data, start + dictionary_bytes, len(data))
+    starts, ids = [0], []
+    for size in values[:bucket_count]: starts.append(starts[-1] + size)
+    for bucket in range(bucket_count):
+        previous = 0
+        for delta in values[bucket_count + starts[bucket]:bucket_count + starts[bucket + 1]]:
+            previous += delta
+            ids.append(previous)
+    return terms, {term: term_id for term_id, term in enumerate(terms)}, starts, ids
+
+def one_edit_apart(a, b):
+    """
+    Returns True if b is a with exactly one character inserted, deleted or
+    substituted, or two adjacent characters swapped (oneEditApart() in search_worker.js).
+    """
+    if a == b or abs(len(a) - len(b)) > 1: return False
+    i = 0
+    while i < len(a) and i < len(b) and a[i] == b[i]: i += 1
+    if len(a) != len(b): return a[i + (len(a) > len(b)):] == b[i + (len(b) > len(a)):]
+    if a[i + 1:] == b[i + 1:]: return True
+    return i + 1 < len(a) and a[i] == b[i + 1] and a[i + 1] == b[i] and a[i + 2:] == b[i + 2:]
+
+def fuzzy_candidates(fuzzy, term):
+    """Returns the sorted vocabulary terms one edit (see one_edit_apart()) away from term."""
+    terms, term_ids, starts, ids = fuzzy
+    bucket_count = len(starts) - 1
+    if not terms or not is_fuzzy_term(term, FUZZY_MIN_LENGTH - 1): return []
+    found = set()
+    for probe in fuzzy_deletions(term) | {term}:
+        if probe in term_ids: found.add(term_ids[probe])
+        bucket = fuzzy_hash(probe) % bucket_count
+        found.update(ids[starts[bucket]:starts[bucket + 1]])
+    return sorted(terms[term_id] for term_id in found if one_edit_apart(term, terms[term_id]))
+
+def expand_query_terms(terms, word_index, fuzzy):
+    """
+    Python twin of expandTerms() in search_worker.js. Returns one list of terms per
+    query term: the term itself if the word index has it (or it may not be
+    corrected), else the FUZZY_MAX_EXPANSIONS terms one edit away that occur in the
+    most chats (ties by term), or the term itself if there are none. A misspelled
+    stop word is left alone: what was meant is not indexed.
+    """
+    groups = []
+    for term in terms:
+        if fuzzy is None or not is_fuzzy_term(term) or word_index.get(term) or \
+                any(term == stop_word or one_edit_apart(term, stop_word) for stop_word in STOP_WORDS):
+            groups.append([term])
+            continue
+        candidates = sorted(fuzzy_candidates(fuzzy, term), key=lambda candidate: -len(word_index.get(candidate, [])))
+        groups.append(candidates[:FUZZY_MAX_EXPANSIONS] or [term])
+    return groups
+
+def write_fuzzy_index(output_dir, terms):
+    """Writes the symmetric-deletion dictionary of the vocabulary and reports its size."""
+    fuzzy_path = os.path.join(output_dir, FUZZY_FILE_NAME)
+    encoded = encode_fuzzy_index(terms)
+    write_if_changed(fuzzy_path, encoded)
+    count_written(fuzzy_path)
+    print(f"[INFO] Fuzzy index size: {len(encoded):,} bytes "
+          f"({FUZZY_HEADER.unpack_from(encoded)[2]:,} terms).")
+
+def self_test_fuzzy(output_dir, word_index, sample_size=25):
+    """Checks fuzzy_candidates() against a scan of the vocabulary for typos made from sampled terms."""
+    with open(os.path.join(output_dir, FUZZY_FILE_NAME), 'rb') as f: fuzzy = read_fuzzy_index(f.read())
+    vocabulary = [term for term in sorted(word_index) if is_fuzzy_term(term, FUZZY_MIN_LENGTH - 1)]
+    queries = ['zzqxv']
+    for term in [term for term in vocabulary if is_fuzzy_term(term)][::max(1, len(vocabulary) // sample_size)]:
+        middle = len(term) // 2
+        queries += [term[:middle] + term[middle + 1:], term[:middle] + 'q' + term[middle:],
+                    term[:middle - 1] + term[middle] + term[middle - 1] + term[middle + 1:], term[:middle] + 'x' + term[middle + 1:]]
+    failures = 0
+    for query in queries:
+        expected = [term for term in vocabulary if one_edit_apart(query, term)]
+        if fuzzy_candidates(fuzzy, query) != expected:
+            failures += 1
+            print(f"[ERROR] Fuzzy index self-test mismatch for query {query!r}.")
+    if failures:
+        print(f"[ERROR] Fuzzy index self-test failed ({failures}/{len(queries)} queries).")
+    else:
+        print(f"[SUCCESS] Fuzzy index self-test passed ({len(queries)} queries).")
+    return failures == 0
+
+def read_chat_file(filepath):
+    """
+    Reads a chat file and returns (content, sha256 hex digest). The content is
+    decoded exactly as a text-mode read with errors='ignore' would produce it.
+    """
+    with open(filepath, 'rb') as f:
+        raw = f.read()
+    count(bytes_read=len(raw), files_read=1)
+    return decode_chat(raw), hashlib.sha256(raw).hexdigest()
+
+def read_chat(chat_id, rel_path, stat, pack=None):
+    """
+    read_chat_file() for a chat of the report. When the chat pack holds exactly
+    the file that stat describes, the content is decoded straight from the
+    pack's memory map and the digest recorded in the pack is returned.
+    """
+    entry = pack.current(chat_id, rel_path, stat) if pack is not None else None
+    if entry is None:
+        return read_chat_file(os.path.join(ALL_CHATS_DIR, rel_path))
+    raw = pack.get(entry)
+    count(bytes_read=len(raw), pack_reads=1)
+    return decode_chat(raw), entry.sha256
+
+def segment_messages(content):
+    """
+    Splits chat text into messages in one left-to-right pass over the marker
+    positions. Returns [(role, start, end)] with code point offsets of the
+    trimmed message text; text before the first marker is not a message.
+    """
+    bounds = []
+    position = content.find('## ')
+    while position != -1:
+        for marker, role in MESSAGE_MARKERS.items():
+            if content.startswith(marker, position):
+                bounds.append((role, position, position + len(marker)))
+                position += len(marker)
+                break
+        else:
+            position += 1
+        position = content.find('## ', position)
+
+    messages = []
+    for i, (role, _, start) in enumerate(bounds):
+        end = bounds[i + 1][1] if i + 1 < len(bounds) else len(content)
+        while start < end and content[start] in JS_WHITESPACE: start += 1
+        while end > start and content[end - 1] in JS_WHITESPACE: end -= 1
+        messages.append((role, start, end))
+    return messages
+
+def message_records(content, messages):
+    """
+    Converts segment_messages() output into database records whose offsets count
+    UTF-16 code units, so that content.slice(start, end) is exact in JavaScript.
+    """
+    records = []
+    last_index, last_unit = 0, 0
+    for role, start, end in messages:
+        start_unit = last_unit + len(content[last_index:start].encode('utf-16-le')) // 2
+        end_unit = start_unit + len(content[start:end].encode('utf-16-le')) // 2
+        records.append({'role': role, 'start': start_unit, 'end': end_unit})
+        last_index, last_unit = end, end_unit
+    return records
+
+def chat_metadata(chat):
+    """Returns the fields of a chat's database record that come from its CSV row."""
+    return {
+        'title': chat.get('Title', 'Untitled'),
+        'msg_count': int(chat.get('Actual Msg Count', 0)),
+        'filesize': int(chat.get('Filesize (bytes)', 0))
+    }
+
+def chat_record(chat, chat_id, content, segments=None):
+    """Builds the database.json record for one chat from its CSV row (segments: segment_messages(content), if known)."""
+    return {
+        'id': chat_id,
+        **chat_metadata(chat),
+        'content': content,
+        'messages': message_records(content, segment_messages(content) if segments is None else segments)
+    }
+
+def utf16_length(text):
+    """Returns the length of text in UTF-16 code units, i.e. its JavaScript string length."""
+    return len(text) if text.isascii() else len(text.encode('utf-16-le')) // 2
+
+def utf16_slice(content, start, end):
+    """Returns content.slice(start, end) as JavaScript computes it, for offsets in UTF-16 code units."""
+    if content.isascii(): return content[start:end]
+    return content.encode('utf-16-le')[2 * start:2 * end].decode('utf-16-le', errors='ignore')
+
+def token_positions(content, segments):
+    """
+    Returns {term: [(message number, offset)]} for every indexed token inside the
+    messages of a chat (segments: segment_messages() output). Offsets count UTF-16
+    code units from the start of the message, like the message records.
+    """
+    positions = {}
+    for number, (_, start, end) in enumerate(segments):
+        text = content[start:end]
+        ascii_text = text.isascii()
+        last_index, last_unit = 0, 0
+        for match in TOKEN_PATTERN.finditer(text):
+            term = match.group().lower()
+            if term in STOP_WORDS: continue
+            if ascii_text:
+                unit = match.start()
+            else:
+                unit = last_unit + utf16_length(text[last_index:match.start()])
+                last_index, last_unit = match.start(), unit
+            positions.setdefault(term, []).append((number, unit))
+    return positions
+
+def tokenize_chat(content, segments):
+    """
+    Tokenizes a chat in one pass and returns (lowercased content, token_counts(),
+    token_positions()). The lowercased text is matched message by message for
+    the positions, and between the messages (the text before the first one and
+    the markers) for the tokens that only count. No token crosses a message
+    edge, and lowercasing never changes whether a character is a word
+    character, so this finds exactly the tokens of both functions, unless
+    lowercasing changed the text's length ('\u0130'): that falls back to them.
+    UTF-16 offsets only differ from code point offsets after characters outside
+    the BMP, so those are located once instead of measuring every token.
+    """
+    lower_content = content.lower()
+    if len(lower_content) != len(content):
+        return lower_content, token_counts(lower_content), token_positions(content, segments)
+    astral = [match.start() for match in ASTRAL_PATTERN.finditer(content)] if not content.isascii() else []
+    counts, positions, previous_end = Counter(), {}, 0
+    for number, (_, start, end) in enumerate(segments):
+        counts.update(token for token in TOKEN_PATTERN.findall(lower_content, previous_end, start) if token not in STOP_WORDS)
+        previous_end = end
+        first_astral = bisect.bisect_left(astral, start) if astral else 0
+        for match in TOKEN_PATTERN.finditer(lower_content, start, end):
+            term = match.group()
+            if term in STOP_WORDS: continue
+            offset = match.start() - start
+            if astral: offset += bisect.bisect_left(astral, match.start()) - first_astral
+            positions.setdefault(term, []).append((number, offset))
+    counts.update(token for token in TOKEN_PATTERN.findall(lower_content, previous_end) if token not in STOP_WORDS)
+    for term, occurrences in positions.items(): counts[term] += len(occurrences)
+    return lower_content, dict(sorted(counts.items())), positions
+
+def encode_positions_block(positions):
+    """
+    Encodes one chat's positional postings as varints: the term count, then per
+    term (in sorted order) its UTF-8 length and bytes, its occurrence count and
+    each occurrence as (message delta, offset), where the offset is relative to
+    the previous occurrence when both are in the same message.
+    """
+    out = bytearray()
+    encode_varint(len(positions), out)
+    for term in sorted(positions):
+        encoded = term.encode('utf-8')
+        encode_varint(len(encoded), out)
+        out += encoded
+        occurrences = positions[term]
+        encode_varint(len(occurrences), out)
+        previous_message, previous_offset = 0, 0
+        for message, offset in occurrences:
+            encode_varint(message - previous_message, out)
+            encode_varint(offset - previous_offset if message == previous_message else offset, out)
+            previous_message, previous_offset = message, offset
+    return bytes(out)
+
+def read_varint(data, position):
+    """Decodes the varint at data[position]; returns (value, position after it)."""
+    value, shift = 0, 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80: return value, position
+        shift += 7
+
+def decode_positions_block(data, start=0, terms=None):
+    """Decodes the positions block at data[start] into {term: [(message, offset)]}, only for terms if given."""
+    positions = {}
+    term_count, position = read_varint(data, start)
+    for _ in range(term_count):
+        if terms is not None and len(positions) == len(terms): break
+        length, position = read_varint(data, position)
+        term = bytes(data[position:position + length]).decode('utf-8')
+        position += length
+        occurrence_count, position = read_varint(data, position)
+        wanted = terms is None or term in terms
+        occurrences, message, offset = [], 0, 0
+        for _ in range(occurrence_count):
+            message_delta, position = read_varint(data, position)
+            value, position = read_varint(data, position)
+            if not wanted: continue
+            offset = offset + value if message_delta == 0 else value
+            message += message_delta
+            occurrences.append((message, offset))
+        if wanted: positions[term] = occurrences
+    return positions
+
+def self_test_positions(output_dir, database, layout, sample_size=25):
+    """
+    Checks the written positions files against the chat text: every sampled
+    occurrence must point at its term, and each message must have exactly as
+    many occurrences as it has indexed tokens.
+    """
+    if layout == 'sharded':
+        blocks = {}
+        for path in glob.glob(os.path.join(output_dir, SHARD_DIR_NAME, '*.bin')):
+            with open(path, 'rb') as f: blocks.update(read_positions_blocks(f.read()))
+    else:
+        with open(os.path.join(output_dir, POSITIONS_FILE_NAME), 'rb') as f: blocks = read_positions_blocks(f.read())
+    failures, checked = 0, 0
+    for chat_id in sorted(database)[::max(1, len(database) // sample_size)]:
+        record = database[chat_id]
+        content, messages = record['content'], record['messages']
+        positions = decode_positions_block(blocks.get(chat_id, b'\0'))
+        texts = [utf16_slice(content, message['start'], message['end']) for message in messages]
+        expected = [sum(1 for match in TOKEN_PATTERN.finditer(text) if match.group().lower() not in STOP_WORDS)
+                    for text in texts]
+        found = [0] * len(messages)
+        for term, occurrences in positions.items():
+            for number, offset in occurrences:
+                if utf16_slice(texts[number], offset, offset + utf16_length(term)).lower() != term:
+                    failures += 1
+                    print(f"[ERROR] Positions self-test: chat {chat_id} has '{term}' at message {number + 1}, offset {offset}.")
+                found[number] += 1
+        if found != expected:
+            failures += 1
+            print(f"[ERROR] Positions self-test: chat {chat_id} has {sum(found)} occurrences, expected {sum(expected)}.")
+        checked += 1
+    if failures:
+        print(f"[ERROR] Positions self-test failed ({failures} problems in {checked} chats).")
+    else:
+        print(f"[SUCCESS] Positions self-test passed ({checked} chats).")
+    return failures == 0
+
+class PositionsWriter:
+    """
+    Writes a positions file to the binary file object f: each chat's block as it is
+    added, then on finish() the table of (chat ID, block offset) pairs in the order
+    the blocks were added, and the footer (table offset, chat count, magic, version).
+    """
+
+    def __init__(self, f):
+        self.f, self.table, self.offset = f, [], 0
+
+    def add(self, chat_id, block):
+        self.f.write(block)
+        self.table += [chat_id, self.offset]
+        self.offset += len(block)
+
+    def finish(self):
+        self.f.write(struct.pack(f'<{len(self.table)}I', *self.table))
+        self.f.write(POSITIONS_FOOTER.pack(self.offset, len(self.table) // 2, POSITIONS_MAGIC, POSITIONS_VERSION))
+
+def read_positions_table(data):
+    """Parses the footer and table of a positions file. Returns {chat ID: (block start, block end)}."""
+    if len(data) < POSITIONS_FOOTER.size: raise ValueError("Positions file is truncated.")
+    table_offset, chat_count, magic, version = POSITIONS_FOOTER.unpack_from(data, len(data) - POSITIONS_FOOTER.size)
+    if magic != POSITIONS_MAGIC or version != POSITIONS_VERSION:
+        raise ValueError("Not a thortStream positions file (or an unsupported version).")
+    entries = struct.unpack_from(f'<{2 * chat_count}I', data, table_offset)
+    starts = entries[1::2]
+    return {chat_id: (start, end) for chat_id, start, end in zip(entries[0::2], starts, starts[1:] + (table_offset,))}
+
+def read_positions_blocks(data):
+    """Splits a positions file into {chat ID: encoded block}."""
+    return {chat_id: bytes(data[start:end]) for chat_id, (start, end) in read_positions_table(data).items()}
+
+def chat_hits(content, messages, positions, query, mode='word'):
+    """
+    Python twin of chatHits() in search_worker.js. Returns the hits of a query in
+    one chat in reading order, as [(message number, start, end, term)] with UTF-16
+    offsets into the content (messages are the database records). Word hits come
+    from the positional postings (positions: {term: [(message, offset)]}); pattern
+    hits from finding the lowercased query in each lowercased message.
+    """
+    hits = []
+    if mode == 'pattern':
+        if not query: return hits
+        for number, message in enumerate(messages):
+            text = utf16_slice(content, message['start'], message['end']).lower()
+            index = text.find(query)
+            while index != -1:
+                start = message['start'] + utf16_length(text[:index])
+                hits.append((number, start, start + utf16_length(query), query))
+                index = text.find(query, index + len(query))
+    else:
+        for term in dict.fromkeys(term for term in query.split() if len(term) > 1):
+            for number, offset in positions.get(term, []):
+                start = messages[number]['start'] + offset
+                hits.append((number, start, start + utf16_length(term), term))
+    return sorted(hits)
+
+def keyword_in_context(content, messages, hits, context=SNIPPET_CONTEXT):
+    """
+    Python twin of keywordInContext() in search_worker.js. Picks the message with
+    the most distinct hit terms (the earliest on a tie) and returns its first hit
+    with up to context characters either side, clipped to the message, as
+    {'message', 'before', 'match', 'after'}; None if there are no hits.
+    """
+    if not hits: return None
+    terms_by_message = {}
+    for number, _, _, term in hits: terms_by_message.setdefault(number, set()).add(term)
+    best = min(terms_by_message, key=lambda number: (-len(terms_by_message[number]), number))
+    number, start, end, _ = next(hit for hit in hits if hit[0] == best)
+    message = messages[number]
+    before_start, after_end = max(message['start'], start - context), min(message['end'], end + context)
+    return {
+        'message': number,
+        'before': ('\u2026' if before_start > message['start'] else '') + utf16_slice(content, before_start, start),
+        'match': utf16_slice(content, start, end),
+        'after': utf16_slice(content, end, after_end) + ('\u2026' if after_end < message['end'] else '')
+    }
+
+def iter_valid_chats(chat_data):
+    """Yields (chat_id, relative_path, chat) for every CSV row that points at a file."""
     for chat in chat_data:
         chat_id_str = chat.get('Chat ID')
         filename = chat.get('Matched Filename')
         folder = chat.get('Actual Folder')
-        
         if not all([chat_id_str, filename, folder]): continue
-        chat_id = int(chat_id_str)
+        yield int(chat_id_str), os.path.join(folder, filename), chat
 
-        try:
-            filepath = os.path.join(ALL_CHATS_DIR, folder, filename)
-            with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
-                content = f.read()
-            
-            database[chat_id] = {
-                'id': chat_id,
-                'title': chat.get('Title', 'Untitled'),
-                'msg_count': int(chat.get('Actual Msg Count', 0)),
-                'filesize': int(chat.get('Filesize (bytes)', 0)),
-                'content': content
-            }
-
-            lower_content = content.lower()
-            full_text_index[chat_id] = lower_content
-
-            tokens = set(re.findall(r'\b\w{2,}\b', lower_content)) - stop_words
-            for token in tokens:
-                if token not in word_index: word_index[token] = []
-                word_index[token].append(chat_id)
+def skip_redundant_copies(chat_data):
+    """Drops the report rows that analyze_gemini_chats.py --dedup marked as redundant copies of another chat."""
+    kept = [chat for chat in chat_data if DUPLICATE_ANOMALY not in (chat.get('Anomalies') or '')]
+    if len(kept) < len(chat_data):
+        print(f"[INFO] Skipping {len(chat_data) - len(kept)} chats marked as redundant copies of another chat.")
+    return kept
 
-        except FileNotFoundError:
-            print(f"[WARNING] File not found while building database, skipping: {filepath}")
-            continue
+def load_manifest(manifest_path):
+    """Loads the previous build manifest, or returns None if it is missing or stale."""
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if manifest.get('version') != MANIFEST_VERSION:
+        print(f"[INFO] Build manifest is from an older builder version, ignoring it.")
+        return None
+    manifest['files'] = {int(chat_id): entry for chat_id, entry in manifest.get('files', {}).items()}
+    return manifest
+
+def save_manifest(manifest_path, files, layout, word_index_format):
+    """Writes the per-file manifest describing the build that was just produced."""
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    with span('save_manifest'):
+        with atomic_open(manifest_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'version': MANIFEST_VERSION, 'layout': layout, 'word_index_format': word_index_format,
+                                'files': files}))
+        count_written(manifest_path)
+
+def write_if_changed(filepath, text):
+    """Writes text (or bytes) to filepath unless the file already holds exactly that."""
+    mode = 'b' if isinstance(text, bytes) else ''
+    try:
+        with open(filepath, 'r' + mode) as f:
+            if f.read() == text: return False
+    except FileNotFoundError:
+        pass
+    with atomic_open(filepath, 'w' + mode) as f: f.write(text)
+    count_written(filepath)
+    return True
+
+def remove_if_exists(path):
+    """Removes a stale output file left behind by a different layout."""
+    if os.path.isfile(path): os.remove(path)
+
+def load_previous_outputs(output_dir, manifest):
+    """
+    Loads the database, indexes and positions blocks written by the build a
+    manifest describes, or returns None if any of them is missing.
+    """
+    try:
+        positions = {}
+        if manifest.get('layout') == 'sharded':
+            with open(os.path.join(output_dir, 'catalog.json'), 'r') as f: database = json.load(f)
+            shards = {}
+            for record in database.values():
+                number = record.pop('shard')
+                if number not in shards:
+                    with open(os.path.join(output_dir, SHARD_DIR_NAME, f"{number}.json"), 'r') as f:
+                        shards[number] = json.load(f)
+                    with open(os.path.join(output_dir, SHARD_DIR_NAME, f"{number}.bin"), 'rb') as f:
+                        positions.update(read_positions_blocks(f.read()))
+                record.update(shards[number][str(record['id'])])
+        else:
+            with open(os.path.join(output_dir, 'database.json'), 'r') as f: database = json.load(f)
+            with open(os.path.join(output_dir, POSITIONS_FILE_NAME), 'rb') as f: positions = read_positions_blocks(f.read())
+        if manifest.get('word_index_format') == 'binary':
+            with open(os.path.join(output_dir, 'search_index_word.bin'), 'rb') as f: word_index = decode_word_index(f.read())
+        else:
+            with open(os.path.join(output_dir, 'search_index_word.json'), 'r') as f: word_index = json.load(f)
+        with open(os.path.join(output_dir, 'search_index_trigram.json'), 'r') as f: trigram_index = json.load(f)
+    except (FileNotFoundError, KeyError, ValueError, struct.error):
+        return None
+    database = {int(chat_id): record for chat_id, record in database.items()}
+    return database, word_index, trigram_index, positions
+
+class DatabaseWriter:
+    """
+    Writes chat records one at a time in either layout. In the single layout each
+    record goes straight into database.json; in the sharded layout chats are packed
+    in order into shards of about SHARD_MAX_BYTES of content, and each shard is
+    written as soon as it is full. Only the catalog (metadata without content) is
+    kept until close(), which also removes the files of the other layout.
+    Each chat's positions block goes to search_index_positions.bin, or to the
+    shards/<n>.bin file that accompanies its content shard.
+    """
+
+    def __init__(self, output_dir, layout):
+        self.output_dir, self.layout = output_dir, layout
+        self.shard_dir = os.path.join(output_dir, SHARD_DIR_NAME)
+        self.records = 0
+        if layout == 'sharded':
+            os.makedirs(self.shard_dir, exist_ok=True)
+            self.catalog, self.shard, self.shard_bytes = {}, {}, 0
+            self.shard_count, self.rewritten = 0, 0
+            self.shard_positions = PositionsWriter(io.BytesIO())
+        else:
+            self.path = os.path.join(output_dir, 'database.json')
+            self.file = open(self.path + '.tmp', 'w')
+            self.file.write('{')
+            self.positions_path = os.path.join(output_dir, POSITIONS_FILE_NAME)
+            self.positions_file = open(self.positions_path + '.tmp', 'wb')
+            self.positions = PositionsWriter(self.positions_file)
+
+    def add(self, chat_id, record, positions_block):
+        if self.layout == 'sharded':
+            content = record['content']
+            size = len(content.encode('utf-8'))
+            if self.shard and self.shard_bytes + size > SHARD_MAX_BYTES:
+                self.flush_shard()
+            self.shard[chat_id] = {'content': content, 'messages': record['messages']}
+            self.shard_positions.add(chat_id, positions_block)
+            self.shard_bytes += size
+            self.catalog[chat_id] = {key: value for key, value in record.items() if key not in ('content', 'messages')}
+            self.catalog[chat_id]['shard'] = self.shard_count
+        else:
+            # Exactly what json.dump(database, f) writes, one record at a time.
+            self.file.write((', ' if self.records else '') + json.dumps(str(chat_id)) + ': ' + json.dumps(record))
+            self.positions.add(chat_id, positions_block)
+        self.records += 1
+
+    def flush_shard(self):
+        self.rewritten += write_if_changed(os.path.join(self.shard_dir, f"{self.shard_count}.json"), json.dumps(self.shard))
+        self.shard_positions.finish()
+        write_if_changed(os.path.join(self.shard_dir, f"{self.shard_count}.bin"), self.shard_positions.f.getvalue())
+        self.shard_positions = PositionsWriter(io.BytesIO())
+        self.shard_count += 1
+        self.shard, self.shard_bytes = {}, 0
 
-    # Ensure the output directory exists
+    def close(self):
+        if self.layout == 'sharded':
+            if self.shard: self.flush_shard()
+            for stale in glob.glob(os.path.join(self.shard_dir, '*.json')) + glob.glob(os.path.join(self.shard_dir, '*.bin')):
+                name = os.path.splitext(os.path.basename(stale))[0]
+                if not name.isdigit() or int(name) >= self.shard_count: os.remove(stale)
+            catalog_path = os.path.join(self.output_dir, 'catalog.json')
+            with atomic_open(catalog_path, 'w') as f: f.write(json.dumps(self.catalog))
+            count_written(catalog_path)
+            remove_if_exists(os.path.join(self.output_dir, 'database.json'))
+            remove_if_exists(os.path.join(self.output_dir, POSITIONS_FILE_NAME))
+            print(f"[INFO] Wrote catalog.json and {self.shard_count} content shards ({self.rewritten} rewritten).")
+        else:
+            self.file.write('}')
+            self.file.close()
+            self.positions.finish()
+            self.positions_file.close()
+            os.replace(self.path + '.tmp', self.path)
+            os.replace(self.positions_path + '.tmp', self.positions_path)
+            count_written(self.path, self.positions_path)
+            remove_if_exists(os.path.join(self.output_dir, 'catalog.json'))
+            for stale in glob.glob(os.path.join(self.shard_dir, '*.json')) + glob.glob(os.path.join(self.shard_dir, '*.bin')):
+                os.remove(stale)
+            if os.path.isdir(self.shard_dir) and not os.listdir(self.shard_dir): os.rmdir(self.shard_dir)
+
+def write_database(output_dir, database, positions, layout):
+    """Writes the chat database and positions blocks in the requested layout and removes files of the other layout."""
+    writer = DatabaseWriter(output_dir, layout)
+    for chat_id, record in database.items():
+        writer.add(chat_id, record, positions[chat_id])
+    writer.close()
+
+def write_word_index(output_dir, word_index, word_index_format):
+    """Writes the word index in the requested format and removes the file of the other format."""
+    json_path = os.path.join(output_dir, 'search_index_word.json')
+    binary_path = os.path.join(output_dir, 'search_index_word.bin')
+    if word_index_format == 'binary':
+        encoded = encode_word_index(word_index)
+        with atomic_open(binary_path, 'wb') as f: f.write(encoded)
+        count_written(binary_path)
+        remove_if_exists(json_path)
+        report_word_index_formats(word_index, encoded)
+    else:
+        with atomic_open(json_path, 'w') as f: f.write(json.dumps(word_index, sort_keys=True))
+        count_written(json_path)
+        remove_if_exists(binary_path)
+
+def hashed_asset_name(name, digest):
+    """Returns the content-hashed asset path for a data file, e.g. 'assets/shards/0.<hash>.json'."""
+    stem, extension = os.path.splitext(name)
+    return f"{ASSET_DIR_NAME}/{stem}.{digest[:ASSET_HASH_LENGTH]}{extension}"
+
+def sha256_of_file(filepath):
+    """Returns the SHA-256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(PUBLISH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+            count(bytes_read=len(chunk))
+    count(files_read=1)
+    return digest.hexdigest()
+
+def copy_with_variants(source_path, asset_path):
+    """
+    Copies a file to asset_path next to its .gz (and .br) variants in one chunked
+    pass. The plain copy is renamed into place last: its presence means the variants exist.
+    """
+    temp_path = asset_path + '.tmp'
+    with open(source_path, 'rb') as source, open(temp_path, 'wb') as plain, \
+            open(asset_path + '.gz', 'wb') as gz_file, \
+            gzip.GzipFile(filename='', mode='wb', fileobj=gz_file, compresslevel=9, mtime=0) as gz:
+        br_file = open(asset_path + '.br', 'wb') if brotli is not None else None
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY) if brotli is not None else None
+        for chunk in iter(lambda: source.read(PUBLISH_CHUNK_SIZE), b''):
+            plain.write(chunk)
+            gz.write(chunk)
+            if br_file: br_file.write(compressor.process(chunk))
+        if br_file:
+            br_file.write(compressor.finish())
+            br_file.close()
+    os.replace(temp_path, asset_path)
+
+def publish_assets(output_dir):
+    """
+    Publishes every data file under a content-hashed name with .gz (and .br) variants
+    and writes asset_manifest.json. Assets whose hash already exists are not
+    recompressed, and an existing asset is never rewritten, which is why
+    search_api.py memory-maps these copies rather than the plain files. The
+    manifest is written before anything is removed, and the assets of the
+    previous generation (recorded in the manifest as 'previous') are kept until
+    the next build, so a page that loaded the old manifest can still fetch what
+    it names; older assets are removed.
+    """
+    manifest_path = os.path.join(output_dir, ASSET_MANIFEST_NAME)
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            old_manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        old_manifest = {}
+    names = [name for name in DATA_FILE_NAMES if os.path.isfile(os.path.join(output_dir, name))]
+    shard_files = glob.glob(os.path.join(output_dir, SHARD_DIR_NAME, '*.json')) + \
+        glob.glob(os.path.join(output_dir, SHARD_DIR_NAME, '*.bin'))
+    names += [f"{SHARD_DIR_NAME}/{os.path.basename(path)}"
+              for path in sorted(shard_files, key=lambda path: (int(os.path.splitext(os.path.basename(path))[0]), path))]
+
+    files, published = {}, 0
+    raw_bytes, gzip_bytes = 0, 0
+    for name in names:
+        source_path = os.path.join(output_dir, name)
+        asset = hashed_asset_name(name, sha256_of_file(source_path))
+        files[name] = asset
+        asset_path = os.path.join(output_dir, asset)
+        if not os.path.isfile(asset_path):
+            os.makedirs(os.path.dirname(asset_path), exist_ok=True)
+            copy_with_variants(source_path, asset_path)
+            count_written(asset_path, asset_path + '.gz', asset_path + '.br')
+            published += 1
+        raw_bytes += os.path.getsize(source_path)
+        gzip_bytes += os.path.getsize(asset_path + '.gz')
+
+    # A rebuild that publishes the same assets keeps the generation before them as the previous one.
+    old_files = old_manifest.get('files', {})
+    previous = old_files if old_files != files else old_manifest.get('previous', {})
+    with atomic_open(manifest_path, 'w') as f:
+        json.dump({'version': 1, 'files': files, 'previous': previous}, f, indent=2, sort_keys=True)
+
+    keep = set()
+    for asset in list(files.values()) + list(previous.values()): keep.update([asset, asset + '.gz', asset + '.br'])
+    asset_root = os.path.join(output_dir, ASSET_DIR_NAME)
+    for stale in glob.glob(os.path.join(asset_root, '**', '*'), recursive=True):
+        if os.path.isfile(stale) and os.path.relpath(stale, output_dir).replace(os.sep, '/') not in keep:
+            try:
+                os.remove(stale)
+            except PermissionError:
+                pass  # still memory-mapped by search_api.py (Windows); removed by a later build
+    shard_asset_dir = os.path.join(asset_root, SHARD_DIR_NAME)
+    if os.path.isdir(shard_asset_dir) and not os.listdir(shard_asset_dir): os.rmdir(shard_asset_dir)
+
+    variants = "gzip and brotli" if brotli is not None else "gzip (install 'brotli' for .br variants)"
+    print(f"[INFO] Published {len(files)} hashed assets ({published} new, {len(set(previous.values()) - set(files.values()))} "
+          f"kept from the previous build), precompressed with {variants}: {raw_bytes:,} bytes, {gzip_bytes:,} bytes gzipped.")
+
+def write_outputs(output_dir, database, positions, word_index, trigram_index, ranking, layout, word_index_format):
+    """
+    Writes the database with its positions, both indexes, the fuzzy index of the word index's vocabulary
+    and the BM25 ranking table, then publishes
+    their hashed, precompressed copies. Keys are written in sorted order so that a
+    full and an incremental build of the same inputs are byte-identical. Every file
+    is written to a temporary name and renamed into place (common/atomic_write.py),
+    asset_manifest.json last, so the SPA and search_api.py never read a half-written
+    file while run_pipeline.py --watch rebuilds under them.
+    """
     os.makedirs(output_dir, exist_ok=True)
+    ranking_path = os.path.join(output_dir, 'search_index_ranking.json')
+    trigram_path = os.path.join(output_dir, 'search_index_trigram.json')
+    with span('write_database', layout=layout):
+        write_database(output_dir, database, positions, layout)
+    with span('write_word_index', format=word_index_format):
+        write_word_index(output_dir, word_index, word_index_format)
+    with span('write_fuzzy_index'):
+        write_fuzzy_index(output_dir, word_index)
+    with span('write_ranking'):
+        with atomic_open(ranking_path, 'w') as f: f.write(json.dumps(ranking, sort_keys=True))
+        count_written(ranking_path)
+    with span('write_trigram_index'):
+        with atomic_open(trigram_path, 'w') as f: f.write(json.dumps(trigram_index, sort_keys=True))
+        count_written(trigram_path)
+    # Superseded by the trigram index; pattern search confirms matches against the chat content itself.
+    remove_if_exists(os.path.join(output_dir, 'search_index_full_text.json'))
+    with span('publish_assets'):
+        publish_assets(output_dir)
+
+def create_database_and_indexes(chat_data, output_dir, manifest_path=MANIFEST_PATH, layout='single', word_index_format='json',
+                                pack=None):
+    """
+    Creates the data files: database.json (or catalog.json plus content shards),
+    search_index_word.json (or .bin), search_index_fuzzy.bin, search_index_trigram.json
+    and search_index_ranking.json. Also records
+    a manifest of every processed file so that later builds can run incrementally.
+    Chat content comes from pack (a ChatPack) where it is current.
+    Returns the database and both indexes.
+    """
+    print("[INFO] Creating JSON database and search indexes...")
+    database = {}
+    positions = {}
+    word_index = {}
+    trigram_index = {}
+    manifest_files = {}
+
+    with span('index_chats'):
+        for chat_id, rel_path, chat in iter_valid_chats(chat_data):
+            if chat_id in database:
+                print(f"[WARNING] Chat ID {chat_id} is listed twice in the report, skipping the second entry.")
+                continue
+            try:
+                filepath = os.path.join(ALL_CHATS_DIR, rel_path)
+                with phase('read'):
+                    stat = os.stat(filepath)
+                    content, digest = read_chat(chat_id, rel_path, stat, pack)
+
+                with phase('records'):
+                    segments = segment_messages(content)
+                    database[chat_id] = chat_record(chat, chat_id, content, segments)
 
-    with open(os.path.join(output_dir, 'database.json'), 'w') as f: json.dump(database, f)
-    with open(os.path.join(output_dir, 'search_index_word.json'), 'w') as f: json.dump(word_index, f)
-    with open(os.path.join(output_dir, 'search_index_full_text.json'), 'w') as f: json.dump(full_text_index, f)
+                with phase('tokenize'):
+                    lower_content, tokens, chat_positions = tokenize_chat(content, segments)
+                    for token in tokens:
+                        if token not in word_index: word_index[token] = []
+                        word_index[token].append(chat_id)
+
+                    for gram in trigrams(lower_content):
+                        if gram not in trigram_index: trigram_index[gram] = []
+                        trigram_index[gram].append(chat_id)
+
+                with phase('positions'):
+                    positions[chat_id] = encode_positions_block(chat_positions)
+
+                manifest_files[chat_id] = {
+                    'path': rel_path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                    'sha256': digest, 'meta': chat_metadata(chat), 'tokens': tokens
+                }
+
+            except FileNotFoundError:
+                print(f"[WARNING] File not found while building database, skipping: {filepath}")
+                continue
+
+        # Posting lists are kept in ascending chat ID order, whatever order the CSV is in.
+        with phase('sort_postings'):
+            for postings in word_index.values(): postings.sort()
+            for postings in trigram_index.values(): postings.sort()
+        count(chats=len(database), terms=len(word_index), trigrams=len(trigram_index))
+
+    with span('build_ranking'):
+        ranking = build_ranking(word_index, manifest_files)
+    write_outputs(output_dir, database, positions, word_index, trigram_index, ranking, layout, word_index_format)
+    save_manifest(manifest_path, manifest_files, layout, word_index_format)
 
     print(f"[SUCCESS] Database created ({len(database)} documents).")
     print(f"[SUCCESS] Word index created ({len(word_index)} tokens).")
-    print(f"[SUCCESS] Full-text index created ({len(full_text_index)} documents).")
+    print(f"[SUCCESS] Trigram index created ({len(trigram_index)} trigrams).")
+    return database, word_index, trigram_index
+
+class SpilledIndex:
+    """
+    An inverted index built under a memory budget. Postings are buffered in a dict
+    until max_postings of them are held, then written to a run file of JSON lines
+    sorted by key. merged() yields every key in sorted order with its postings
+    from all runs combined and sorted, holding one line per run at a time.
+    """
+
+    def __init__(self, run_dir, name, max_postings):
+        self.run_dir, self.name, self.max_postings = run_dir, name, max_postings
+        self.buffer, self.buffered, self.runs = {}, 0, []
+
+    def add(self, key, posting):
+        postings = self.buffer.get(key)
+        if postings is None: self.buffer[key] = [posting]
+        else: postings.append(posting)
+        self.buffered += 1
+
+    def spill_if_full(self):
+        if self.buffered >= self.max_postings: self.spill()
+
+    def spill(self):
+        path = os.path.join(self.run_dir, f"{self.name}.{len(self.runs)}.jsonl")
+        with open(path, 'w', encoding='utf-8') as f:
+            for key in sorted(self.buffer):
+                f.write(json.dumps([key, self.buffer[key]]) + '\n')
+        count_written(path)
+        count(spilled_runs=1)
+        self.runs.append(path)
+        self.buffer, self.buffered = {}, 0
+
+    def merged(self):
+        if not self.runs:
+            for key in sorted(self.buffer): yield key, sorted(self.buffer[key])
+            return
+        if self.buffer: self.spill()
+        files = [open(path, 'r', encoding='utf-8') for path in self.runs]
+        try:
+            current, postings = None, []
+            for key, run_postings in heapq.merge(*[map(json.loads, f) for f in files], key=itemgetter(0)):
+                if key != current:
+                    if current is not None: yield current, sorted(postings)
+                    current, postings = key, []
+                postings.extend(run_postings)
+            if current is not None: yield current, sorted(postings)
+        finally:
+            for f in files: f.close()
+
+def write_json_items(f, items):
+    """
+    Writes sorted (key, value) pairs exactly as json.dump(dict(items), f, sort_keys=True)
+    would, without building the dict. Returns the number of pairs written.
+    """
+    f.write('{')
+    written = 0
+    for key, value in items:
+        f.write((', ' if written else '') + json.dumps(key) + ': ' + json.dumps(value))
+        written += 1
+    f.write('}')
+    return written
+
+def write_merged_word_index(output_dir, words, doc_lengths, word_index_format, run_dir):
+    """
+    Merges the spilled word postings into the word index (JSON or binary) and the
+    BM25 ranking table in a single pass. Returns the vocabulary, in sorted order.
+    """
+    json_path = os.path.join(output_dir, 'search_index_word.json')
+    binary_path = os.path.join(output_dir, 'search_index_word.bin')
+    ranking_path = os.path.join(output_dir, 'search_index_ranking.json')
+    postings_path = os.path.join(run_dir, 'word_postings.bin')
+    binary = word_index_format == 'binary'
+    average = sum(doc_lengths.values()) / len(doc_lengths) if doc_lengths else 0
+    # Every other key of the ranking table sorts before 'term_frequencies', which is streamed last.
+    ranking_head = json.dumps({'avg_doc_length': average, 'b': BM25_B, 'doc_lengths': doc_lengths, 'k1': BM25_K1},
+                              sort_keys=True)[:-1] + ', "term_frequencies": {'
+    term_count, terms, offsets = 0, [], [0]
+    with atomic_open(ranking_path, 'w') as ranking, (open(postings_path, 'wb') if binary else atomic_open(json_path, 'w')) as out:
+        ranking.write(ranking_head)
+        if not binary: out.write('{')
+        for term, postings in words.merged():
+            separator = ', ' if term_count else ''
+            term_count += 1
+            chat_ids = [chat_id for chat_id, _ in postings]
+            ranking.write(separator + json.dumps(term) + ': ' + json.dumps([frequency for _, frequency in postings]))
+            if binary:
+                encoded = bytearray()
+                encode_posting_list(chat_ids, encoded)
+                out.write(encoded)
+                terms.append(term)
+                offsets.append(offsets[-1] + len(encoded))
+            else:
+                out.write(separator + json.dumps(term) + ': ' + json.dumps(chat_ids))
+                terms.append(term)
+        ranking.write('}}')
+        if not binary: out.write('}')
+
+    if binary:
+        with atomic_open(binary_path, 'wb') as f, open(postings_path, 'rb') as postings:
+            f.write(encode_word_index_head(terms, offsets))
+            shutil.copyfileobj(postings, f)
+        os.remove(postings_path)
+        print(f"[INFO] Word index size: binary {os.path.getsize(binary_path):,} bytes.")
+    remove_if_exists(json_path if binary else binary_path)
+    count_written(binary_path if binary else json_path, ranking_path)
+    return terms
+
+def stream_database_and_indexes(chat_data, output_dir, manifest_path=MANIFEST_PATH, layout='single',
+                                word_index_format='json', max_postings=STREAM_MAX_POSTINGS, run_dir=RUN_DIR, pack=None):
+    """
+    Bounded-memory twin of create_database_and_indexes() with byte-identical output.
+    Each chat's record goes straight to the database writer and its manifest entry
+    straight to the manifest; its postings go into two SpilledIndex buffers that
+    are spilled to sorted runs in run_dir and merged once every chat is read.
+    Nothing is returned, since nothing is kept in memory.
+    """
+    print(f"[INFO] Streaming JSON database and search indexes (at most {max_postings:,} buffered postings per index)...")
+    os.makedirs(output_dir, exist_ok=True)
+    if os.path.isdir(run_dir): shutil.rmtree(run_dir)
+    os.makedirs(run_dir)
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    words = SpilledIndex(run_dir, 'words', max_postings)
+    grams = SpilledIndex(run_dir, 'trigrams', max_postings)
+    doc_lengths = {}
+
+    database = DatabaseWriter(output_dir, layout)
+    manifest_part = manifest_path + '.part'
+    with span('index_chats'), open(manifest_part, 'w', encoding='utf-8') as manifest:
+        # Exactly what save_manifest() writes, one file entry at a time.
+        manifest.write(json.dumps({'version': MANIFEST_VERSION, 'layout': layout, 'word_index_format': word_index_format,
+                                   'files': {}})[:-2])
+        for chat_id, rel_path, chat in iter_valid_chats(chat_data):
+            if chat_id in doc_lengths:
+                print(f"[WARNING] Chat ID {chat_id} is listed twice in the report, skipping the second entry.")
+                continue
+            filepath = os.path.join(ALL_CHATS_DIR, rel_path)
+            try:
+                with phase('read'):
+                    stat = os.stat(filepath)
+                    content, digest = read_chat(chat_id, rel_path, stat, pack)
+            except FileNotFoundError:
+                print(f"[WARNING] File not found while building database, skipping: {filepath}")
+                continue
+
+            with phase('tokenize'):
+                segments = segment_messages(content)
+                lower_content, tokens, chat_positions = tokenize_chat(content, segments)
+                for token, frequency in tokens.items(): words.add(token, (chat_id, frequency))
+                for gram in trigrams(lower_content): grams.add(gram, chat_id)
+            with phase('positions'):
+                block = encode_positions_block(chat_positions)
+            with phase('records'):
+                database.add(chat_id, chat_record(chat, chat_id, content, segments), block)
+            with phase('spill'):
+                words.spill_if_full()
+                grams.spill_if_full()
+
+            manifest.write((', ' if doc_lengths else '') + json.dumps(str(chat_id)) + ': ' + json.dumps({
+                'path': rel_path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                'sha256': digest, 'meta': chat_metadata(chat), 'tokens': tokens
+            }))
+            doc_lengths[chat_id] = sum(tokens.values())
+        manifest.write('}}')
+        count(chats=len(doc_lengths))
+
+    with span('write_database', layout=layout):
+        database.close()
+    with span('merge_word_index', format=word_index_format, runs=len(words.runs)):
+        vocabulary = write_merged_word_index(output_dir, words, doc_lengths, word_index_format, run_dir)
+    with span('write_fuzzy_index'):
+        write_fuzzy_index(output_dir, vocabulary)
+    with span('merge_trigram_index', runs=len(grams.runs)):
+        trigram_path = os.path.join(output_dir, 'search_index_trigram.json')
+        with atomic_open(trigram_path, 'w') as f: gram_count = write_json_items(f, grams.merged())
+        count_written(trigram_path)
+    shutil.rmtree(run_dir)
+    remove_if_exists(os.path.join(output_dir, 'search_index_full_text.json'))
+    with span('publish_assets'):
+        publish_assets(output_dir)
+    os.replace(manifest_part, manifest_path)
+    count_written(manifest_path)
+
+    print(f"[SUCCESS] Database created ({len(doc_lengths)} documents).")
+    print(f"[SUCCESS] Word index created ({len(vocabulary)} tokens).")
+    print(f"[SUCCESS] Trigram index created ({gram_count} trigrams).")
+
+def expected_outputs(layout, word_index_format):
+    """Returns the data files a build with these options leaves in the output folder."""
+    names = ['database.json', POSITIONS_FILE_NAME] if layout == 'single' else ['catalog.json']
+    names.append('search_index_word.json' if word_index_format == 'json' else 'search_index_word.bin')
+    return names + ['search_index_trigram.json', 'search_index_ranking.json', FUZZY_FILE_NAME, ASSET_MANIFEST_NAME]
+
+def build_is_current(chats, output_dir, manifest, layout, word_index_format):
+    """
+    True if the previous build already is what a build of chats, the
+    (chat_id, relative_path, chat) rows of the report, would write: same options,
+    every output present, and every chat at the same path, size and mtime with
+    the same CSV metadata as the manifest records. Costs one os.stat per chat.
+    """
+    if (manifest.get('layout'), manifest.get('word_index_format')) != (layout, word_index_format): return False
+    if not all(os.path.isfile(os.path.join(output_dir, name)) for name in expected_outputs(layout, word_index_format)):
+        return False
+    old_files, matched = manifest['files'], set()
+    for chat_id, rel_path, chat in chats:
+        if chat_id in matched: continue
+        try:
+            stat = os.stat(os.path.join(ALL_CHATS_DIR, rel_path))
+        except FileNotFoundError:
+            continue  # skipped by this build as by the last one, unless its entry is left over (checked below)
+        entry = old_files.get(chat_id)
+        if (entry is None or entry['path'] != rel_path or entry['size'] != stat.st_size
+                or entry['mtime_ns'] != stat.st_mtime_ns or entry['meta'] != chat_metadata(chat)):
+            return False
+        matched.add(chat_id)
+    return len(matched) == len(old_files)
+
+def update_database_and_indexes(chat_data, output_dir, manifest_path=MANIFEST_PATH, layout='single', word_index_format='json',
+                                stream_max_postings=None, pack=None):
+    """
+    Incrementally patches the JSON files written by a previous build. Only chats
+    whose file was added, changed or deleted since the manifest was recorded are
+    re-read and re-tokenized; the others keep their message records and positions
+    from the previous outputs. When no file, report row or option changed,
+    nothing is loaded or written. The result is identical to a full rebuild.
+    Falls back to a full build when there is no usable previous build (a streamed
+    one when stream_max_postings is given). Returns the database and both
+    indexes, or None when nothing was rebuilt or after a streamed full build.
+    """
+    manifest = load_manifest(manifest_path)
+    chats = list(iter_valid_chats(chat_data))
+    if manifest:
+        with span('check_previous_build'):
+            current = build_is_current(chats, output_dir, manifest, layout, word_index_format)
+        if current:
+            print(f"[INFO] Nothing changed since the previous build ({len(manifest['files'])} chats). No files written.")
+            return None
+    with span('load_previous_outputs'):
+        previous = load_previous_outputs(output_dir, manifest) if manifest else None
+    if previous is None:
+        print("[INFO] No usable previous build found. Running a full build instead.")
+        if stream_max_postings:
+            return stream_database_and_indexes(chat_data, output_dir, manifest_path, layout, word_index_format,
+                                               stream_max_postings, pack=pack)
+        return create_database_and_indexes(chat_data, output_dir, manifest_path, layout, word_index_format, pack)
+
+    print("[INFO] Incrementally updating JSON database and search indexes...")
+    old_database, word_index, trigram_index, old_positions = previous
+    old_files = manifest['files']
+    database = {}
+    positions = {}
+    manifest_files = {}
+    added, changed, metadata_only = 0, 0, 0
+
+    with span('update_chats'):
+        for chat_id, rel_path, chat in chats:
+            if chat_id in manifest_files:
+                print(f"[WARNING] Chat ID {chat_id} is listed twice in the report, skipping the second entry.")
+                continue
+            filepath = os.path.join(ALL_CHATS_DIR, rel_path)
+            try:
+                stat = os.stat(filepath)
+            except FileNotFoundError:
+                print(f"[WARNING] File not found while building database, skipping: {filepath}")
+                continue
+
+            entry = old_files.get(chat_id)
+            meta = chat_metadata(chat)
+            known = entry is not None and chat_id in old_database and chat_id in old_positions
+            if (known and entry['path'] == rel_path and entry['size'] == stat.st_size
+                    and entry['mtime_ns'] == stat.st_mtime_ns):
+                manifest_files[chat_id] = entry
+            else:
+                content, digest = read_chat(chat_id, rel_path, stat, pack)
+                if known and entry['sha256'] == digest:
+                    # Touched or moved, but the bytes are the same: nothing to re-tokenize.
+                    manifest_files[chat_id] = dict(entry, path=rel_path, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+                else:
+                    old_tokens = entry['tokens'].keys() if entry is not None else set()
+                    old_grams = trigrams(old_database[chat_id]['content'].lower()) if chat_id in old_database else set()
+                    segments = segment_messages(content)
+                    lower_content, tokens, chat_positions = tokenize_chat(content, segments)
+                    grams = trigrams(lower_content)
+                    for token in old_tokens - tokens.keys(): remove_posting(word_index, token, chat_id)
+                    for token in tokens.keys() - old_tokens: add_posting(word_index, token, chat_id)
+                    for gram in old_grams - grams: remove_posting(trigram_index, gram, chat_id)
+                    for gram in grams - old_grams: add_posting(trigram_index, gram, chat_id)
+                    manifest_files[chat_id] = {
+                        'path': rel_path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                        'sha256': digest, 'meta': meta, 'tokens': tokens
+                    }
+                    database[chat_id] = chat_record(chat, chat_id, content, segments)
+                    positions[chat_id] = encode_positions_block(chat_positions)
+                    if entry is None: added += 1
+                    else: changed += 1
+                    continue
+
+            # Same content as before: the previous record (messages included) and positions block still hold.
+            if manifest_files[chat_id]['meta'] != meta:
+                manifest_files[chat_id] = dict(manifest_files[chat_id], meta=meta)
+                metadata_only += 1
+            database[chat_id] = dict(old_database[chat_id], **meta)
+            positions[chat_id] = old_positions[chat_id]
+
+        removed_ids = set(old_files) - set(manifest_files)
+        for chat_id in removed_ids:
+            for token in old_files[chat_id]['tokens']: remove_posting(word_index, token, chat_id)
+            if chat_id in old_database:
+                for gram in trigrams(old_database[chat_id]['content'].lower()): remove_posting(trigram_index, gram, chat_id)
+        count(chats=len(database), chats_added=added, chats_changed=changed, chats_removed=len(removed_ids))
+
+    with span('build_ranking'):
+        ranking = build_ranking(word_index, manifest_files)
+    write_outputs(output_dir, database, positions, word_index, trigram_index, ranking, layout, word_index_format)
+    save_manifest(manifest_path, manifest_files, layout, word_index_format)
+
+    print(f"[INFO] Chats added: {added}, changed: {changed}, removed: {len(removed_ids)}, metadata-only updates: {metadata_only}.")
+    print(f"[SUCCESS] Database updated ({len(database)} documents).")
+    print(f"[SUCCESS] Word index updated ({len(word_index)} tokens).")
+    print(f"[SUCCESS] Trigram index updated ({len(trigram_index)} trigrams).")
+    return database, word_index, trigram_index
 
 def main():
+    parser = argparse.ArgumentParser(description="Builds the thortStream SPA database and search indexes.")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Only re-process chats added, changed or deleted since the previous build.")
+    parser.add_argument('--layout', choices=OUTPUT_LAYOUTS, default='single',
+                        help="'single' writes database.json; 'sharded' writes catalog.json plus lazily loaded content shards.")
+    parser.add_argument('--word-index-format', choices=WORD_INDEX_FORMATS, default='json',
+                        help="'json' writes search_index_word.json; 'binary' writes the compact search_index_word.bin.")
+    parser.add_argument('--self-test', action='store_true',
+                        help="After building, check the trigram pattern search, positions and fuzzy index against linear scans.")
+    parser.add_argument('--streaming', action='store_true',
+                        help="Full builds write records as they go and merge spilled index runs, in bounded memory.")
+    parser.add_argument('--max-postings', type=int, default=STREAM_MAX_POSTINGS,
+                        help=f"Postings buffered per index before a run is spilled with --streaming (default: {STREAM_MAX_POSTINGS:,}).")
+    parser.add_argument('--no-pack', action='store_true',
+                        help="Read every chat from its file even when the chat pack holds a current copy.")
+    parser.add_argument('--keep-duplicates', action='store_true',
+                        help="Also build the chats the analysis marked as redundant copies (DUPLICATE).")
+    add_trace_arguments(parser)
+    args = parser.parse_args()
+    configure_from_args('build_database', args)
+
     print("--- Starting thortStream Database Builder ---")
     chat_data = read_csv_data(CSV_REPORT_PATH)
     if not chat_data: return
 
     valid_chats = [c for c in chat_data if c.get('Actual Msg Count') and c.get('Actual Msg Count') != 'N/A']
-    
+    if not args.keep_duplicates: valid_chats = skip_redundant_copies(valid_chats)
+
     # Generate the JSON database and indexes directly into the public folder
-    create_database_and_indexes(valid_chats, WEBSITE_DATA_DIR)
+    stream_max_postings = max(1, args.max_postings) if args.streaming else None
+    pack = None if args.no_pack else open_chat_pack()
+    if args.incremental:
+        result = update_database_and_indexes(valid_chats, WEBSITE_DATA_DIR, layout=args.layout,
+                                             word_index_format=args.word_index_format,
+                                             stream_max_postings=stream_max_postings, pack=pack)
+    elif args.streaming:
+        result = stream_database_and_indexes(valid_chats, WEBSITE_DATA_DIR, layout=args.layout,
+                                             word_index_format=args.word_index_format,
+                                             max_postings=stream_max_postings, pack=pack)
+    else:
+        result = create_database_and_indexes(valid_chats, WEBSITE_DATA_DIR, layout=args.layout,
+                                             word_index_format=args.word_index_format, pack=pack)
+
+    if args.self_test and result is None:
+        print("[WARNING] --self-test needs the in-memory build; it was skipped (streamed build, or nothing to rebuild).")
+    elif args.self_test:
+        database, word_index, trigram_index = result
+        with span('self_test'):
+            self_test_pattern_search(trigram_index, database)
+            self_test_positions(WEBSITE_DATA_DIR, database, args.layout)
+            self_test_fuzzy(WEBSITE_DATA_DIR, word_index)
 
     print(f"\n--- Database Build Complete ---")
     print(f"JSON data files have been updated in the '{WEBSITE_DATA_DIR}' directory.")
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+Filename:   build_search_db.py
+Author:     Simon C, assisted by Dora
+Version:    1.3
+Date:       2026-10-17
+Aim:        An alternative build target to build_database.py for scripts and
+            back-office tools. It loads the master CSV metadata and every
+            chat, split into messages exactly as the SPA shows them, into a
+            single SQLite file with an FTS5 full-text index over the titles
+            and message bodies. A chat's title is indexed once, with its
+            first message. search_archive.py queries it.
+            Runs are incremental: a chat is only re-indexed when its file or
+            its CSV metadata changed, and chats gone from the report are
+            deleted, so keeping a very large archive up to date is cheap.
+            Chats are read from the chat pack when it holds their current
+            copy (see build_database.py), unless --no-pack is given.
+            Redundant copies marked by analyze_gemini_chats.py --dedup are
+            skipped unless --keep-duplicates is given.
+            Run it from the project root:
+                python src/03_website_generation/build_search_db.py
+"""
+
+import os
+import sys
+import sqlite3
+import argparse
+
+from build_database import read_csv_data, iter_valid_chats, read_chat, segment_messages, skip_redundant_copies
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'common'))
+from instrumentation import span, phase, count, add_trace_arguments, configure_from_args
+from chat_pack import open_chat_pack
+
+# --- CONFIGURATION ---
+BASE_DIR = os.getcwd()
+CSV_REPORT_PATH = os.path.join(BASE_DIR, 'output', 'reports', 'chat_analysis_report.csv')
+ALL_CHATS_DIR = os.path.join(BASE_DIR, 'data', 'allchats')
+SEARCH_DB_PATH = os.path.join(BASE_DIR, 'output', 'search', 'archive.sqlite3')
+
+# Bump this when the schema or the message segmentation changes; an older file is then rebuilt.
+SCHEMA_VERSION = 2
+# unicode61 folds case and diacritics, so 'cafe' finds 'Café'.
+FTS_TOKENIZER = 'unicode61 remove_diacritics 2'
+
+# messages_fts is an external-content FTS5 table over message_documents: the text is stored once,
+# in messages, and the index is kept in step by index_messages() / unindex_messages(). The title
+# belongs to the chat, so only its first message carries it; title: terms then match once per chat.
+SCHEMA = f"""
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE chats (
+    id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL,
+    msg_count INTEGER NOT NULL,
+    filesize INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT NOT NULL
+);
+CREATE TABLE messages (
+    id INTEGER PRIMARY KEY,
+    chat_id INTEGER NOT NULL REFERENCES chats(id),
+    position INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    body TEXT NOT NULL,
+    UNIQUE (chat_id, position)
+);
+CREATE VIEW message_documents AS
+    SELECT messages.id AS id, CASE WHEN messages.position = 0 THEN chats.title ELSE '' END AS title,
+           messages.body AS body
+    FROM messages JOIN chats ON chats.id = messages.chat_id;
+CREATE VIRTUAL TABLE messages_fts USING fts5(
+    title, body, content='message_documents', content_rowid='id', tokenize='{FTS_TOKENIZER}'
+);
+"""
+
+# --- SCRIPT ---
+
+def open_search_db(db_path):
+    """Opens (creating or rebuilding as needed) the search database and returns the connection."""
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    connection = sqlite3.connect(db_path)
+    connection.execute('PRAGMA journal_mode=WAL')
+    try:
+        version = connection.execute("SELECT value FROM meta WHERE key = 'schema_version'").fetchone()
+    except sqlite3.OperationalError:
+        version = None
+    if version is None or int(version[0]) != SCHEMA_VERSION:
+        if version is not None:
+            print("[INFO] Search database is from an older schema version. Rebuilding it.")
+        connection.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(db_path + suffix): os.remove(db_path + suffix)
+        connection = sqlite3.connect(db_path)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.executescript(SCHEMA)
+        connection.execute("INSERT INTO meta (key, value) VALUES ('schema_version', ?)", (str(SCHEMA_VERSION),))
+        connection.commit()
+    return connection
+
+def chat_messages(content):
+    """
+    Returns [(role, body)] for a chat, using the SPA's message segmentation. A
+    chat without any message markers is indexed as a single 'text' message.
+    """
+    messages = [(role, content[start:end]) for role, start, end in segment_messages(content)]
+    return messages or [('text', content.strip())]
+
+def unindex_messages(connection, chat_id):
+    """Removes a chat's messages from the FTS index and the messages table."""
+    rows = connection.execute("SELECT id, title, body FROM message_documents WHERE id IN "
+                              "(SELECT id FROM messages WHERE chat_id = ?)", (chat_id,)).fetchall()
+    connection.executemany("INSERT INTO messages_fts (messages_fts, rowid, title, body) VALUES ('delete', ?, ?, ?)", rows)
+    connection.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,))
+
+def index_messages(connection, chat_id, title, messages):
+    """Stores a chat's messages and adds them to the FTS index, the title with the first message only."""
+    for position, (role, body) in enumerate(messages):
+        cursor = connection.execute("INSERT INTO messages (chat_id, position, role, body) VALUES (?, ?, ?, ?)",
+                                    (chat_id, position, role, body))
+        connection.execute("INSERT INTO messages_fts (rowid, title, body) VALUES (?, ?, ?)",
+                           (cursor.lastrowid, title if position == 0 else '', body))
+
+def upsert_chat(connection, chat_id, row, rel_path, stat, pack=None):
+    """Inserts or replaces one chat: its metadata row, its messages and their FTS entries."""
+    content, digest = read_chat(chat_id, rel_path, stat, pack)
+    unindex_messages(connection, chat_id)
+    connection.execute("INSERT OR REPLACE INTO chats (id, title, msg_count, filesize, path, size, mtime_ns, sha256) "
+                       "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                       (chat_id, row['title'], row['msg_count'], row['filesize'], rel_path, stat.st_size,
+                        stat.st_mtime_ns, digest))
+    messages = chat_messages(content)
+    index_messages(connection, chat_id, row['title'], messages)
+    return len(messages)
+
+def delete_chat(connection, chat_id):
+    """Removes a chat and everything indexed for it."""
+    unindex_messages(connection, chat_id)
+    connection.execute("DELETE FROM chats WHERE id = ?", (chat_id,))
+
+def sync_search_db(connection, chat_data, pack=None):
+    """
+    Brings the database in line with the CSV report. A chat is re-indexed when
+    its file's path, size or mtime, or its CSV metadata, differs from what is
+    stored; chats no longer in the report are deleted. Chat content comes from
+    pack (a ChatPack) where it is current. Returns a dict of counts.
+    """
+    stored = {row[0]: row[1:] for row in connection.execute(
+        "SELECT id, title, msg_count, filesize, path, size, mtime_ns FROM chats")}
+    stats = {'added': 0, 'changed': 0, 'unchanged': 0, 'removed': 0, 'messages': 0}
+    seen = set()
+    with connection:
+        for chat_id, rel_path, chat in iter_valid_chats(chat_data):
+            if chat_id in seen: continue
+            filepath = os.path.join(ALL_CHATS_DIR, rel_path)
+            try:
+                stat = os.stat(filepath)
+            except FileNotFoundError:
+                print(f"[WARNING] File not found while building the search database, skipping: {filepath}")
+                continue
+            seen.add(chat_id)
+            row = {'title': chat.get('Title', 'Untitled'), 'msg_count': int(chat.get('Actual Msg Count', 0)),
+                   'filesize': int(chat.get('Filesize (bytes)', 0))}
+            current = (row['title'], row['msg_count'], row['filesize'], rel_path, stat.st_size, stat.st_mtime_ns)
+            if stored.get(chat_id) == current:
+                stats['unchanged'] += 1
+                continue
+            with phase('upsert'):
+                stats['messages'] += upsert_chat(connection, chat_id, row, rel_path, stat, pack)
+            stats['changed' if chat_id in stored else 'added'] += 1
+        for chat_id in set(stored) - seen:
+            delete_chat(connection, chat_id)
+            stats['removed'] += 1
+    count(chats_added=stats['added'], chats_changed=stats['changed'], chats_removed=stats['removed'],
+          messages_indexed=stats['messages'])
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Builds or updates the SQLite FTS5 search database of the archive.")
+    parser.add_argument('--db', default=SEARCH_DB_PATH, help="Database file (default: output/search/archive.sqlite3).")
+    parser.add_argument('--rebuild', action='store_true', help="Delete the database and index every chat again.")
+    parser.add_argument('--optimize', action='store_true', help="Merge the FTS index segments after updating.")
+    parser.add_argument('--no-pack', action='store_true', help="Read every chat from its file, not from the chat pack.")
+    parser.add_argument('--keep-duplicates', action='store_true',
+                        help="Also index the chats the analysis marked as redundant copies (DUPLICATE).")
+    add_trace_arguments(parser)
+    args = parser.parse_args()
+    configure_from_args('build_search_db', args)
+
+    print("--- Starting thortStream Search Database Builder ---")
+    chat_data = read_csv_data(CSV_REPORT_PATH)
+    if not chat_data: return
+    valid_chats = [c for c in chat_data if c.get('Actual Msg Count') and c.get('Actual Msg Count') != 'N/A']
+    if not args.keep_duplicates: valid_chats = skip_redundant_copies(valid_chats)
+
+    if args.rebuild:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.db + suffix): os.remove(args.db + suffix)
+    connection = open_search_db(args.db)
+    with span('sync'):
+        stats = sync_search_db(connection, valid_chats, None if args.no_pack else open_chat_pack())
+    if args.optimize or args.rebuild:
+        with span('optimize'):
+            connection.execute("INSERT INTO messages_fts (messages_fts) VALUES ('optimize')")
+            connection.commit()
+    connection.close()
+
+    print(f"[INFO] Chats added: {stats['added']}, changed: {stats['changed']}, removed: {stats['removed']}, "
+          f"unchanged: {stats['unchanged']} ({stats['messages']:,} messages indexed).")
+    print(f"[SUCCESS] Search database is up to date: {args.db}")
+    print("Query it with: python src/03_website_generation/search_archive.py \"your query\"")
+
+if __name__ == '__main__':
+    main()
@@ -2,8 +2,8 @@
 """
 Filename:   build_website_content.py
 Author:     Simon C, assisted by Dora
-Version:    1.5
-Date:       2025-08-12
+Version:    2.4
+Date:       2026-10-17
 Description:
     A static site content builder. This version fixes a critical bug where
     the search index was being generated incorrectly, resulting in an empty
@@ -11,11 +11,22 @@ Description:
 """
 
 import os
+import sys
 import csv
 import shutil
 import re
 import html
 import json
+import argparse
+import hashlib
+import inspect
+from concurrent.futures import ProcessPoolExecutor
+from build_database import segment_messages, read_chat, skip_redundant_copies, MESSAGE_MARKERS, JS_WHITESPACE
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'common'))
+from instrumentation import span, phase, count, count_written, add_trace_arguments, configure_from_args
+from chat_pack import open_chat_pack
+from atomic_write import atomic_open
 
 # --- CONFIGURATION ---
 BASE_DIR = os.getcwd()
@@ -29,13 +40,26 @@ SOURCE_DOCS_DIR = os.path.join(BASE_DIR, 'src', 'docs')
 # Output Path
 WEBSITE_OUTPUT_DIR = os.path.join(BASE_DIR, 'public')
 
+# Cache Path
+SITE_MANIFEST_PATH = os.path.join(BASE_DIR, 'output', 'cache', 'site_manifest.json')
+SITE_MANIFEST_VERSION = 1
+
+STATIC_FILES = ['search.js', 'chat_page.js', 'search_worker.js']
+TEMPLATE_FIELD_PATTERN = re.compile(r'\{(title|chat_id|msg_count|filesize|content)\}')
+STOP_WORDS = set(['a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'has', 'he', 'in', 'is', 'it', 'its', 'of', 'on', 'that', 'the', 'to', 'was', 'were', 'will', 'with'])
+
+# Set up in each rendering process by init_page_renderer().
+PAGE_RENDERER = {}
+
 def read_csv_data(filepath):
     """Reads the master CSV report into a list of dictionaries."""
     print(f"[INFO] Reading master report from: {filepath}")
     try:
         with open(filepath, 'r', encoding='utf-8') as f:
             reader = csv.DictReader(f)
-            return [row for row in reader]
+            rows = [row for row in reader]
+            count(bytes_read=f.tell(), files_read=1)
+            return rows
     except FileNotFoundError:
         print(f"[FATAL] Master CSV report not found at '{filepath}'. Cannot continue.")
         return None
@@ -43,98 +67,280 @@ def read_csv_data(filepath):
 def format_chat_content(raw_text):
     """Formats the raw chat text into styled HTML."""
     if not raw_text: return "<p class='text-red-400'>Could not load chat content.</p>"
-    escaped_text = html.escape(raw_text)
-    parts = re.split(r'(## (?:PROMPT|RESPONSE) ##)', escaped_text)
-    html_content = ""
-    for i in range(1, len(parts), 2):
-        marker, content = parts[i], parts[i+1].strip().replace('\n', '<br>')
-        if "PROMPT" in marker:
-            html_content += f'<div class="p-4 bg-blue-900/30 border border-blue-800 rounded-lg"><h3 class="font-semibold text-blue-300 mb-2">Simon\'s Prompt</h3><div class="prose prose-invert max-w-none text-gray-300">{content}</div></div>'
-        elif "RESPONSE" in marker:
-            html_content += f'<div class="p-4 bg-gray-800/50 border border-gray-700 rounded-lg"><h3 class="font-semibold text-gray-300 mb-2">Dora\'s Response</h3><div class="prose prose-invert max-w-none text-gray-200">{content}</div></div>'
-    return html_content if html_content else f"<p>{escaped_text.replace('\n', '<br>')}</p>"
-
-def create_search_index(chat_data, output_dir):
-    """Creates a JSON search index from the chat content."""
+    blocks = []
+    for role, start, end in segment_messages(raw_text):
+        content = html.escape(raw_text[start:end]).replace('\n', '<br>')
+        if role == 'prompt':
+            blocks.append(f'<div class="p-4 bg-blue-900/30 border border-blue-800 rounded-lg"><h3 class="font-semibold text-blue-300 mb-2">Simon\'s Prompt</h3><div class="prose prose-invert max-w-none text-gray-300">{content}</div></div>')
+        else:
+            blocks.append(f'<div class="p-4 bg-gray-800/50 border border-gray-700 rounded-lg"><h3 class="font-semibold text-gray-300 mb-2">Dora\'s Response</h3><div class="prose prose-invert max-w-none text-gray-200">{content}</div></div>')
+    if not blocks:
+        return "<p>" + html.escape(raw_text).replace('\n', '<br>') + "</p>"
+    return "".join(blocks)
+
+def compile_template(template):
+    """
+    Splits a page template into literal text (even positions) and field names
+    (odd positions), so that rendering a page is one join instead of a
+    str.replace pass over the whole page per field.
+    """
+    return TEMPLATE_FIELD_PATTERN.split(template)
+
+def render_template(parts, fields):
+    page = list(parts)
+    for i in range(1, len(page), 2): page[i] = fields[page[i]]
+    return ''.join(page)
+
+def chat_tokens(content):
+    """Returns the sorted search tokens of a chat's text."""
+    return sorted(set(re.findall(r'\b\w{2,}\b', content.lower())) - STOP_WORDS)
+
+def render_digest(chat_page_template):
+    """
+    Fingerprints how a page is rendered: the template, and the source of the
+    functions (and constants) that turn chat text into page HTML and search
+    tokens, so a change to either re-renders every page.
+    """
+    code = [inspect.getsource(function) for function in (segment_messages, format_chat_content, render_template, chat_tokens)]
+    constants = [MESSAGE_MARKERS, sorted(JS_WHITESPACE), sorted(STOP_WORDS), TEMPLATE_FIELD_PATTERN.pattern]
+    return hashlib.sha256(json.dumps([chat_page_template, code, constants]).encode('utf-8')).hexdigest()
+
+def page_key(chat, rel_path, stat, renderer):
+    """Fingerprints everything a chat page is rendered from: its report row, its file and render_digest()."""
+    fields = [chat.get('Title', 'Untitled'), chat.get('Chat ID'), chat.get('Actual Msg Count', 'N/A'),
+              chat.get('Filesize (bytes)', 0), rel_path, stat.st_size, stat.st_mtime_ns, renderer]
+    return hashlib.sha256(json.dumps(fields).encode('utf-8')).hexdigest()
+
+def init_page_renderer(template_parts, use_pack, pack=None):
+    """Sets up render_chat_page() in this process; pool workers open their own view of the chat pack."""
+    PAGE_RENDERER['template'] = template_parts
+    PAGE_RENDERER['pack'] = pack if pack is not None or not use_pack else open_chat_pack()
+
+def render_chat_page(job):
+    """
+    Reads one chat, renders its page and writes it (atomically, and only if
+    its bytes changed). Returns (chat_id, search tokens, whether the page was
+    written), or (chat_id, None, False) if the chat file is gone.
+    """
+    chat, rel_path, stat, page_path = job
+    chat_id = chat.get('Chat ID')
+    try:
+        with phase('read'):
+            content, _ = read_chat(int(chat_id), rel_path, stat, PAGE_RENDERER['pack'])
+    except FileNotFoundError:
+        return chat_id, None, False
+    with phase('render'):
+        page_html = render_template(PAGE_RENDERER['template'], {
+            'title': html.escape(chat.get('Title', 'Untitled')), 'chat_id': chat_id,
+            'msg_count': chat.get('Actual Msg Count', 'N/A'),
+            'filesize': f"{int(chat.get('Filesize (bytes)', 0)):,}", 'content': format_chat_content(content)
+        })
+    with phase('write'):
+        written = write_if_changed(page_path, page_html)
+    return chat_id, chat_tokens(content), written
+
+def write_if_changed(filepath, text):
+    """Atomically writes text to filepath unless the file already holds exactly that."""
+    try:
+        with open(filepath, 'r', encoding='utf-8') as f:
+            if f.read() == text: return False
+    except (FileNotFoundError, UnicodeDecodeError):
+        pass
+    with atomic_open(filepath, 'w', encoding='utf-8') as f: f.write(text)
+    return True
+
+def load_site_manifest(manifest_path, output_dir):
+    """Returns {chat_id: {'key', 'tokens'}} recorded by the last build of output_dir, or {}."""
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    if manifest.get('version') != SITE_MANIFEST_VERSION or manifest.get('output_dir') != output_dir:
+        return {}
+    return manifest.get('pages', {})
+
+def save_site_manifest(manifest_path, output_dir, pages):
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    with atomic_open(manifest_path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps({'version': SITE_MANIFEST_VERSION, 'output_dir': output_dir, 'pages': pages}))
+    count_written(manifest_path)
+
+def sync_static_files(output_dir):
+    """Brings the static files and docs in output_dir in line with the sources, copying only what differs."""
+    copied = 0
+    sources = {name: os.path.join(SOURCE_TEMPLATES_DIR, name) for name in STATIC_FILES}
+    for folder, _, names in os.walk(SOURCE_DOCS_DIR):
+        for name in names:
+            path = os.path.join(folder, name)
+            sources[os.path.join('docs', os.path.relpath(path, SOURCE_DOCS_DIR))] = path
+    for name, source_path in sources.items():
+        target_path = os.path.join(output_dir, name)
+        with open(source_path, 'rb') as f: data = f.read()
+        try:
+            with open(target_path, 'rb') as f:
+                if f.read() == data: continue
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        with atomic_open(target_path, 'wb') as f: f.write(data)
+        shutil.copystat(source_path, target_path)
+        copied += 1
+    docs_output_dir = os.path.join(output_dir, 'docs')
+    for folder, _, names in os.walk(docs_output_dir):
+        for name in names:
+            if os.path.relpath(os.path.join(folder, name), output_dir) not in sources:
+                os.remove(os.path.join(folder, name))
+    return copied
+
+def remove_orphan_pages(chats_output_dir, page_ids):
+    """Removes the pages of chats that are no longer in the report. Returns how many were removed."""
+    removed = 0
+    for name in os.listdir(chats_output_dir):
+        stem, extension = os.path.splitext(name)
+        if extension == '.html' and stem not in page_ids:
+            os.remove(os.path.join(chats_output_dir, name))
+            removed += 1
+    return removed
+
+def write_search_index(sorted_chats, page_tokens, output_dir):
+    """Writes the JSON search index from the tokens of each chat, in report order."""
     print("[INFO] Creating search index...")
-    search_index = {}
-    stop_words = set(['a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'has', 'he', 'in', 'is', 'it', 'its', 'of', 'on', 'that', 'the', 'to', 'was', 'were', 'will', 'with'])
-    for chat in chat_data:
-        chat_id, filename, folder = int(chat.get('Chat ID', 0)), chat.get('Matched Filename'), chat.get('Actual Folder')
-        if not all([chat_id, filename, folder]): continue
+    search_index, indexed = {}, set()
+    for chat in sorted_chats:
+        tokens = page_tokens.get(chat.get('Chat ID'))
+        if tokens is None or chat['Chat ID'] in indexed: continue
+        indexed.add(chat['Chat ID'])
+        chat_id = int(chat['Chat ID'])
+        for token in tokens:
+            postings = search_index.get(token)
+            if postings is None: search_index[token] = [chat_id]
+            else: postings.append(chat_id)
+    search_index_path = os.path.join(output_dir, 'search_index.json')
+    write_if_changed(search_index_path, json.dumps(search_index))
+    count_written(search_index_path)
+    print(f"[SUCCESS] Search index created with {len(search_index)} tokens.")
+
+def build_chat_pages(sorted_chats, chats_output_dir, chat_page_template, previous_pages, pack=None, workers=1):
+    """
+    Renders the page of every chat whose key is not in previous_pages (or
+    whose page is missing) and returns the new {chat_id: {'key', 'tokens'}}.
+    Pages that are up to date are not read or touched.
+    """
+    template_parts = compile_template(chat_page_template)
+    renderer = render_digest(chat_page_template)
+    pages, jobs = {}, []
+    for chat in sorted_chats:
+        chat_id, filename, folder = chat.get('Chat ID'), chat.get('Matched Filename'), chat.get('Actual Folder')
+        if not all([chat_id, filename, folder]) or chat_id in pages: continue
+        rel_path = os.path.join(folder, filename)
         try:
-            # **BUG FIX**: Use the 'folder' variable from the CSV, not a hardcoded path.
-            filepath = os.path.join(ALL_CHATS_DIR, folder, filename)
-            with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
-                content = f.read().lower()
-            tokens = set(re.findall(r'\b\w{2,}\b', content)) - stop_words
-            for token in tokens:
-                if token not in search_index: search_index[token] = []
-                search_index[token].append(chat_id)
+            stat = os.stat(os.path.join(ALL_CHATS_DIR, rel_path))
         except FileNotFoundError:
-            print(f"[WARNING] File not found while building search index, skipping: {filepath}")
+            print(f"[WARNING] File not found while building the site, skipping: {os.path.join(ALL_CHATS_DIR, rel_path)}")
             continue
-    with open(os.path.join(output_dir, 'search_index.json'), 'w', encoding='utf-8') as f:
-        json.dump(search_index, f)
-    print(f"[SUCCESS] Search index created with {len(search_index)} tokens.")
+        key = page_key(chat, rel_path, stat, renderer)
+        page_path = os.path.join(chats_output_dir, f"{chat_id}.html")
+        previous = previous_pages.get(chat_id)
+        if previous is not None and previous['key'] == key and os.path.isfile(page_path):
+            pages[chat_id] = previous
+            continue
+        pages[chat_id] = {'key': key, 'tokens': None}
+        jobs.append((chat, rel_path, stat, page_path))
+
+    if workers > 1 and len(jobs) > 1:
+        print(f"[INFO] Rendering {len(jobs)} chat pages with {workers} worker processes.")
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_page_renderer,
+                                 initargs=(template_parts, pack is not None)) as executor:
+            results = list(executor.map(render_chat_page, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
+    else:
+        init_page_renderer(template_parts, pack is not None, pack)
+        results = [render_chat_page(job) for job in jobs]
+    written = 0
+    for chat_id, tokens, page_written in results:
+        if tokens is None:
+            del pages[chat_id]
+            continue
+        pages[chat_id]['tokens'] = tokens
+        if page_written:
+            written += 1
+            count_written(os.path.join(chats_output_dir, f"{chat_id}.html"))
+    count(pages_rendered=len(jobs), pages_written=written)
+    print(f"[INFO] Generated {len(pages)} individual chat pages ({len(jobs)} rendered, {written} written).")
+    return pages
 
 def main():
+    parser = argparse.ArgumentParser(description="Builds the static thortStream website into public/.")
+    parser.add_argument('--no-pack', action='store_true', help="Read every chat from its file, not from the chat pack.")
+    parser.add_argument('--output-dir', default=WEBSITE_OUTPUT_DIR,
+                        help="Directory to build the site in; it is deleted and recreated unless --incremental (default: public/).")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Keep the output directory and only re-render pages whose chat, report row or template changed.")
+    parser.add_argument('--parallel', action='store_true', help="Render chat pages on a process pool.")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="Number of worker processes used with --parallel (default: all cores).")
+    parser.add_argument('--keep-duplicates', action='store_true',
+                        help="Also build pages for the chats the analysis marked as redundant copies (DUPLICATE).")
+    add_trace_arguments(parser)
+    args = parser.parse_args()
+    configure_from_args('build_website_content', args)
+    output_dir = os.path.abspath(args.output_dir)
+
     print("--- Starting thortStream Archive Builder ---")
-    chat_data = read_csv_data(CSV_REPORT_PATH)
+    with span('read_csv'):
+        chat_data = read_csv_data(CSV_REPORT_PATH)
     if not chat_data: return
 
     valid_chats = [c for c in chat_data if c.get('Actual Msg Count') and c.get('Actual Msg Count') != 'N/A']
+    if not args.keep_duplicates: valid_chats = skip_redundant_copies(valid_chats)
+    pack = None if args.no_pack else open_chat_pack()
     sorted_chats = sorted(valid_chats, key=lambda x: int(x['Actual Msg Count']), reverse=True)
-    
+    chats_output_dir = os.path.join(output_dir, 'chats')
+    previous_pages = load_site_manifest(SITE_MANIFEST_PATH, output_dir) if args.incremental else {}
+
     # Setup output directories
-    if os.path.exists(WEBSITE_OUTPUT_DIR): shutil.rmtree(WEBSITE_OUTPUT_DIR)
-    os.makedirs(WEBSITE_OUTPUT_DIR)
-    chats_output_dir = os.path.join(WEBSITE_OUTPUT_DIR, 'chats')
-    os.makedirs(chats_output_dir)
-    docs_output_dir = os.path.join(WEBSITE_OUTPUT_DIR, 'docs')
-    
-    # Copy static files (JS, Docs)
-    shutil.copy(os.path.join(SOURCE_TEMPLATES_DIR, 'search.js'), WEBSITE_OUTPUT_DIR)
-    shutil.copy(os.path.join(SOURCE_TEMPLATES_DIR, 'chat_page.js'), WEBSITE_OUTPUT_DIR)
-    shutil.copytree(SOURCE_DOCS_DIR, docs_output_dir)
-    print(f"[INFO] Copied static assets and docs to output directory: {WEBSITE_OUTPUT_DIR}")
+    with span('copy_static'):
+        if args.incremental and os.path.isdir(chats_output_dir):
+            copied = sync_static_files(output_dir)
+            print(f"[INFO] Static assets and docs are in sync ({copied} files copied): {output_dir}")
+        else:
+            if args.incremental: print("[INFO] No previous site found. Running a full build instead.")
+            previous_pages = {}
+            if os.path.exists(output_dir): shutil.rmtree(output_dir)
+            os.makedirs(chats_output_dir)
+
+            # Copy static files (JS, Docs)
+            for name in STATIC_FILES: shutil.copy(os.path.join(SOURCE_TEMPLATES_DIR, name), output_dir)
+            shutil.copytree(SOURCE_DOCS_DIR, os.path.join(output_dir, 'docs'))
+            print(f"[INFO] Copied static assets and docs to output directory: {output_dir}")
 
     # Read templates
     with open(os.path.join(SOURCE_TEMPLATES_DIR, 'index_template.html'), 'r') as f: index_template = f.read()
     with open(os.path.join(SOURCE_TEMPLATES_DIR, 'chat_page_template.html'), 'r') as f: chat_page_template = f.read()
 
     # Generate individual chat pages
-    for chat in sorted_chats:
-        chat_id, filename, folder = chat.get('Chat ID'), chat.get('Matched Filename'), chat.get('Actual Folder')
-        if not all([chat_id, filename, folder]): continue
-        raw_content = ""
-        try:
-            filepath = os.path.join(ALL_CHATS_DIR, folder, filename)
-            with open(filepath, 'r', encoding='utf-8', errors='ignore') as f: raw_content = f.read()
-        except FileNotFoundError: continue
-        
-        page_html = chat_page_template.replace('{title}', html.escape(chat.get('Title', 'Untitled')))
-        page_html = page_html.replace('{chat_id}', chat_id)
-        page_html = page_html.replace('{msg_count}', chat.get('Actual Msg Count', 'N/A'))
-        page_html = page_html.replace('{filesize}', f"{int(chat.get('Filesize (bytes)', 0)):,}")
-        page_html = page_html.replace('{content}', format_chat_content(raw_content))
-        
-        with open(os.path.join(chats_output_dir, f"{chat_id}.html"), 'w', encoding='utf-8') as f: f.write(page_html)
-    print(f"[INFO] Generated {len(sorted_chats)} individual chat pages.")
+    with span('chat_pages', workers=args.workers if args.parallel else 1):
+        pages = build_chat_pages(sorted_chats, chats_output_dir, chat_page_template, previous_pages, pack,
+                                 workers=args.workers if args.parallel else 1)
+        removed = remove_orphan_pages(chats_output_dir, pages)
+        if removed: print(f"[INFO] Removed {removed} pages of chats that are no longer in the report.")
 
     # Generate the search index
-    create_search_index(sorted_chats, WEBSITE_OUTPUT_DIR)
+    with span('search_index'):
+        write_search_index(sorted_chats, {chat_id: page['tokens'] for chat_id, page in pages.items()}, output_dir)
 
     # Generate the index page content
-    chat_list_html = ""
-    for chat in sorted_chats:
-        chat_list_html += f'<a href="chats/{chat.get("Chat ID")}.html" data-chat-id="{chat.get("Chat ID")}" class="block p-5 bg-gray-800 rounded-lg border border-gray-700 hover:bg-gray-700/80 hover:border-blue-600 transition-all duration-200"><div class="flex justify-between items-center"><h2 class="text-xl font-bold text-white">{html.escape(chat.get("Title"))}</h2><span class="text-lg font-semibold text-blue-400 bg-blue-900/50 px-3 py-1 rounded-full">{chat.get("Actual Msg Count")} msgs</span></div></a>\n'
-    
-    final_index_html = index_template.replace('{chat_list}', chat_list_html)
-    with open(os.path.join(WEBSITE_OUTPUT_DIR, "index.html"), 'w', encoding='utf-8') as f: f.write(final_index_html)
+    with span('index_page'):
+        chat_list_html = []
+        for chat in sorted_chats:
+            chat_list_html.append(f'<a href="chats/{chat.get("Chat ID")}.html" data-chat-id="{chat.get("Chat ID")}" class="block p-5 bg-gray-800 rounded-lg border border-gray-700 hover:bg-gray-700/80 hover:border-blue-600 transition-all duration-200"><div class="flex justify-between items-center"><h2 class="text-xl font-bold text-white">{html.escape(chat.get("Title"))}</h2><span class="text-lg font-semibold text-blue-400 bg-blue-900/50 px-3 py-1 rounded-full">{chat.get("Actual Msg Count")} msgs</span></div></a>\n')
+
+        final_index_html = index_template.replace('{chat_list}', ''.join(chat_list_html))
+        write_if_changed(os.path.join(output_dir, "index.html"), final_index_html)
+        count_written(os.path.join(output_dir, "index.html"))
     print("[INFO] Generated final index.html")
+    if pages != previous_pages: save_site_manifest(SITE_MANIFEST_PATH, output_dir, pages)
 
-    print(f"\n--- Website Build Complete ---\nYou can now open the website by running 'python -m http.server' in the 'public' directory.")
+    print(f"\n--- Website Build Complete ---\nYou can now open the website by running 'python -m http.server' in the '{output_dir}' directory.")
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,619 @@
+# -*- coding: utf-8 -*-
+"""
+Filename:   search_api.py
+Author:     Simon C, assisted by Dora
+Version:    1.5
+Date:       2026-10-17
+Aim:        An asyncio HTTP service that loads the data files built by
+            build_database.py once and answers searches on the server, so a
+            browser no longer downloads database.json and the search indexes
+            to search the archive. It serves:
+                GET /api/status                      what is loaded
+                GET /api/chats?offset=&limit=        chat metadata, most messages first
+                GET /api/chats/<id>[?q=&mode=]       one chat (content and message
+                                                     records), with the query's hits
+                GET /api/search?q=&mode=word|pattern&offset=&limit=[&ids=1]
+                                                     a page of results (BM25-ranked
+                                                     matches first) with snippets,
+                                                     plus every matching ID in order
+                                                     with ids=1
+                GET /api/snippets?q=&mode=&ids=1,2   keyword-in-context snippets
+            Word searches are typo-tolerant like the SPA's: a term that is not
+            in the word index is expanded through search_index_fuzzy.bin, and
+            /api/search reports the expansions as 'corrections'.
+            The binary word index is memory-mapped and its posting lists are
+            decoded per query, and the positions file is memory-mapped too, so
+            hits and snippets are index lookups. The mapped files are the
+            content-hashed copies named in asset_manifest.json, which a rebuild
+            never overwrites, and a replaced Archive unmaps them once its last
+            request is done. Content shards (with their
+            positions) are read when first needed and the most recently used
+            ones stay cached. Results of hot queries
+            are kept in an LRU cache. When a rebuild changes the data files,
+            they are reloaded (and the cache dropped) on the next request.
+            An API request that fails on missing or half-written data files
+            (a rebuild in progress) is answered 503, any other failure 500,
+            both with a JSON error body.
+            Every other path is served from public/ like serve_archive.py
+            (precompressed variants, 304 revalidation and byte ranges), so the SPA and the
+            API share one origin: search_worker.js uses the API when
+            /api/status answers and falls back to the static files otherwise.
+            Run it from the project root:
+                python src/03_website_generation/search_api.py --port 8000
+"""
+
+import os
+import json
+import gzip
+import mmap
+import time
+import asyncio
+import traceback
+import argparse
+import threading
+import posixpath
+import email.utils
+import mimetypes
+from collections import OrderedDict
+from http import HTTPStatus
+from urllib.parse import urlsplit, parse_qs, unquote
+
+from build_database import (rank_bm25, intersect_postings, trigrams, read_word_index_dictionary, lookup_word_postings,
+                            read_positions_table, decode_positions_block, chat_hits, keyword_in_context,
+                            read_fuzzy_index, expand_query_terms,
+                            TRIGRAM_LENGTH, SHARD_DIR_NAME, ASSET_MANIFEST_NAME, POSITIONS_FILE_NAME, FUZZY_FILE_NAME)
+from serve_archive import (accepted_encodings, parse_range, ENCODINGS, IMMUTABLE_PREFIX, IMMUTABLE_CACHE_CONTROL,
+                           REVALIDATE_CACHE_CONTROL, COPY_CHUNK_SIZE)
+
+# --- CONFIGURATION ---
+BASE_DIR = os.getcwd()
+WEBSITE_DIR = os.path.join(BASE_DIR, 'public')
+DEFAULT_PORT = 8000
+
+API_PREFIX = '/api/'
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 5000
+MAX_SNIPPET_IDS = 200       # chats per /api/snippets request
+QUERY_CACHE_SIZE = 256      # searches whose ordered results are kept
+SHARD_CACHE_SIZE = 64       # content shards kept in memory (sharded layout only)
+RELOAD_CHECK_SECONDS = 2.0  # how often a request may check the data files for a rebuild
+KEEP_ALIVE_SECONDS = 15
+MAX_HEADER_LINES = 100
+GZIP_MIN_BYTES = 1024       # smaller JSON responses are sent uncompressed
+GZIP_LEVEL = 5
+# The files whose size and mtime identify a build; a change to any of them triggers a reload.
+DATA_FILE_NAMES = ['database.json', 'catalog.json', 'search_index_word.json', 'search_index_word.bin',
+                   'search_index_trigram.json', 'search_index_ranking.json', POSITIONS_FILE_NAME, FUZZY_FILE_NAME,
+                   ASSET_MANIFEST_NAME]
+
+# --- SCRIPT ---
+
+class ApiError(Exception):
+    """An error answered with a JSON body and the given HTTP status."""
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def data_signature(directory):
+    """Returns the (name, size, mtime) of every data file present, identifying the current build."""
+    signature = []
+    for name in DATA_FILE_NAMES:
+        try:
+            stat = os.stat(os.path.join(directory, name))
+        except FileNotFoundError:
+            continue
+        signature.append((name, stat.st_size, stat.st_mtime_ns))
+    return tuple(signature)
+
+def map_file(path):
+    """Memory-maps a file read-only."""
+    with open(path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def open_positions(path):
+    """Returns (data, {chat ID: (block start, block end)}) for a positions file, or None if there is none."""
+    if not os.path.isfile(path): return None
+    data = map_file(path)
+    return data, read_positions_table(data)
+
+def close_map(data):
+    """Unmaps a memory map; one still exported to a buffer is left to the garbage collector."""
+    try:
+        data.close()
+    except BufferError:
+        pass
+
+class MappedWordIndex:
+    """
+    Read-only view of search_index_word.bin with the dict interface rank_bm25()
+    expects. The file is memory-mapped: only the term dictionary is parsed up
+    front, and a term's posting list is decoded when it is looked up.
+    """
+    def __init__(self, path):
+        self.data = map_file(path)
+        self.dictionary = read_word_index_dictionary(self.data)
+
+    def get(self, term, default=None):
+        if term not in self.dictionary[0]: return default
+        return lookup_word_postings(self.data, self.dictionary, term)
+
+    def __len__(self):
+        return len(self.dictionary[0])
+
+class Archive:
+    """
+    One loaded build: chat metadata, content (or shard locations) and the search
+    indexes. Requests hold it with acquire()/release(); once it is retired (a
+    reload replaced it) and no request holds it, its memory maps are closed.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.signature = data_signature(directory)
+        self.users, self.retired, self.closed = 0, False, False
+        try:
+            with open(os.path.join(directory, ASSET_MANIFEST_NAME), 'r') as f: self.assets = json.load(f)['files']
+        except (FileNotFoundError, ValueError, KeyError):
+            self.assets = {}  # a build without hashed assets: the files are mapped under their plain names
+        catalog_path = os.path.join(directory, 'catalog.json')
+        self.layout = 'sharded' if os.path.isfile(catalog_path) else 'single'
+        with open(catalog_path if self.layout == 'sharded' else os.path.join(directory, 'database.json'), 'r') as f:
+            records = json.load(f)
+
+        # Metadata is what the chat list shows; the single layout also keeps every chat's body in memory.
+        self.chats, self.bodies, self.shards = {}, {}, {}
+        for chat_id, record in records.items():
+            chat_id = int(chat_id)
+            content, messages, shard = record.pop('content', None), record.pop('messages', []), record.pop('shard', None)
+            self.chats[chat_id] = record
+            if shard is None: self.bodies[chat_id] = {'content': content, 'messages': messages}
+            else: self.shards[chat_id] = shard
+        # Positions of the single layout; a sharded build keeps them next to each shard (see load_shard()).
+        self.positions = open_positions(self.mapped_path(POSITIONS_FILE_NAME)) if self.layout == 'single' else None
+        # The SPA's default order: most messages first, ties by ID.
+        self.default_order = sorted(self.chats, key=lambda chat_id: (-self.chats[chat_id]['msg_count'], chat_id))
+
+        binary_path = self.mapped_path('search_index_word.bin')
+        if os.path.isfile(binary_path):
+            self.word_index, self.word_index_format = MappedWordIndex(binary_path), 'binary'
+        else:
+            with open(os.path.join(directory, 'search_index_word.json'), 'r') as f: self.word_index = json.load(f)
+            self.word_index_format = 'json'
+        with open(os.path.join(directory, 'search_index_trigram.json'), 'r') as f: self.trigram_index = json.load(f)
+        fuzzy_path = os.path.join(directory, FUZZY_FILE_NAME)
+        if os.path.isfile(fuzzy_path):
+            with open(fuzzy_path, 'rb') as f: self.fuzzy = read_fuzzy_index(f.read())
+        else:
+            self.fuzzy = None  # an older build: misspelled terms then simply match nothing
+        try:
+            with open(os.path.join(directory, 'search_index_ranking.json'), 'r') as f: self.ranking = json.load(f)
+            self.ranking['doc_lengths'] = {int(chat_id): length for chat_id, length in self.ranking['doc_lengths'].items()}
+        except FileNotFoundError:
+            self.ranking = None  # word search then returns its matches unranked, like the SPA
+
+        self.lock = threading.Lock()
+        self.shard_cache = OrderedDict()  # shard number -> ({chat ID string: body}, positions), oldest first
+        self.query_cache = OrderedDict()  # (mode, query) -> (ordered IDs or None, ranked IDs), oldest first
+        self.cache_hits = self.cache_misses = 0
+
+    def mapped_path(self, name):
+        """
+        Returns the file to memory-map for a data file: its content-hashed copy,
+        which the builder never replaces (a mapped file cannot be replaced on
+        Windows), or the plain file if the build published none.
+        """
+        asset = self.assets.get(name)
+        if asset and os.path.isfile(os.path.join(self.directory, asset)): return os.path.join(self.directory, asset)
+        return os.path.join(self.directory, name)
+
+    def acquire(self):
+        with self.lock:
+            self.users += 1
+
+    def release(self):
+        with self.lock:
+            self.users -= 1
+        if self.retired and self.users == 0: self.close()
+
+    def retire(self):
+        """Marks the archive as replaced; it is closed as soon as no request holds it."""
+        self.retired = True
+        if self.users == 0: self.close()
+
+    def close(self):
+        """Closes the memory maps of the word index and the positions files."""
+        with self.lock:
+            if self.closed: return
+            self.closed = True
+            positions = [self.positions] + [shard[1] for shard in self.shard_cache.values()]
+            self.shard_cache.clear()
+        if isinstance(self.word_index, MappedWordIndex): close_map(self.word_index.data)
+        for located in positions:
+            if located is not None: close_map(located[0])
+
+    def status(self):
+        return {
+            'api': 'thortstream', 'chats': len(self.chats), 'layout': self.layout,
+            'word_index_format': self.word_index_format, 'ranked': self.ranking is not None,
+            'fuzzy': self.fuzzy is not None,
+            'built': max((mtime for _, _, mtime in self.signature), default=0) // 1000000,
+            'query_cache': {'size': len(self.query_cache), 'hits': self.cache_hits, 'misses': self.cache_misses}
+        }
+
+    def load_shard(self, number):
+        """Returns (bodies, positions) of a content shard."""
+        with self.lock:
+            shard = self.shard_cache.pop(number, None)
+        if shard is None:
+            with open(os.path.join(self.directory, SHARD_DIR_NAME, f"{number}.json"), 'r') as f: bodies = json.load(f)
+            shard = bodies, open_positions(self.mapped_path(f"{SHARD_DIR_NAME}/{number}.bin"))
+        with self.lock:
+            self.shard_cache[number] = shard
+            while len(self.shard_cache) > SHARD_CACHE_SIZE: self.shard_cache.popitem(last=False)
+        return shard
+
+    def chat_body(self, chat_id):
+        """Returns {content, messages} for a chat, reading its shard if needed."""
+        if chat_id in self.bodies: return self.bodies[chat_id]
+        if chat_id not in self.shards: return {'content': None, 'messages': []}
+        return self.load_shard(self.shards[chat_id])[0].get(str(chat_id), {'content': None, 'messages': []})
+
+    def chat_hits(self, chat_id, query, mode):
+        """Returns the query's hits in a chat as dicts (see chat_hits()), or None if the build has no positions."""
+        body = self.chat_body(chat_id)
+        if not query or not body['content']: return []
+        positions = {}
+        if mode == 'word':
+            located = self.positions if chat_id in self.bodies else self.load_shard(self.shards[chat_id])[1]
+            if located is None: return None
+            data, table = located
+            # Corrected terms are highlighted where their expansions occur.
+            terms = [term for group in self.expand_terms(query) for term in group]
+            query = ' '.join(terms)
+            if terms and chat_id in table: positions = decode_positions_block(data, table[chat_id][0], set(terms))
+        return [{'message': number, 'start': start, 'end': end, 'term': term}
+                for number, start, end, term in chat_hits(body['content'], body['messages'], positions, query, mode)]
+
+    def snippet(self, chat_id, query, mode):
+        """Returns the keyword-in-context snippet of the query in a chat, or None."""
+        hits = self.chat_hits(chat_id, query, mode)
+        if not hits: return None
+        body = self.chat_body(chat_id)
+        return keyword_in_context(body['content'], body['messages'],
+                                  [(hit['message'], hit['start'], hit['end'], hit['term']) for hit in hits])
+
+    def expand_terms(self, query):
+        """Returns the word search terms (2+ characters) of a query, each as the list of terms it stands for."""
+        return expand_query_terms([term for term in query.split() if len(term) > 1], self.word_index, self.fuzzy)
+
+    def corrections(self, query):
+        """Returns {query term: expansions} for the terms of a word search that were corrected."""
+        return {group_term: group for group_term, group in zip([term for term in query.split() if len(term) > 1],
+                                                             self.expand_terms(query)) if group != [group_term]}
+
+    def word_matches(self, query):
+        """
+        Mirrors the SPA's word search: every term (2+ characters), or one of its
+        expansions if it was corrected, must occur; matches are ranked with BM25.
+        """
+        groups = self.expand_terms(query)
+        if not groups: return None, []
+        matched = intersect_postings([sorted(set().union(*[self.word_index.get(term, []) for term in group]))
+                                      for group in groups])
+        ranked = [chat_id for chat_id, _ in rank_bm25(self.word_index, self.ranking, groups)] if self.ranking else []
+        return matched, ranked
+
+    def pattern_matches(self, query):
+        """Mirrors the SPA's Pattern Search: trigram candidates confirmed against the lowercased content."""
+        if len(query) < TRIGRAM_LENGTH: return None, []
+        candidates = intersect_postings([self.trigram_index.get(gram, []) for gram in trigrams(query)])
+        matched = []
+        for chat_id in candidates:
+            content = self.chat_body(chat_id)['content'] if chat_id in self.chats else None
+            if content and query in content.lower(): matched.append(chat_id)
+        return matched, []
+
+    def search(self, query, mode):
+        """
+        Returns (IDs in display order or None if the query does not filter,
+        ranked IDs, cache hit). Ranked matches come first, the rest follow in
+        the default order, exactly as the SPA lists them.
+        """
+        key = (mode, query)
+        with self.lock:
+            cached = self.query_cache.pop(key, None)
+            if cached is not None:
+                self.query_cache[key] = cached
+                self.cache_hits += 1
+                return cached + (True,)
+            self.cache_misses += 1
+        matched, ranked = (self.pattern_matches if mode == 'pattern' else self.word_matches)(query)
+        if matched is None:
+            ordered = None
+        else:
+            matched, ranked_set = set(matched), set(ranked)
+            ordered = ranked + [chat_id for chat_id in self.default_order if chat_id in matched and chat_id not in ranked_set]
+        with self.lock:
+            self.query_cache[key] = (ordered, ranked)
+            while len(self.query_cache) > QUERY_CACHE_SIZE: self.query_cache.popitem(last=False)
+        return ordered, ranked, False
+
+def page_arguments(params):
+    """Reads offset and limit from the query parameters."""
+    try:
+        offset = int(params.get('offset', ['0'])[0])
+        limit = int(params.get('limit', [str(DEFAULT_PAGE_SIZE)])[0])
+    except ValueError:
+        raise ApiError(HTTPStatus.BAD_REQUEST, "offset and limit must be integers")
+    if offset < 0 or not 0 < limit <= MAX_PAGE_SIZE:
+        raise ApiError(HTTPStatus.BAD_REQUEST, f"offset must be >= 0 and limit between 1 and {MAX_PAGE_SIZE}")
+    return offset, limit
+
+def search_arguments(params):
+    """Reads the query (lowercased, as the SPA sends it) and the search mode from the query parameters."""
+    mode = params.get('mode', ['word'])[0]
+    if mode not in ('word', 'pattern'): raise ApiError(HTTPStatus.BAD_REQUEST, "mode must be 'word' or 'pattern'")
+    return params.get('q', [''])[0].lower().strip(), mode
+
+class SearchServer:
+    """Routes requests to the loaded Archive, reloading it when the build changes."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.archive = Archive(directory)
+        self.last_check = time.monotonic()
+        self.reload_lock = asyncio.Lock()
+
+    async def current_archive(self):
+        """Returns the loaded archive, first reloading it if the data files changed since it was loaded."""
+        if time.monotonic() - self.last_check < RELOAD_CHECK_SECONDS: return self.archive
+        async with self.reload_lock:
+            if time.monotonic() - self.last_check < RELOAD_CHECK_SECONDS: return self.archive
+            loop = asyncio.get_running_loop()
+            if await loop.run_in_executor(None, data_signature, self.directory) != self.archive.signature:
+                try:
+                    archive = await loop.run_in_executor(None, Archive, self.directory)
+                    self.archive, previous = archive, self.archive
+                    previous.retire()
+                    print(f"[INFO] Data files changed. Reloaded {len(self.archive.chats):,} chats.")
+                except (OSError, ValueError, KeyError) as e:
+                    print(f"[WARNING] Data files changed but could not be reloaded (build still running?): {e}")
+            self.last_check = time.monotonic()
+        return self.archive
+
+    async def api(self, path, params):
+        """Answers an /api/ request; returns the JSON-serialisable body."""
+        archive = await self.current_archive()
+        archive.acquire()  # no await in between, so a reload cannot close it first
+        try:
+            return await self.answer(archive, path, params)
+        finally:
+            archive.release()
+
+    async def answer(self, archive, path, params):
+        """Answers an /api/ request from one archive."""
+        loop = asyncio.get_running_loop()
+        route = path[len(API_PREFIX):].strip('/').split('/')
+        if route == ['status']:
+            return archive.status()
+        if route == ['chats']:
+            offset, limit = page_arguments(params)
+            return {'total': len(archive.chats), 'offset': offset,
+                    'chats': [archive.chats[chat_id] for chat_id in archive.default_order[offset:offset + limit]]}
+        if len(route) == 2 and route[0] == 'chats':
+            try:
+                chat_id = int(route[1])
+            except ValueError:
+                raise ApiError(HTTPStatus.BAD_REQUEST, "chat ID must be an integer")
+            if chat_id not in archive.chats: raise ApiError(HTTPStatus.NOT_FOUND, f"no chat {chat_id}")
+            query, mode = search_arguments(params)
+            body = await loop.run_in_executor(None, archive.chat_body, chat_id)
+            hits = await loop.run_in_executor(None, archive.chat_hits, chat_id, query, mode)
+            return {**archive.chats[chat_id], **body, 'hits': hits}
+        if route == ['snippets']:
+            query, mode = search_arguments(params)
+            try:
+                chat_ids = [int(chat_id) for chat_id in params.get('ids', [''])[0].split(',') if chat_id]
+            except ValueError:
+                raise ApiError(HTTPStatus.BAD_REQUEST, "ids must be comma-separated integers")
+            if len(chat_ids) > MAX_SNIPPET_IDS: raise ApiError(HTTPStatus.BAD_REQUEST, f"at most {MAX_SNIPPET_IDS} ids")
+            chat_ids = [chat_id for chat_id in chat_ids if chat_id in archive.chats]
+            snippets = await loop.run_in_executor(None, lambda: {chat_id: archive.snippet(chat_id, query, mode)
+                                                                 for chat_id in chat_ids})
+            return {'query': query, 'mode': mode, 'snippets': snippets}
+        if route == ['search']:
+            query, mode = search_arguments(params)
+            offset, limit = page_arguments(params)
+            started = time.perf_counter()
+            # Searches run in a worker thread, so a slow pattern search never stalls other connections.
+            ordered, ranked, cached = await loop.run_in_executor(None, archive.search, query, mode)
+            ids = archive.default_order if ordered is None else ordered
+            page = ids[offset:offset + limit]
+            snippets = {}
+            if ordered is not None:
+                snippets = await loop.run_in_executor(None, lambda: {chat_id: archive.snippet(chat_id, query, mode)
+                                                                     for chat_id in page})
+            result = {
+                'query': query, 'mode': mode, 'filtered': ordered is not None, 'total': len(ids), 'offset': offset,
+                'ranked': ranked, 'corrections': archive.corrections(query) if mode == 'word' else {},
+                'results': [dict(archive.chats[chat_id], snippet=snippets.get(chat_id)) for chat_id in page],
+                'cached': cached, 'elapsed_ms': round((time.perf_counter() - started) * 1000, 2)
+            }
+            if params.get('ids', ['0'])[0] == '1': result['ids'] = ordered
+            return result
+        raise ApiError(HTTPStatus.NOT_FOUND, f"unknown API path '{path}'")
+
+    def translate_path(self, url_path):
+        """
+        Maps a URL path to a file path under the served directory, or None if it
+        would leave it. Like SimpleHTTPRequestHandler.translate_path, a segment
+        that holds a separator of any platform ('\\' included, whatever the
+        server runs on), a drive or '..' is refused; the resolved path must also
+        still be inside the directory.
+        """
+        parts = []
+        for part in posixpath.normpath(unquote(url_path)).split('/'):
+            if part in ('', '.'): continue
+            if part == '..' or '\\' in part or ':' in part or os.path.splitdrive(part)[0]: return None
+            parts.append(part)
+        path = os.path.join(self.directory, *parts)
+        root = os.path.realpath(self.directory)
+        resolved = os.path.realpath(path)
+        if resolved != root and not resolved.startswith(root.rstrip(os.sep) + os.sep): return None
+        return path
+
+    def static_file(self, url_path, headers):
+        """
+        Resolves a static request to (status, headers, file path or None, (first byte, last byte)).
+        Picks a precompressed variant and applies If-None-Match and Range like serve_archive.py.
+        """
+        path = self.translate_path(url_path)
+        if path is None: return HTTPStatus.NOT_FOUND, {}, None, None
+        if os.path.isdir(path): path = os.path.join(path, 'index.html')
+        if not os.path.isfile(path): return HTTPStatus.NOT_FOUND, {}, None, None
+
+        chosen_path, coding = path, None
+        accepted = accepted_encodings(headers.get('accept-encoding'))
+        for token, suffix in ENCODINGS:
+            if token in accepted and os.path.isfile(path + suffix):
+                chosen_path, coding = path + suffix, token
+                break
+        stat = os.stat(chosen_path)
+        etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}{"-" + coding if coding else ""}"'
+        response_headers = {
+            'ETag': etag, 'Last-Modified': email.utils.formatdate(stat.st_mtime, usegmt=True),
+            'Cache-Control': IMMUTABLE_CACHE_CONTROL if url_path.startswith(IMMUTABLE_PREFIX) else REVALIDATE_CACHE_CONTROL,
+            'Vary': 'Accept-Encoding'
+        }
+        if_none_match = headers.get('if-none-match')
+        if if_none_match and any(tag.strip() in ('*', etag, f'W/{etag}') for tag in if_none_match.split(',')):
+            return HTTPStatus.NOT_MODIFIED, response_headers, None, None
+
+        # Range applies to the chosen variant's bytes; a stale If-Range gets the whole file.
+        size = stat.st_size
+        byte_range = None
+        if_range = headers.get('if-range')
+        if 'range' in headers and (if_range is None or if_range.strip() == etag):
+            byte_range = parse_range(headers['range'], size)
+        if byte_range == 'unsatisfiable':
+            response_headers.update({'Content-Range': f'bytes */{size}', 'Content-Length': '0'})
+            return HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE, response_headers, None, None
+        start, end = byte_range if byte_range else (0, size - 1)
+        response_headers['Content-Type'] = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        response_headers['Content-Length'] = str(max(0, end - start + 1))
+        if byte_range: response_headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response_headers['Accept-Ranges'] = 'bytes'
+        if coding: response_headers['Content-Encoding'] = coding
+        return (HTTPStatus.PARTIAL_CONTENT if byte_range else HTTPStatus.OK), response_headers, chosen_path, (start, end)
+
+    async def handle_connection(self, reader, writer):
+        """Serves HTTP/1.1 requests on one connection until the client closes it or goes idle."""
+        try:
+            while True:
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), KEEP_ALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    break
+                if not request_line: break
+                headers = {}
+                for _ in range(MAX_HEADER_LINES):
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''): break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                parts = request_line.decode('latin-1').split()
+                if len(parts) != 3:
+                    await self.respond(writer, HTTPStatus.BAD_REQUEST, {'Connection': 'close'}, b'')
+                    break
+                method, target, version = parts
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                await self.handle_request(writer, method, target, headers, keep_alive)
+                if not keep_alive: break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle_request(self, writer, method, target, headers, keep_alive):
+        connection = {'Connection': 'keep-alive' if keep_alive else 'close'}
+        if method not in ('GET', 'HEAD'):
+            await self.respond(writer, HTTPStatus.METHOD_NOT_ALLOWED, {**connection, 'Allow': 'GET, HEAD'}, b'')
+            return
+        url = urlsplit(target)
+        send_body = method == 'GET'
+        if url.path.startswith(API_PREFIX):
+            try:
+                status, body = HTTPStatus.OK, await self.api(url.path, parse_qs(url.query))
+            except ApiError as e:
+                status, body = e.status, {'error': str(e)}
+            except (FileNotFoundError, ValueError) as e:
+                # A data file is missing or half-written: a rebuild is replacing the indexes.
+                print(f"[WARNING] {url.path} failed on the data files (rebuild in progress?): {e}")
+                status, body = HTTPStatus.SERVICE_UNAVAILABLE, {'error': "The search index is missing or being rebuilt; try again shortly."}
+            except Exception:
+                print(f"[ERROR] {url.path} failed:")
+                traceback.print_exc()
+                status, body = HTTPStatus.INTERNAL_SERVER_ERROR, {'error': "Internal server error."}
+            payload = json.dumps(body, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+            response_headers = {**connection, 'Content-Type': 'application/json; charset=utf-8', 'Cache-Control': 'no-store',
+                                'Vary': 'Accept-Encoding'}
+            if len(payload) >= GZIP_MIN_BYTES and 'gzip' in accepted_encodings(headers.get('accept-encoding')):
+                payload = await asyncio.get_running_loop().run_in_executor(None, gzip.compress, payload, GZIP_LEVEL)
+                response_headers['Content-Encoding'] = 'gzip'
+            await self.respond(writer, status, response_headers, payload if send_body else b'', len(payload))
+            return
+
+        status, response_headers, path, byte_range = self.static_file(url.path, headers)
+        response_headers.update(connection)
+        if path is None:
+            await self.respond(writer, status, response_headers, b'')
+            return
+        await self.respond(writer, status, response_headers, b'', int(response_headers['Content-Length']))
+        if not send_body: return
+        start, end = byte_range
+        with open(path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(COPY_CHUNK_SIZE, remaining))
+                if not chunk: break
+                writer.write(chunk)
+                remaining -= len(chunk)
+                await writer.drain()
+
+    async def respond(self, writer, status, headers, body, content_length=None):
+        """Writes the status line, headers (Content-Length defaults to the body's) and body."""
+        lines = [f"HTTP/1.1 {status.value} {status.phrase}"]
+        headers.setdefault('Content-Length', str(len(body) if content_length is None else content_length))
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+
+async def serve(directory, bind, port):
+    started = time.perf_counter()
+    server = SearchServer(directory)
+    archive = server.archive
+    print(f"[INFO] Loaded {len(archive.chats):,} chats ({archive.layout} layout, {archive.word_index_format} word index"
+          f"{', BM25 ranking' if archive.ranking else ''}) in {time.perf_counter() - started:.2f}s.")
+    listener = await asyncio.start_server(server.handle_connection, bind, port)
+    print(f"[INFO] Serving '{directory}' and the search API on http://{bind}:{port}/ (Ctrl+C to stop).")
+    async with listener:
+        await listener.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serves the thortStream archive with a server-side search API.")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--bind', default='127.0.0.1', help="Address to listen on (default: 127.0.0.1).")
+    parser.add_argument('--directory', default=WEBSITE_DIR, help="Folder with the built site (default: public/).")
+    args = parser.parse_args()
+
+    if not os.path.isfile(os.path.join(args.directory, 'search_index_trigram.json')):
+        print(f"[ERROR] No search indexes in '{args.directory}'. Run build_database.py first, from the project root.")
+        return
+    try:
+        asyncio.run(serve(args.directory, args.bind, args.port))
+    except KeyboardInterrupt:
+        print("\n[INFO] Server stopped.")
+
+if __name__ == '__main__':
+    main()
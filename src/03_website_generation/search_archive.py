@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Filename:   search_archive.py
+Author:     Simon C, assisted by Dora
+Version:    1.1
+Date:       2026-10-17
+Aim:        Query API and command line for the SQLite FTS5 database written by
+            build_search_db.py. Queries support phrases ("exact words"),
+            prefixes (pyth*), boolean operators (AND, OR, NOT, or -word) and
+            title-only terms (title:dora). Hits are individual messages ranked
+            with FTS5's BM25 (title matches weigh more) and come with a short
+            snippet; --per-chat keeps only the best message of each chat. A
+            title is indexed with its chat's first message, so a title match
+            is one hit per chat, and the terms of a query must all occur in
+            the same message (or in the title and the first message).
+            Use it from Python:
+                from search_archive import open_archive, search
+                hits = search(open_archive(), 'scraper -selenium')
+            or from the project root:
+                python src/03_website_generation/search_archive.py "\"rate limit\" pyth*" --per-chat
+"""
+
+import os
+import json
+import sqlite3
+import argparse
+
+# --- CONFIGURATION ---
+BASE_DIR = os.getcwd()
+SEARCH_DB_PATH = os.path.join(BASE_DIR, 'output', 'search', 'archive.sqlite3')
+
+DEFAULT_LIMIT = 20
+# BM25 column weights for (title, body): a title match counts as much as five body matches.
+TITLE_WEIGHT = 5.0
+BODY_WEIGHT = 1.0
+SNIPPET_TOKENS = 16
+SNIPPET_MARKS = ('[', ']')
+BOOLEAN_OPERATORS = ('AND', 'OR', 'NOT')
+COLUMN_PREFIXES = ('title:', 'body:')
+
+# --- SCRIPT ---
+
+def open_archive(db_path=SEARCH_DB_PATH):
+    """Opens the search database read-only."""
+    if not os.path.isfile(db_path):
+        raise FileNotFoundError(f"No search database at '{db_path}'. Run build_search_db.py first.")
+    return sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True)
+
+def quote_term(term):
+    """Returns term as an FTS5 string, so punctuation such as 'c++' is never read as query syntax."""
+    return '"' + term.replace('"', '""') + '"'
+
+def split_query(text):
+    """Splits a query into words and "quoted phrases" (quotes kept); an unclosed quote runs to the end."""
+    parts, position = [], 0
+    while position < len(text):
+        if text[position].isspace():
+            position += 1
+            continue
+        start = position
+        while position < len(text) and not text[position].isspace():
+            if text[position] == '"':
+                closing = text.find('"', position + 1)
+                position = len(text) if closing == -1 else closing + 1
+            else:
+                position += 1
+        parts.append(text[start:position])
+    return parts
+
+def to_fts_query(text):
+    """
+    Translates the friendly query syntax into an FTS5 MATCH expression:
+        word         must appear (terms are ANDed)     "two words"  exact phrase
+        pyth*        prefix                            a OR b       either term
+        -word / NOT  must not appear                   title:word   only in titles
+    Returns None if nothing searchable is left.
+    """
+    positives, negatives, negate_next = [], [], False
+    for part in split_query(text):
+        if part in BOOLEAN_OPERATORS:
+            if part == 'NOT': negate_next = True
+            elif positives and positives[-1] not in BOOLEAN_OPERATORS: positives.append(part)
+            continue
+        negate = negate_next or (part.startswith('-') and len(part) > 1)
+        if part.startswith('-') and len(part) > 1: part = part[1:]
+        negate_next = False
+        column = next((prefix for prefix in COLUMN_PREFIXES if part.lower().startswith(prefix)), '')
+        part = part[len(column):]
+        prefix = part.endswith('*') and not part.endswith('"*')
+        phrase = part.strip('*').strip('"')
+        if not phrase.strip(): continue
+        term = (column.replace(':', ' : ') if column else '') + quote_term(phrase) + ('*' if prefix else '')
+        (negatives if negate else positives).append(term)
+    while positives and positives[-1] in BOOLEAN_OPERATORS: positives.pop()
+    if not positives: return None
+    query = ' '.join(positives)
+    for term in negatives: query = f"({query}) NOT {term}"
+    return query
+
+def search(connection, query, limit=DEFAULT_LIMIT, per_chat=False, raw=False, chat_id=None):
+    """
+    Runs a query and returns hits, best first, as dicts with chat_id, title,
+    position (message number), role, score (higher is better) and snippet.
+    raw=True passes the query to FTS5 unchanged; chat_id limits the search to one chat.
+    """
+    match = query if raw else to_fts_query(query)
+    if not match: return []
+    where, parameters = "messages_fts MATCH ?", [match]
+    if chat_id is not None:
+        where += " AND messages.chat_id = ?"
+        parameters.append(chat_id)
+    hits = f"""
+        SELECT messages.chat_id, chats.title, messages.position, messages.role,
+               -bm25(messages_fts, {TITLE_WEIGHT}, {BODY_WEIGHT}) AS score,
+               snippet(messages_fts, -1, ?, ?, '...', {SNIPPET_TOKENS}) AS snippet
+        FROM messages_fts
+        JOIN messages ON messages.id = messages_fts.rowid
+        JOIN chats ON chats.id = messages.chat_id
+        WHERE {where}
+    """
+    parameters = list(SNIPPET_MARKS) + parameters
+    if per_chat:
+        sql = f"""
+            SELECT chat_id, title, position, role, score, snippet FROM (
+                SELECT *, ROW_NUMBER() OVER (PARTITION BY chat_id ORDER BY score DESC, position) AS best
+                FROM ({hits})
+            ) WHERE best = 1 ORDER BY score DESC, chat_id LIMIT ?
+        """
+    else:
+        sql = hits + " ORDER BY score DESC, messages.chat_id, messages.position LIMIT ?"
+    rows = connection.execute(sql, parameters + [limit]).fetchall()
+    return [{'chat_id': row[0], 'title': row[1], 'position': row[2], 'role': row[3], 'score': round(row[4], 4),
+             'snippet': row[5]} for row in rows]
+
+def count_matches(connection, query, raw=False):
+    """Returns (matching messages, matching chats) for a query."""
+    match = query if raw else to_fts_query(query)
+    if not match: return 0, 0
+    return connection.execute("""
+        SELECT COUNT(*), COUNT(DISTINCT messages.chat_id) FROM messages_fts
+        JOIN messages ON messages.id = messages_fts.rowid WHERE messages_fts MATCH ?
+    """, (match,)).fetchone()
+
+def main():
+    parser = argparse.ArgumentParser(description="Searches the archive's SQLite FTS5 database.")
+    parser.add_argument('query', help="Words, \"phrases\", prefix*, AND/OR/NOT, -word, title:word.")
+    parser.add_argument('--db', default=SEARCH_DB_PATH, help="Database file (default: output/search/archive.sqlite3).")
+    parser.add_argument('--limit', type=int, default=DEFAULT_LIMIT, help=f"Maximum hits (default: {DEFAULT_LIMIT}).")
+    parser.add_argument('--per-chat', action='store_true', help="Show only the best message of each chat.")
+    parser.add_argument('--chat', type=int, help="Only search this chat ID.")
+    parser.add_argument('--raw', action='store_true', help="Pass the query to FTS5 unchanged (full FTS5 syntax).")
+    parser.add_argument('--json', action='store_true', help="Print the hits as JSON.")
+    args = parser.parse_args()
+
+    try:
+        connection = open_archive(args.db)
+        hits = search(connection, args.query, args.limit, args.per_chat, args.raw, args.chat)
+        messages, chats = count_matches(connection, args.query, args.raw)
+    except FileNotFoundError as e:
+        print(f"[ERROR] {e}")
+        return
+    except sqlite3.OperationalError as e:
+        print(f"[ERROR] Invalid query: {e}")
+        return
+
+    if not args.raw and to_fts_query(args.query) is None:
+        print("[WARNING] Nothing to search for: the query has no positive terms.")
+        return
+    if args.json:
+        print(json.dumps(hits, ensure_ascii=False, indent=2))
+        return
+    print(f"[INFO] {messages:,} matching messages in {chats:,} chats (FTS5 query: {args.query if args.raw else to_fts_query(args.query)})")
+    for hit in hits:
+        print(f"\n#{hit['chat_id']} {hit['title']}  [message {hit['position'] + 1}, {hit['role']}, score {hit['score']}]")
+        print("    " + " ".join(hit['snippet'].split()))
+
+if __name__ == '__main__':
+    main()
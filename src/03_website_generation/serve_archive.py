@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Filename:   serve_archive.py
+Author:     Simon C, assisted by Dora
+Version:    1.0
+Date:       2026-10-17
+Aim:        Serves the public/ folder for local browsing, replacing
+            'python -m http.server'. It sends the brotli or gzip variant that
+            build_database.py precompressed when the browser accepts it,
+            answers conditional requests (If-None-Match / If-Modified-Since)
+            with 304, supports single byte-range requests, and marks the
+            content-hashed files under assets/ as cacheable forever. Everything
+            else is revalidated on each visit, so a repeat visit costs a few
+            304 responses instead of the whole archive.
+            Run it from the project root:
+                python src/03_website_generation/serve_archive.py --port 8000
+"""
+
+import os
+import re
+import email.utils
+import argparse
+import mimetypes
+from http import HTTPStatus
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+# --- CONFIGURATION ---
+BASE_DIR = os.getcwd()
+WEBSITE_DIR = os.path.join(BASE_DIR, 'public')
+DEFAULT_PORT = 8000
+
+# Files under assets/ carry a content hash in their name (see publish_assets() in build_database.py).
+IMMUTABLE_PREFIX = '/assets/'
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+# Precompressed variants, in order of preference: (Accept-Encoding token, file suffix).
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+COPY_CHUNK_SIZE = 64 * 1024
+
+# --- SCRIPT ---
+
+def accepted_encodings(header):
+    """Returns the content codings an Accept-Encoding header allows (q=0 excluded)."""
+    accepted = set()
+    for part in (header or '').split(','):
+        token, _, params = part.strip().partition(';')
+        if params.strip().replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'): continue
+        if token: accepted.add(token.strip().lower())
+    return accepted
+
+def parse_range(header, size):
+    """
+    Parses a single 'bytes=start-end' range against a representation of the given
+    size. Returns (start, end) inclusive, None to serve the whole file (missing or
+    multi-range header), or 'unsatisfiable'.
+    """
+    match = RANGE_PATTERN.match((header or '').strip())
+    if not match or match.group(1) == match.group(2) == '': return None
+    first, last = match.group(1), match.group(2)
+    if first == '':
+        length = int(last)  # suffix range: the final N bytes
+        if length == 0: return 'unsatisfiable'
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end: return 'unsatisfiable'
+    return start, end
+
+class ArchiveRequestHandler(SimpleHTTPRequestHandler):
+    """Static file handler with precompressed variants, validators, cache headers and Range support."""
+
+    protocol_version = 'HTTP/1.1'  # keep-alive, so a repeat visit's revalidations share one connection
+
+    def do_GET(self):
+        self.serve(send_body=True)
+
+    def do_HEAD(self):
+        self.serve(send_body=False)
+
+    def serve(self, send_body):
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            if not self.path.split('?', 1)[0].endswith('/'):
+                # Let the base class send its redirect to the slash-terminated URL.
+                handle = super().send_head()
+                if handle: handle.close()
+                return
+            path = os.path.join(path, 'index.html')
+        if not os.path.isfile(path):
+            self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+            return
+
+        # Pick the smallest variant the client accepts; Range then applies to that variant's bytes.
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        chosen_path, coding = path, None
+        accepted = accepted_encodings(self.headers.get('Accept-Encoding'))
+        for token, suffix in ENCODINGS:
+            if token in accepted and os.path.isfile(path + suffix):
+                chosen_path, coding = path + suffix, token
+                break
+
+        stat = os.stat(chosen_path)
+        etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}{"-" + coding if coding else ""}"'
+        last_modified = email.utils.formatdate(stat.st_mtime, usegmt=True)
+        url_path = self.path.split('?', 1)[0]
+        cache_control = IMMUTABLE_CACHE_CONTROL if url_path.startswith(IMMUTABLE_PREFIX) else REVALIDATE_CACHE_CONTROL
+
+        if self.is_not_modified(etag, stat.st_mtime):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_validators(etag, last_modified, cache_control)
+            self.end_headers()
+            return
+
+        size = stat.st_size
+        byte_range = None
+        if_range = self.headers.get('If-Range')
+        if 'Range' in self.headers and (if_range is None or if_range.strip() == etag):
+            byte_range = parse_range(self.headers['Range'], size)
+        if byte_range == 'unsatisfiable':
+            self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+            self.send_header('Content-Range', f'bytes */{size}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        start, end = byte_range if byte_range else (0, size - 1)
+        self.send_response(HTTPStatus.PARTIAL_CONTENT if byte_range else HTTPStatus.OK)
+        self.send_header('Content-Type', content_type)
+        if coding: self.send_header('Content-Encoding', coding)
+        self.send_header('Content-Length', str(max(0, end - start + 1)))
+        if byte_range: self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_validators(etag, last_modified, cache_control)
+        self.end_headers()
+        if not send_body: return
+
+        with open(chosen_path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(COPY_CHUNK_SIZE, remaining))
+                if not chunk: break
+                self.wfile.write(chunk)
+                remaining -= len(chunk)
+
+    def is_not_modified(self, etag, mtime):
+        """Applies If-None-Match, or If-Modified-Since when no entity tag was sent."""
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            return '*' in tags or etag in tags or f'W/{etag}' in tags
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+            return since is not None and int(mtime) <= since.timestamp()
+        return False
+
+    def send_validators(self, etag, last_modified, cache_control):
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', last_modified)
+        self.send_header('Cache-Control', cache_control)
+        self.send_header('Vary', 'Accept-Encoding')
+
+def main():
+    parser = argparse.ArgumentParser(description="Serves the thortStream archive with compression and caching.")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--bind', default='127.0.0.1', help="Address to listen on (default: 127.0.0.1).")
+    parser.add_argument('--directory', default=WEBSITE_DIR, help="Folder to serve (default: public/).")
+    args = parser.parse_args()
+
+    if not os.path.isfile(os.path.join(args.directory, 'index.html')):
+        print(f"[ERROR] No index.html in '{args.directory}'. Run this from the project root after building the site.")
+        return
+
+    handler = lambda *handler_args, **kwargs: ArchiveRequestHandler(*handler_args, directory=args.directory, **kwargs)
+    server = ThreadingHTTPServer((args.bind, args.port), handler)
+    print(f"[INFO] Serving '{args.directory}' on http://{args.bind}:{args.port}/ (Ctrl+C to stop).")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    print("\n[INFO] Server stopped.")
+
+if __name__ == '__main__':
+    main()
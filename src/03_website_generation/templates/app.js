@@ -1,24 +1,41 @@
 /**
  * @filename  app.js
  * @author    Simon C, assisted by Dora
- * @version   2.2 (Definitive Diagnostic)
- * @date      2025-08-12
+ * @version   3.4 (Typo-Tolerant Search)
+ * @date      2026-10-17
  * @aim       The core client-side application for the thortStream archive.
  * @precursor Evolved from search.js and chat_page.js from the static site
  * generator version of the project.
  */
 document.addEventListener('DOMContentLoaded', () => {
-    // This is the most basic test. If this alert does not appear,
-    // the browser is not executing the script's main body for some reason.
-    alert("Dora Engine Initialized (Inside DOMContentLoaded)");
-
     const app = document.getElementById('app');
-    let allChats = {};
-    let wordIndex = {};
-    let fullTextIndex = {};
+    let allChats = {}; // chat metadata only; content and the search indexes live in search_worker.js
+    const appVersion = "3.4";
+    let searchSource = 'static'; // 'api' when search_api.py runs the searches (reported by the worker)
+
+    // Index loading, searching and chat content all go through the search worker (see the protocol
+    // at the top of search_worker.js). Each request gets an id; its reply resolves the matching promise.
+    let searchWorker = null;
+    const workerReplies = new Map(); // request id -> resolve
+    let workerRequests = 0;
+    let activeQueryId = 0; // the search query still waiting for its results, if any
+    const SEARCH_DEBOUNCE_MS = 150;
+
+    // The chat list is virtualized: only the rows in (or near) the viewport are in the DOM. Rows have a
+    // fixed height so a row's position follows from its index in the current list of IDs.
+    const CHAT_ROW_HEIGHT = 96;     // px, including the 16px gap below each row
+    const SNIPPET_ROW_HEIGHT = 124; // rows of search results, which show a snippet under the title
+    const LIST_OVERSCAN = 8;        // rows rendered above and below the viewport
+    let sortedChatIds = [];         // every chat ID, most messages first; computed once after loading
+    // {container, ids, query, mode, rowHeight, highlightRegex, snippets, first, last} while the list is shown.
+    // mode is set while the list holds search results; snippets maps chat ID -> snippet HTML ('' while loading).
+    let listView = null;
+    let listFramePending = false;
+    // Long chats are rendered a batch of messages at a time, as the reader scrolls towards the end.
+    const MESSAGE_BATCH = 25;
 
     // --- TEMPLATES ---
-    const mainLayoutTemplate = `
+    const mainLayoutTemplate = () => `
         <header class="text-center mb-10">
             <h1 class="text-5xl font-extrabold text-white">Stream of Consciousness</h1>
             <p class="text-gray-400 mt-2">A browsable archive of all conversations.</p>
@@ -32,83 +49,279 @@ document.addEventListener('DOMContentLoaded', () => {
                     <input type="checkbox" id="pattern-search-toggle" class="mr-2 h-4 w-4 rounded bg-gray-700 border-gray-600 text-blue-500 focus:ring-blue-500">
                     <label for="pattern-search-toggle">Enable Pattern Search (slower, finds partial words)</label>
                 </div>
+                <p id="search-corrections" class="mt-3 text-sm text-gray-400 hidden"></p>
             </div>
         </header>
-        <div id="chat-list-container" class="space-y-4"></div>
+        <div id="chat-list-container" class="relative"></div>
         <div id="no-results" class="text-center text-gray-400 py-10 hidden"><p class="text-lg">No results found.</p></div>
-        <footer class="text-center text-gray-500 mt-12 py-4"><p>thortStream Archive v2.2</p></footer>
+        <footer class="text-center text-gray-500 mt-12 py-4"><p>thortStream Archive v${appVersion}${searchSource === 'api' ? ' · server search' : ''}</p></footer>
     `;
 
     const chatViewTemplate = (chat, formattedContent) => `
         <header class="mb-8">
             <a href="#" id="back-to-index" class="text-blue-400 hover:text-blue-300 transition-colors">&larr; Back to Index</a>
             <h1 class="text-4xl font-bold mt-4 text-white">${escapeHtml(chat.title)}</h1>
-            <p class="text-gray-400 text-sm mt-2">Chat ID: ${chat.id} | Messages: ${chat.msg_count} | Filesize: ${chat.filesize.toLocaleString()} bytes</p>
+            <p class="text-gray-400 text-sm mt-2">Chat ID: ${chat.id} | Messages: ${chat.msg_count} | Filesize: ${chat.filesize.toLocaleString()} bytes | v${appVersion}</p>
         </header>
         <details class="mb-8 p-6 bg-gray-800 rounded-lg border border-gray-700 cursor-pointer"><summary class="text-2xl font-semibold text-white list-none"><span class="marker">►</span> Associated Artifacts</summary><div class="mt-4"><p class="text-gray-400">This section is reserved for future artifacts.</p></div></details>
         <main id="chat-main-content" class="space-y-6">${formattedContent}</main>
-        <footer class="text-center text-gray-500 mt-12 py-4"><p>thortStream Archive v2.2</p></footer>
-        <div id="floating-nav" class="fixed bottom-5 right-5 space-y-2"><button id="next-occurrence-btn" title="Next Occurrence (N)" class="hidden w-14 h-14 bg-blue-600 text-white rounded-full shadow-lg hover:bg-blue-500 focus:outline-none focus:ring-2 focus:ring-blue-400 flex items-center justify-center text-lg font-bold">Next</button><button id="back-to-top-btn" title="Back to Top" class="w-14 h-14 bg-gray-700 text-white rounded-full shadow-lg hover:bg-gray-600 focus:outline-none focus:ring-2 focus:ring-gray-500 flex items-center justify-center">&uarr;</button></div>
+        <footer class="text-center text-gray-500 mt-12 py-4"><p>thortStream Archive v${appVersion}</p></footer>
+        <div id="floating-nav" class="fixed top-5 left-5 space-y-2"><button id="next-occurrence-btn" title="Next Occurrence (N)" class="hidden h-14 bg-blue-600 text-white rounded-full shadow-lg hover:bg-blue-500 focus:outline-none focus:ring-2 focus:ring-blue-400 flex items-center justify-center text-lg font-bold px-4">Next</button><button id="back-to-top-btn" title="Back to Top" class="w-14 h-14 bg-gray-700 text-white rounded-full shadow-lg hover:bg-gray-600 focus:outline-none focus:ring-2 focus:ring-gray-500 flex items-center justify-center">&uarr;</button></div>
     `;
 
     // --- UTILITY FUNCTIONS ---
     const escapeHtml = (str) => str.replace(/[&<>"']/g, (match) => ({'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'}[match]));
-    const formatChatContent = (rawText) => {
-        if (!rawText) return "<p class='text-red-400'>Could not load chat content.</p>";
-        const escapedText = escapeHtml(rawText);
-        const parts = escapedText.split(/(## (?:PROMPT|RESPONSE) ##)/);
-        let htmlContent = "";
-        for (let i = 1; i < parts.length; i += 2) {
-            const marker = parts[i];
-            const content = parts[i + 1].trim().replace(/\n/g, '<br>');
-            if (marker.includes("PROMPT")) {
-                htmlContent += `<div class="p-4 bg-blue-900/30 border border-blue-800 rounded-lg"><h3 class="font-semibold text-blue-300 mb-2">Simon's Prompt</h3><div class="prose prose-invert max-w-none text-gray-300">${content}</div></div>`;
-            } else if (marker.includes("RESPONSE")) {
-                htmlContent += `<div class="p-4 bg-gray-800/50 border border-gray-700 rounded-lg"><h3 class="font-semibold text-gray-300 mb-2">Dora's Response</h3><div class="prose prose-invert max-w-none text-gray-200">${content}</div></div>`;
+    // Messages come prebuilt from build_database.py as {role, start, end} offsets into the chat content,
+    // so rendering a message is one slice of the content instead of a regex split of the whole text.
+    // Search hits come as offsets too (messageHits); highlightRegex is only used for builds without positions.
+    const formatMessage = (rawText, message, index, totalMessages, highlightRegex, messageHits) => {
+        let content;
+        if (messageHits) {
+            // Escape the text between the hits, and wrap each hit in a highlight
+            const parts = [];
+            let position = message.start;
+            for (const hit of messageHits) {
+                parts.push(escapeHtml(rawText.slice(position, hit.start)), `<mark class="highlight">${escapeHtml(rawText.slice(hit.start, hit.end))}</mark>`);
+                position = hit.end;
+            }
+            parts.push(escapeHtml(rawText.slice(position, message.end)));
+            content = parts.join('').replace(/\n/g, '<br>');
+        } else {
+            // First, escape all HTML to prevent security issues
+            content = escapeHtml(rawText.slice(message.start, message.end)).replace(/\n/g, '<br>');
+
+            // Then, if a search is active, apply highlighting
+            if (highlightRegex) {
+                content = content.replace(highlightRegex, `<mark class="highlight">$1</mark>`);
             }
         }
-        return htmlContent || `<p>${escapedText.replace(/\n/g, '<br>')}</p>`;
+
+        const messageNumbering = `<span class="text-xs text-gray-500 font-mono">Message ${index + 1} of ${totalMessages}</span>`;
+        if (message.role === 'prompt') {
+            return `<div class="p-4 bg-blue-900/30 border border-blue-800 rounded-lg"><div class="flex justify-between items-center mb-2"><h3 class="font-semibold text-blue-300">Simon's Prompt</h3>${messageNumbering}</div><div class="prose prose-invert max-w-none text-gray-300">${content}</div></div>`;
+        }
+        return `<div class="p-4 bg-gray-800/50 border border-gray-700 rounded-lg"><div class="flex justify-between items-center mb-2"><h3 class="font-semibold text-gray-300">Dora's Response</h3>${messageNumbering}</div><div class="prose prose-invert max-w-none text-gray-200">${content}</div></div>`;
+    };
+
+    // Renders a chat's messages into mainContent in batches. The next batch is added when the end of the
+    // rendered part comes near the viewport, or when ensureHighlight() needs a match that is further down.
+    // hits are the search hits from the positional index ({message, start, end}, in reading order), or
+    // null for a build without positions, in which case highlightRegex finds them instead.
+    const createMessageWindow = (mainContent, rawText, messages, totalMessages, hits, highlightRegex) => {
+        let rendered = 0;
+        const hitsByMessage = new Map();
+        for (const hit of hits || []) {
+            if (!hitsByMessage.has(hit.message)) hitsByMessage.set(hit.message, []);
+            hitsByMessage.get(hit.message).push(hit);
+        }
+        const renderMore = (count = MESSAGE_BATCH) => {
+            const end = Math.min(messages.length, rendered + count);
+            const html = [];
+            for (let i = rendered; i < end; i++) {
+                html.push(hits ? formatMessage(rawText, messages[i], i, totalMessages, null, hitsByMessage.get(i) || [])
+                    : formatMessage(rawText, messages[i], i, totalMessages, highlightRegex));
+            }
+            mainContent.insertAdjacentHTML('beforeend', html.join(''));
+            rendered = end;
+            if (rendered >= messages.length && observer) observer.disconnect();
+        };
+
+        // With a search active, the total and the first message with a highlight are known up front, so
+        // navigation can show the count and rendering goes at least as far as the first highlight.
+        let totalHighlights = hits ? hits.length : 0;
+        let firstMatch = hits && hits.length ? hits[0].message : -1;
+        if (!hits && highlightRegex) {
+            messages.forEach((message, i) => {
+                const found = escapeHtml(rawText.slice(message.start, message.end)).replace(/\n/g, '<br>').match(highlightRegex);
+                if (found) {
+                    totalHighlights += found.length;
+                    if (firstMatch === -1) firstMatch = i;
+                }
+            });
+        }
+
+        const sentinel = document.createElement('div');
+        mainContent.insertAdjacentElement('afterend', sentinel);
+        const observer = ('IntersectionObserver' in window) ? new IntersectionObserver((entries) => {
+            if (entries.some(entry => entry.isIntersecting)) renderMore();
+        }, { rootMargin: '0px 0px 1500px 0px' }) : null;
+        renderMore(observer ? Math.max(MESSAGE_BATCH, firstMatch + 1 + MESSAGE_BATCH) : messages.length);
+        if (observer && rendered < messages.length) observer.observe(sentinel);
+
+        const highlights = mainContent.getElementsByClassName('highlight'); // live: grows as batches are added
+        return {
+            totalHighlights,
+            highlights,
+            ensureHighlight: (index) => {
+                if (hits && index < hits.length && rendered <= hits[index].message) renderMore(hits[index].message + 1 - rendered);
+                while (highlights.length <= index && rendered < messages.length) renderMore();
+                return highlights[index];
+            },
+        };
     };
     
     // --- ROUTING & RENDERING ---
-    const renderChatListView = (chatsToShow, query = '') => {
-        app.innerHTML = mainLayoutTemplate;
-        const container = document.getElementById('chat-list-container');
-        const sortedChats = Object.values(chatsToShow).sort((a, b) => b.msg_count - a.msg_count);
-        
-        const highlightRegex = (query && query.length >= 3) ? new RegExp(`(${escapeRegExp(query)})`, 'gi') : null;
+    const snippetHtml = (snippet) => {
+        if (!snippet) return '';
+        const collapse = (text) => escapeHtml(text).replace(/\s+/g, ' ');
+        return `<span class="text-gray-500">Message ${snippet.message + 1}:</span> ${collapse(snippet.before)}<mark class="highlight">${escapeHtml(snippet.match)}</mark>${collapse(snippet.after)}`;
+    };
 
-        container.innerHTML = sortedChats.map(chat => {
-            let titleHtml = escapeHtml(chat.title);
-            if (highlightRegex) {
-                titleHtml = titleHtml.replace(highlightRegex, `<mark class="highlight">$1</mark>`);
-            }
-            return `
-            <a href="#/chat/${chat.id}?q=${encodeURIComponent(query)}" data-chat-id="${chat.id}" class="block p-5 bg-gray-800 rounded-lg border border-gray-700 hover:bg-gray-700/80 hover:border-blue-600 transition-all duration-200">
+    const chatRowHtml = (chat, index, view) => {
+        let titleHtml = escapeHtml(chat.title);
+        if (view.highlightRegex) {
+            titleHtml = titleHtml.replace(view.highlightRegex, `<mark class="highlight">$1</mark>`);
+        }
+        const search = view.query ? `?q=${encodeURIComponent(view.query)}${view.mode ? `&mode=${view.mode}` : ''}` : '';
+        const snippet = view.mode ? `<p data-snippet-for="${chat.id}" class="text-sm text-gray-400 truncate mt-2">${view.snippets.get(chat.id) || '&nbsp;'}</p>` : '';
+        return `
+            <a href="#/chat/${chat.id}${search}" data-chat-id="${chat.id}" style="top: ${index * view.rowHeight}px; height: ${view.rowHeight - 16}px;" class="absolute inset-x-0 block p-5 bg-gray-800 rounded-lg border border-gray-700 hover:bg-gray-700/80 hover:border-blue-600 transition-all duration-200">
                 <div class="flex justify-between items-center">
-                    <h2 class="text-xl font-bold text-white">${titleHtml}</h2>
-                    <span class="text-lg font-semibold text-blue-400 bg-blue-900/50 px-3 py-1 rounded-full">${chat.msg_count} msgs</span>
-                </div>
-            </a>`
-        }).join('');
+                    <h2 class="text-xl font-bold text-white truncate mr-4">${titleHtml}</h2>
+                    <span class="flex-shrink-0 text-lg font-semibold text-blue-400 bg-blue-900/50 px-3 py-1 rounded-full">${chat.msg_count} msgs</span>
+                </div>${snippet}
+            </a>`;
+    };
+
+    // Asks the worker for the snippets of the given rows that do not have one yet, and fills them in
+    // when they arrive, unless the list has moved on to another search by then.
+    const requestSnippets = (ids) => {
+        const { query, mode, snippets } = listView;
+        const missing = ids.filter(id => !snippets.has(id));
+        if (!mode || missing.length === 0) return;
+        missing.forEach(id => snippets.set(id, ''));
+        askWorker({ type: 'snippets', query, mode, chatIds: missing }).then(reply => {
+            if (reply.type !== 'snippets') { missing.forEach(id => snippets.delete(id)); return; }
+            for (const id of missing) {
+                snippets.set(id, snippetHtml(reply.snippets[id]));
+                if (!listView || listView.snippets !== snippets) continue;
+                const element = listView.container.querySelector(`[data-snippet-for="${id}"]`);
+                if (element) element.innerHTML = snippets.get(id) || '&nbsp;';
+            }
+        });
+    };
+
+    // Puts the rows that are in or near the viewport into the DOM; does nothing if that range is already shown.
+    const renderListWindow = () => {
+        listFramePending = false;
+        if (!listView || !listView.container.isConnected) { listView = null; return; }
+        const { container, ids, rowHeight } = listView;
+        const top = container.getBoundingClientRect().top;
+        const first = Math.max(0, Math.floor(-top / rowHeight) - LIST_OVERSCAN);
+        const last = Math.min(ids.length, Math.ceil((window.innerHeight - top) / rowHeight) + LIST_OVERSCAN);
+        if (first === listView.first && last === listView.last) return;
+        listView.first = first;
+        listView.last = last;
+        const rows = [];
+        for (let i = first; i < last; i++) rows.push(chatRowHtml(allChats[ids[i]], i, listView));
+        container.innerHTML = rows.join('');
+        requestSnippets(ids.slice(first, last));
+    };
+
+    const scheduleListWindow = () => {
+        if (listView && !listFramePending) {
+            listFramePending = true;
+            requestAnimationFrame(renderListWindow);
+        }
+    };
+
+    // Shows the given chat IDs, in order, as the list; only the visible window is rendered. mode is the
+    // search mode when the IDs are search results, which then get a snippet of where the query hits.
+    const showChatIds = (ids, query, mode = null) => {
+        listView.ids = ids;
+        listView.query = query;
+        listView.mode = mode;
+        listView.rowHeight = mode ? SNIPPET_ROW_HEIGHT : CHAT_ROW_HEIGHT;
+        listView.snippets = new Map();
+        listView.highlightRegex = (query && query.length >= 3) ? new RegExp(`(${escapeRegExp(query)})`, 'gi') : null;
+        listView.first = listView.last = -1;
+        listView.container.style.height = `${ids.length * listView.rowHeight}px`;
+        renderListWindow();
+    };
+
+    const renderChatListView = (chatsToShow, query = '') => {
+        app.innerHTML = mainLayoutTemplate();
+        const container = document.getElementById('chat-list-container');
+        const ids = chatsToShow === allChats ? sortedChatIds
+            : Object.values(chatsToShow).sort((a, b) => b.msg_count - a.msg_count).map(chat => chat.id);
+        listView = { container };
+        showChatIds(ids, query);
         
         setupSearchListeners();
-        document.getElementById('search-input').value = query;
+        const searchInput = document.getElementById('search-input');
+        searchInput.value = query;
+        if (query) searchInput.dispatchEvent(new Event('input'));
     };
 
-    const renderChatDetailView = (chatId) => {
+    const startSearchWorker = () => {
+        searchWorker = new Worker('search_worker.js');
+        searchWorker.onmessage = (event) => {
+            const resolve = workerReplies.get(event.data.id);
+            if (!resolve) return;
+            workerReplies.delete(event.data.id);
+            resolve(event.data);
+        };
+        // If the worker script itself fails, fail every waiting request rather than leaving it hanging.
+        searchWorker.onerror = (event) => {
+            for (const [id, resolve] of workerReplies) resolve({ type: 'error', id, message: event.message || 'The search worker failed.' });
+            workerReplies.clear();
+        };
+    };
+
+    const askWorker = (message) => new Promise(resolve => {
+        const id = ++workerRequests;
+        workerReplies.set(id, resolve);
+        if (message.type === 'query') activeQueryId = id;
+        searchWorker.postMessage({ ...message, id });
+    });
+
+    const cancelActiveQuery = () => {
+        if (activeQueryId) searchWorker.postMessage({ type: 'cancel', id: activeQueryId });
+        activeQueryId = 0;
+    };
+
+    // Returns {body, hits}: the chat's content and message records, and where the query hits in it.
+    const loadChatBody = async (chat, query, mode) => {
+        const reply = await askWorker({ type: 'chat', chatId: chat.id, query, mode });
+        if (reply.type === 'error') throw new Error(reply.message);
+        return { body: reply.body, hits: reply.hits };
+    };
+
+    const renderChatDetailView = async (chatId) => {
         const chat = allChats[chatId];
         if (!chat) { renderChatListView(allChats); return; }
+        listView = null;
+        cancelActiveQuery();
         
-        const params = new URLSearchParams(window.location.hash.split('?')[1] || '');
-        const searchQuery = params.get('q');
+        const currentHash = window.location.hash;
+        const params = new URLSearchParams(currentHash.split('?')[1] || '');
+        const searchQuery = (params.get('q') || '').toLowerCase();
+        const searchMode = params.get('mode') || 'word';
+
+        app.innerHTML = `<p class="text-center text-gray-400 py-10">Loading chat...</p>`;
+        let body = { content: null, messages: [] };
+        let hits = [];
+        try {
+            ({ body, hits } = await loadChatBody(chat, searchQuery, searchMode));
+        } catch (error) {
+            console.error(error);
+        }
+        if (window.location.hash !== currentHash) return; // The user navigated away while the shard was loading.
         
-        let formattedContent = formatChatContent(chat.content);
+        const messages = body.messages || [];
+        let formattedContent = '';
+        if (!body.content) formattedContent = "<p class='text-red-400'>Could not load chat content.</p>";
+        else if (messages.length === 0) formattedContent = `<p>${escapeHtml(body.content).replace(/\n/g, '<br>')}</p>`;
         app.innerHTML = chatViewTemplate(chat, formattedContent);
+
+        // Hits come from the positional index; only a build without positions falls back to the regex.
+        const highlightRegex = (hits === null && searchQuery.length > 0) ? new RegExp(`(${escapeRegExp(searchQuery)})`, 'gi') : null;
+        const messageWindow = createMessageWindow(document.getElementById('chat-main-content'), body.content || '',
+            body.content ? messages : [], chat.msg_count, hits, highlightRegex);
         
         requestAnimationFrame(() => {
             document.getElementById('back-to-index').addEventListener('click', (e) => { e.preventDefault(); window.location.hash = ''; });
-            setupChatPageListeners(searchQuery);
+            setupChatPageListeners(messageWindow);
         });
     };
 
@@ -129,93 +342,90 @@ document.addEventListener('DOMContentLoaded', () => {
     const setupSearchListeners = () => {
         const searchInput = document.getElementById('search-input');
         const patternToggle = document.getElementById('pattern-search-toggle');
-        const chatListContainer = document.getElementById('chat-list-container');
         const noResultsMessage = document.getElementById('no-results');
-        const chatLinks = Array.from(chatListContainer.getElementsByTagName('a'));
+        const correctionsMessage = document.getElementById('search-corrections');
         let isPatternMode = false;
+        let debounceTimer = null;
 
         patternToggle.addEventListener('change', () => { isPatternMode = patternToggle.checked; searchInput.dispatchEvent(new Event('input')); });
         
-        const performSearch = () => {
+        const performSearch = async () => {
             const query = searchInput.value.toLowerCase().trim();
-            let matchedIds;
-
-            if (isPatternMode) {
-                if (query.length < 3) { matchedIds = new Set(Object.keys(allChats).map(Number)); }
-                else { matchedIds = new Set(); for (const id in fullTextIndex) { if (fullTextIndex[id].includes(query)) matchedIds.add(Number(id)); } }
-            } else {
-                const terms = query.split(/\s+/).filter(term => term.length > 1);
-                if (terms.length === 0) { matchedIds = new Set(Object.keys(allChats).map(Number)); }
-                else { const idSets = terms.map(term => new Set(wordIndex[term] || [])); matchedIds = idSets.reduce((a, b) => new Set([...a].filter(x => b.has(x)))); }
+            cancelActiveQuery();
+            if (!query) {
+                showChatIds(sortedChatIds, query);
+                noResultsMessage.classList.add('hidden');
+                correctionsMessage.classList.add('hidden');
+                return;
             }
 
-            let resultsFound = false;
-            chatLinks.forEach(link => {
-                const chatId = parseInt(link.dataset.chatId, 10);
-                const titleElement = link.querySelector('h2');
-                let titleHtml = escapeHtml(allChats[chatId].title);
-                
-                const originalHref = `#/chat/${chatId}`;
-                link.href = query ? `${originalHref}?q=${encodeURIComponent(query)}` : originalHref;
-
-                if (matchedIds.has(chatId)) {
-                    link.style.display = 'block';
-                    resultsFound = true;
-                    if (query.length >= 3) {
-                        const highlightRegex = new RegExp(`(${escapeRegExp(query)})`, 'gi');
-                        titleHtml = titleHtml.replace(highlightRegex, `<mark class="highlight">$1</mark>`);
-                    }
-                } else {
-                    link.style.display = 'none';
-                }
-                titleElement.innerHTML = titleHtml;
-            });
-            noResultsMessage.classList.toggle('hidden', resultsFound || query.length === 0);
+            const mode = isPatternMode ? 'pattern' : 'word';
+            const reply = await askWorker({ type: 'query', query, mode });
+            if (reply.id !== activeQueryId) return; // Cancelled or superseded by a newer keystroke.
+            activeQueryId = 0;
+            if (reply.type !== 'results' || !listView) return;
+
+            // The best-ranked matches come first in relevance order; the rest keep the default order.
+            const { matchedIds, rankedIds } = reply;
+            let ids = sortedChatIds;
+            if (matchedIds) {
+                const matchedSet = new Set(matchedIds);
+                const rankedSet = new Set(rankedIds);
+                ids = rankedIds.concat(sortedChatIds.filter(id => matchedSet.has(id) && !rankedSet.has(id)));
+            }
+            showChatIds(ids, query, matchedIds ? mode : null);
+            noResultsMessage.classList.toggle('hidden', ids.length > 0);
+
+            // Misspelled terms were searched as the closest terms in the archive; say which.
+            const corrections = Object.entries(reply.corrections || {});
+            const termList = (terms) => terms.map(term => `<strong class="text-gray-200">${escapeHtml(term)}</strong>`).join(' or ');
+            correctionsMessage.innerHTML = corrections.map(([term, expansions]) =>
+                `No exact match for ${termList([term])}, showing results for ${termList(expansions)}.`).join('<br>');
+            correctionsMessage.classList.toggle('hidden', corrections.length === 0);
         };
-        searchInput.addEventListener('input', performSearch);
+        const scheduleSearch = () => {
+            clearTimeout(debounceTimer);
+            debounceTimer = setTimeout(performSearch, SEARCH_DEBOUNCE_MS);
+        };
+        searchInput.addEventListener('input', scheduleSearch);
     };
 
-    const setupChatPageListeners = (searchQuery) => {
-        const mainContent = document.getElementById('chat-main-content');
+    const setupChatPageListeners = (messageWindow) => {
         const backToTopBtn = document.getElementById('back-to-top-btn');
         const nextOccurrenceBtn = document.getElementById('next-occurrence-btn');
         const floatingNav = document.getElementById('floating-nav');
         let currentHighlightIndex = -1;
-        let highlights = [];
-
-        if (searchQuery && mainContent) {
-            const query = searchQuery.toLowerCase();
-            const messageBlocks = mainContent.querySelectorAll('div.p-4');
-            
-            messageBlocks.forEach(block => {
-                if (block.textContent.toLowerCase().includes(query)) {
-                    block.classList.add('highlight');
-                    highlights.push(block);
-                }
-            });
-
-            if (highlights.length > 0) {
-                nextOccurrenceBtn.classList.remove('hidden');
-                currentHighlightIndex = 0;
-                highlights[0].classList.add('current-highlight');
-                setTimeout(() => {
-                    highlights[0].scrollIntoView({ behavior: 'smooth', block: 'center' });
-                }, 100);
-            }
+        
+        const { highlights, totalHighlights } = messageWindow;
+        
+        if (totalHighlights > 0) {
+            nextOccurrenceBtn.classList.remove('hidden');
+            currentHighlightIndex = 0;
+            messageWindow.ensureHighlight(0).classList.add('current-highlight');
+            nextOccurrenceBtn.textContent = `Next (${currentHighlightIndex + 1}/${totalHighlights})`;
+            setTimeout(() => {
+                highlights[0].scrollIntoView({ behavior: 'smooth', block: 'center' });
+            }, 100);
         }
 
         const scrollToNext = () => {
-            if (highlights.length === 0) return;
+            if (totalHighlights === 0) return;
             highlights[currentHighlightIndex].classList.remove('current-highlight');
-            currentHighlightIndex = (currentHighlightIndex + 1) % highlights.length;
-            highlights[currentHighlightIndex].classList.add('current-highlight');
-            highlights[currentHighlightIndex].scrollIntoView({ behavior: 'smooth', block: 'center' });
+            currentHighlightIndex = (currentHighlightIndex + 1) % totalHighlights;
+            const highlight = messageWindow.ensureHighlight(currentHighlightIndex);
+            highlight.classList.add('current-highlight');
+            nextOccurrenceBtn.textContent = `Next (${currentHighlightIndex + 1}/${totalHighlights})`;
+            highlight.scrollIntoView({ behavior: 'smooth', block: 'center' });
+        };
+
+        const handleScroll = () => {
+            floatingNav.classList.toggle('hidden', window.scrollY < 200);
         };
 
-        window.addEventListener('scroll', () => floatingNav.classList.toggle('hidden', window.scrollY < 200));
+        window.addEventListener('scroll', handleScroll);
         backToTopBtn.addEventListener('click', () => window.scrollTo({ top: 0, behavior: 'smooth' }));
         nextOccurrenceBtn.addEventListener('click', scrollToNext);
-        document.addEventListener('keydown', (e) => { if (e.key === 'n' && highlights.length > 0) scrollToNext(); });
+        document.addEventListener('keydown', (e) => { if (e.key === 'n' && totalHighlights > 0) scrollToNext(); });
     };
     
     const escapeRegExp = (string) => {
@@ -225,15 +435,16 @@ document.addEventListener('DOMContentLoaded', () => {
     // --- INITIALIZATION ---
     const init = async () => {
         try {
-            const [dbRes, wordRes, fullTextRes] = await Promise.all([
-                fetch('database.json'),
-                fetch('search_index_word.json'),
-                fetch('search_index_full_text.json')
-            ]);
-            allChats = await dbRes.json();
-            wordIndex = await wordRes.json();
-            fullTextIndex = await fullTextRes.json();
+            app.innerHTML = `<p class="text-center text-gray-400 py-10">Loading archive...</p>`;
+            startSearchWorker();
+            const reply = await askWorker({ type: 'load' });
+            if (reply.type === 'error') throw new Error(reply.message);
+            allChats = reply.chats;
+            searchSource = reply.source;
+            sortedChatIds = Object.values(allChats).sort((a, b) => b.msg_count - a.msg_count).map(chat => chat.id);
             
+            window.addEventListener('scroll', scheduleListWindow, { passive: true });
+            window.addEventListener('resize', scheduleListWindow);
             window.addEventListener('hashchange', router);
             router(); // Initial route
         } catch (error) {
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+Filename:   generate_synthetic_corpus.py
+Author:     Simon C, assisted by Dora
+Version:    1.0
+Date:       2026-10-17
+Description:
+    Generates a synthetic archive at any scale (1k to 100k chats and beyond)
+    so the pipeline can be measured well past the ~296 real chats. The output
+    folder is laid out like the project root, so every pipeline script can be
+    run from inside it unchanged:
+        data/metadata/chats.json
+        data/allchats/Long|Short/NNN_title.txt   (scraper naming and layout)
+        output/logs/chatAnalysis.txt             (scraper log format)
+        output/reports/chat_analysis_report.csv  (the report analysis should produce)
+    Text is drawn from a Zipf-distributed vocabulary so that word frequencies,
+    posting list lengths and trigram counts behave like real prose. The same
+    seed always produces the same corpus.
+
+    Example:
+        python src/benchmarks/generate_synthetic_corpus.py --chats 10000 --output-dir output/bench/corpus_10000
+"""
+
+import os
+import csv
+import json
+import random
+import argparse
+import itertools
+
+# --- CONFIGURATION ---
+BASE_DIR = os.getcwd()
+DEFAULT_OUTPUT_ROOT = os.path.join(BASE_DIR, 'output', 'bench')
+
+DEFAULT_SEED = 2025
+VOCABULARY_SIZE = 30000
+ZIPF_EXPONENT = 1.07
+# A chat is LONG when it has at least this many messages (as in scrape_chat_content.py).
+LONG_CHAT_MESSAGES = 18
+CANVAS_RATE = 0.3
+# Turns per chat follow a geometric-like spread around the mean; responses are much longer than prompts.
+DEFAULT_MEAN_TURNS = 10
+PROMPT_WORDS = (5, 40)
+RESPONSE_WORDS = (40, 260)
+
+COMMON_WORDS = ['the', 'to', 'and', 'of', 'a', 'in', 'is', 'that', 'for', 'it', 'you', 'with', 'on', 'this',
+                'can', 'be', 'are', 'as', 'your', 'have', 'or', 'will', 'if', 'an', 'at', 'we', 'from', 'by',
+                'simon', 'dora', 'file', 'script', 'chat', 'python', 'archive', 'search', 'index', 'windows',
+                'project', 'data', 'here', 'let', 'me', 'know', 'what', 'how', 'so', 'now', 'just', 'all']
+SYLLABLES = ['ka', 'lo', 'mi', 'ren', 'tor', 'sa', 'vel', 'qu', 'in', 'dar', 'po', 'ne', 'shi', 'ta', 'gor',
+             'e', 'lu', 'bra', 'ce', 'xi', 'mon', 'an', 'fe', 'ro', 'ut', 'zen', 'ya', 'hal', 'ob', 'ist']
+
+# --- SCRIPT ---
+
+def build_vocabulary(rng, size=VOCABULARY_SIZE):
+    """Returns (words, cumulative Zipf weights); common English words take the top ranks."""
+    words = list(COMMON_WORDS)
+    seen = set(words)
+    while len(words) < size:
+        word = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 4)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    weights = [1.0 / (rank ** ZIPF_EXPONENT) for rank in range(1, size + 1)]
+    return words, list(itertools.accumulate(weights))
+
+def sentence_text(rng, vocabulary, word_range):
+    """Returns a few lines of pseudo-prose with between word_range[0] and word_range[1] words."""
+    words, cumulative = vocabulary
+    count = rng.randint(*word_range)
+    chosen = rng.choices(words, cum_weights=cumulative, k=count)
+    lines, line = [], []
+    for word in chosen:
+        line.append(word)
+        if len(line) >= rng.randint(8, 20):
+            lines.append(' '.join(line).capitalize() + '.')
+            line = []
+    if line: lines.append(' '.join(line).capitalize() + '.')
+    return '\n'.join(lines)
+
+def chat_title(rng, vocabulary, chat_id):
+    """Returns a short title; a few contain characters the scraper strips from filenames."""
+    words, cumulative = vocabulary
+    title = ' '.join(rng.choices(words[50:2000], k=rng.randint(2, 6))).title()
+    if chat_id % 17 == 0: title += ': Part ' + str(rng.randint(2, 9))
+    if chat_id % 23 == 0: title = "Dora's " + title
+    return title
+
+def chat_text(rng, vocabulary, chat_id, title, url, turns):
+    """Renders a chat the way the scraper saves it: a small header, then '---'-separated messages."""
+    parts = [f"ID: {chat_id}\nURL: {url}\nTITLE: {title}\n"]
+    for _ in range(turns):
+        parts.append("## PROMPT ##\n\n" + sentence_text(rng, vocabulary, PROMPT_WORDS) + "\n")
+        parts.append("## RESPONSE ##\n\n" + sentence_text(rng, vocabulary, RESPONSE_WORDS) + "\n")
+    return "\n---\n\n".join(parts)
+
+def safe_filename_title(title):
+    """Sanitizes a title for a filename exactly as scrape_chat_content.py does."""
+    return "".join(c for c in title if c.isalnum() or c in (' ', '.', '_')).rstrip()
+
+def generate_corpus(output_dir, chat_count, seed=DEFAULT_SEED, mean_turns=DEFAULT_MEAN_TURNS):
+    """Writes a synthetic corpus into output_dir and returns a summary dict."""
+    rng = random.Random(seed)
+    vocabulary = build_vocabulary(rng)
+
+    chats_json_path = os.path.join(output_dir, 'data', 'metadata', 'chats.json')
+    log_path = os.path.join(output_dir, 'output', 'logs', 'chatAnalysis.txt')
+    csv_path = os.path.join(output_dir, 'output', 'reports', 'chat_analysis_report.csv')
+    for path in (chats_json_path, log_path, csv_path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    for folder in ('Long', 'Short'):
+        os.makedirs(os.path.join(output_dir, 'data', 'allchats', folder), exist_ok=True)
+
+    chats, rows, log_blocks = [], [], []
+    total_bytes, total_messages = 0, 0
+    for chat_id in range(1, chat_count + 1):
+        title = chat_title(rng, vocabulary, chat_id)
+        url = f"https://gemini.google.com/app/{rng.getrandbits(64):016x}"
+        turns = max(1, min(int(rng.expovariate(1.0 / mean_turns)) + 1, mean_turns * 8))
+        message_count = 2 * turns
+        classification = 'LONG' if message_count >= LONG_CHAT_MESSAGES else 'SHORT'
+        folder = classification.capitalize()
+        canvas = rng.random() < CANVAS_RATE
+
+        data = chat_text(rng, vocabulary, chat_id, title, url, turns).encode('utf-8')
+        filename = f"{chat_id:03d}_{safe_filename_title(title)}.txt"
+        with open(os.path.join(output_dir, 'data', 'allchats', folder, filename), 'wb') as f:
+            f.write(data)
+
+        chats.append({'id': chat_id, 'title': title, 'url': url})
+        log_blocks.append(f"\n--- Analyzing Chat #{chat_id} ({chat_id}/{chat_count}): '{title}' ---\n"
+                          + ("[DEBUG] Canvas closed.\n" if canvas else "")
+                          + f"[RESULT] {classification} chat detected ({message_count} messages).\n")
+        rows.append([chat_id, title, message_count, message_count, len(data), canvas, classification,
+                     folder, filename, ''])
+        total_bytes += len(data)
+        total_messages += message_count
+
+    with open(chats_json_path, 'w', encoding='utf-8') as f:
+        json.dump(chats, f, indent=2)
+    with open(log_path, 'w', encoding='utf-8', newline='') as f:
+        f.write(''.join(log_blocks))
+    with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Chat ID', 'Title', 'Logged Msg Count', 'Actual Msg Count', 'Filesize (bytes)', 'Canvas Used',
+                         'Log Classification', 'Actual Folder', 'Matched Filename', 'Anomalies'])
+        writer.writerows(rows)
+
+    return {'chats': chat_count, 'messages': total_messages, 'chat_bytes': total_bytes, 'seed': seed,
+            'mean_turns': mean_turns}
+
+def main():
+    parser = argparse.ArgumentParser(description="Generates a synthetic thortStream corpus for benchmarking.")
+    parser.add_argument('--chats', type=int, default=1000, help="Number of chats to generate (default: 1000).")
+    parser.add_argument('--output-dir', help="Where to write the corpus (default: output/bench/corpus_<chats>).")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--mean-turns', type=int, default=DEFAULT_MEAN_TURNS,
+                        help="Average prompt/response pairs per chat (default: 10).")
+    args = parser.parse_args()
+
+    output_dir = args.output_dir or os.path.join(DEFAULT_OUTPUT_ROOT, f"corpus_{args.chats}")
+    if os.path.exists(os.path.join(output_dir, 'data', 'allchats')):
+        print(f"[ERROR] '{output_dir}' already holds a corpus. Delete it or choose another --output-dir.")
+        return
+    print(f"[INFO] Generating {args.chats:,} synthetic chats into: {output_dir}")
+    summary = generate_corpus(output_dir, args.chats, args.seed, args.mean_turns)
+    print(f"[SUCCESS] Wrote {summary['chats']:,} chats, {summary['messages']:,} messages, "
+          f"{summary['chat_bytes']:,} bytes of chat text.")
+
+if __name__ == '__main__':
+    main()
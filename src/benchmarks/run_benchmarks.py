@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+"""
+Filename:   run_benchmarks.py
+Author:     Simon C, assisted by Dora
+Version:    1.0
+Date:       2026-10-17
+Description:
+    End-to-end benchmark for the pipeline. For each requested scale it
+    generates (or reuses) a synthetic corpus, then runs every stage as its own
+    process from inside the corpus folder, exactly as a user would:
+        generate             generate_synthetic_corpus.py    (only for a new corpus)
+        analyze              analyze_gemini_chats.py --reparse-log
+        analyze_parallel     analyze_gemini_chats.py --reparse-log --parallel
+        build_full           build_database.py
+        build_incremental    build_database.py --incremental   (nothing changed)
+        build_sharded        build_database.py --layout sharded --word-index-format binary
+        build_streaming      build_database.py --streaming   (bounded-memory full build)
+    Each stage records its wall time, peak memory (max RSS of the process) and
+    exit code, and each build records the size of what it wrote. Word (BM25)
+    and pattern search latencies are measured on the full build's indexes with
+    the Python twins of the SPA's search code in build_database.py, in a
+    separate process too. Keeping this process small matters: a child's peak
+    memory includes whatever it inherited from its parent.
+    Results are written as JSON to output/bench/results/. With --compare, the
+    new results are checked against an earlier results file and any timing,
+    memory or size that grew by more than --threshold is reported; the exit
+    code is then 1, so the script can gate a change.
+
+    Example:
+        python src/benchmarks/run_benchmarks.py --scales 1000,10000
+        python src/benchmarks/run_benchmarks.py --scales 1000 --compare output/bench/results/baseline.json
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import random
+import platform
+import argparse
+import subprocess
+import importlib.util
+
+from generate_synthetic_corpus import DEFAULT_SEED
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# --- CONFIGURATION ---
+BASE_DIR = os.getcwd()
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.join(BASE_DIR, 'output', 'bench')
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+RESULTS_VERSION = 1
+
+GENERATE_SCRIPT = os.path.join(SRC_DIR, 'benchmarks', 'generate_synthetic_corpus.py')
+ANALYZE_SCRIPT = os.path.join(SRC_DIR, '02_analysis', 'analyze_gemini_chats.py')
+BUILD_SCRIPT = os.path.join(SRC_DIR, '03_website_generation', 'build_database.py')
+
+# (stage name, script, arguments, output layout to measure afterwards or None)
+STAGES = [
+    ('analyze', ANALYZE_SCRIPT, ['--reparse-log'], None),
+    ('analyze_parallel', ANALYZE_SCRIPT, ['--reparse-log', '--parallel'], None),
+    ('build_full', BUILD_SCRIPT, [], 'single'),
+    ('build_incremental', BUILD_SCRIPT, ['--incremental'], 'single'),
+    ('build_sharded', BUILD_SCRIPT, ['--layout', 'sharded', '--word-index-format', 'binary'], 'sharded'),
+    ('build_streaming', BUILD_SCRIPT, ['--streaming'], 'single'),
+]
+# The query benchmark runs on the outputs of this stage, before later stages replace them.
+QUERY_STAGE = 'build_full'
+
+DEFAULT_QUERY_COUNT = 200
+DEFAULT_THRESHOLD = 0.20
+# Metrics below these floors are too small to compare reliably between runs; single worst cases are too noisy.
+COMPARE_FLOORS = {'seconds': 0.05, 'ms': 0.5, 'bytes': 1024 * 1024}
+COMPARE_SKIP_SUFFIXES = ('max_ms',)
+PSUTIL_POLL_INTERVAL = 0.05
+
+# --- SCRIPT ---
+
+def load_build_module():
+    """Imports build_database.py by path so its search functions can be timed in-process."""
+    spec = importlib.util.spec_from_file_location('build_database', BUILD_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def run_stage(script, arguments, cwd, log_path):
+    """
+    Runs one pipeline script to completion in cwd. Returns {seconds, peak_rss_bytes,
+    exit_code}. Peak memory comes from os.wait4() on POSIX, or from polling with
+    psutil (if installed) elsewhere; otherwise it is None.
+    """
+    with open(log_path, 'w', encoding='utf-8') as log:
+        started = time.perf_counter()
+        process = subprocess.Popen([sys.executable, script] + arguments, cwd=cwd, stdout=log,
+                                   stderr=subprocess.STDOUT)
+        peak = None
+        if hasattr(os, 'wait4'):
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+            peak = usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+        elif psutil is not None:
+            peak = 0
+            try:
+                watched = psutil.Process(process.pid)
+                while process.poll() is None:
+                    peak = max(peak, watched.memory_info().rss)
+                    time.sleep(PSUTIL_POLL_INTERVAL)
+            except psutil.Error:
+                pass
+            process.wait()
+        else:
+            process.wait()
+        seconds = time.perf_counter() - started
+    return {'seconds': round(seconds, 4), 'peak_rss_bytes': peak, 'exit_code': process.returncode}
+
+def measure_outputs(public_dir):
+    """Returns the byte sizes of the files a build wrote into public/, by kind."""
+    sizes = {'total_bytes': 0, 'gzip_bytes': 0, 'brotli_bytes': 0, 'files': {}}
+    for name in ['database.json', 'catalog.json', 'search_index_word.json', 'search_index_word.bin',
+                 'search_index_trigram.json', 'search_index_ranking.json']:
+        path = os.path.join(public_dir, name)
+        if os.path.isfile(path): sizes['files'][name] = os.path.getsize(path)
+    shard_dir = os.path.join(public_dir, 'shards')
+    if os.path.isdir(shard_dir):
+        shard_sizes = [os.path.getsize(os.path.join(shard_dir, name)) for name in os.listdir(shard_dir)]
+        sizes['files']['shards'] = sum(shard_sizes)
+        sizes['shard_count'] = len(shard_sizes)
+    sizes['total_bytes'] = sum(sizes['files'].values())
+    for root, _, names in os.walk(os.path.join(public_dir, 'assets')):
+        for name in names:
+            if name.endswith('.gz'): sizes['gzip_bytes'] += os.path.getsize(os.path.join(root, name))
+            elif name.endswith('.br'): sizes['brotli_bytes'] += os.path.getsize(os.path.join(root, name))
+    return sizes
+
+def latency_summary(samples):
+    """Summarises per-query latencies (seconds) in milliseconds."""
+    ordered = sorted(samples)
+    if not ordered: return {'count': 0}
+    pick = lambda fraction: ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000
+    return {
+        'count': len(ordered),
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 4),
+        'p50_ms': round(pick(0.50), 4),
+        'p95_ms': round(pick(0.95), 4),
+        'max_ms': round(ordered[-1] * 1000, 4)
+    }
+
+def benchmark_queries(public_dir, query_count, seed=DEFAULT_SEED):
+    """
+    Loads the single-layout JSON outputs and times word and pattern searches.
+    Word queries mix rare and common terms (one and two terms); pattern queries
+    are substrings cut from random chats, plus a few that match nothing.
+    """
+    build = load_build_module()
+    rng = random.Random(seed)
+
+    started = time.perf_counter()
+    with open(os.path.join(public_dir, 'database.json'), 'r', encoding='utf-8') as f: database = json.load(f)
+    with open(os.path.join(public_dir, 'search_index_word.json'), 'r', encoding='utf-8') as f: word_index = json.load(f)
+    with open(os.path.join(public_dir, 'search_index_trigram.json'), 'r', encoding='utf-8') as f: trigram_index = json.load(f)
+    with open(os.path.join(public_dir, 'search_index_ranking.json'), 'r', encoding='utf-8') as f: ranking = json.load(f)
+    ranking['doc_lengths'] = {int(chat_id): length for chat_id, length in ranking['doc_lengths'].items()}
+    load_seconds = time.perf_counter() - started
+
+    terms = sorted(word_index, key=lambda term: (-len(word_index[term]), term))
+    common, rare = terms[:200], terms[len(terms) // 2:]
+    word_queries = []
+    for i in range(query_count):
+        pool = common if i % 3 == 0 else rare
+        word_queries.append([rng.choice(pool)] + ([rng.choice(common)] if i % 2 else []))
+
+    texts = {int(chat_id): record['content'] for chat_id, record in database.items()}
+    ids = sorted(texts)
+    pattern_queries = ['zzqx no such pattern']
+    while len(pattern_queries) < query_count:
+        text = texts[rng.choice(ids)]
+        start = rng.randrange(max(1, len(text) - 12))
+        pattern_queries.append(text[start:start + rng.randint(4, 10)])
+
+    word_samples, pattern_samples = [], []
+    word_hits, pattern_hits = 0, 0
+    for query in word_queries:
+        started = time.perf_counter()
+        word_hits += len(build.rank_bm25(word_index, ranking, query))
+        word_samples.append(time.perf_counter() - started)
+    for query in pattern_queries:
+        started = time.perf_counter()
+        pattern_hits += len(build.pattern_search(trigram_index, texts, query))
+        pattern_samples.append(time.perf_counter() - started)
+
+    return {
+        'index_load_seconds': round(load_seconds, 4),
+        'word': dict(latency_summary(word_samples), total_hits=word_hits),
+        'pattern': dict(latency_summary(pattern_samples), total_hits=pattern_hits)
+    }
+
+def corpus_summary(corpus_dir):
+    """Counts chats, messages and chat bytes from the report the generator wrote."""
+    summary = {'chats': 0, 'messages': 0, 'chat_bytes': 0}
+    with open(os.path.join(corpus_dir, 'output', 'reports', 'chat_analysis_report.csv'), 'r', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            summary['chats'] += 1
+            summary['messages'] += int(row['Actual Msg Count'])
+            summary['chat_bytes'] += int(row['Filesize (bytes)'])
+    return summary
+
+def report_stage(result, name, stage, logs_dir):
+    """Records a stage's measurements and prints them; returns True if it succeeded."""
+    result['stages'][name] = stage
+    peak = f"{stage['peak_rss_bytes'] / 2**20:,.0f} MiB" if stage['peak_rss_bytes'] else "n/a"
+    print(f"[INFO]   {name:<18} {stage['seconds']:>9.2f} s   peak {peak:>10}   exit {stage['exit_code']}")
+    if stage['exit_code'] != 0:
+        print(f"[ERROR] Stage '{name}' failed; see {os.path.join(logs_dir, name + '.log')}")
+    return stage['exit_code'] == 0
+
+def benchmark_scale(chat_count, query_count):
+    """Runs every stage on a corpus of chat_count chats and returns its results."""
+    corpus_dir = os.path.join(BENCH_DIR, f"corpus_{chat_count}")
+    logs_dir = os.path.join(BENCH_DIR, 'logs', f"corpus_{chat_count}")
+    os.makedirs(logs_dir, exist_ok=True)
+    result = {'chats': chat_count, 'stages': {}, 'outputs': {}}
+
+    if os.path.isfile(os.path.join(corpus_dir, 'data', 'metadata', 'chats.json')):
+        print(f"[INFO] Reusing synthetic corpus: {corpus_dir}")
+    else:
+        print(f"[INFO] Generating {chat_count:,} synthetic chats into: {corpus_dir}")
+        stage = run_stage(GENERATE_SCRIPT, ['--chats', str(chat_count), '--output-dir', corpus_dir],
+                          BASE_DIR, os.path.join(logs_dir, 'generate.log'))
+        if not report_stage(result, 'generate', stage, logs_dir): return result
+    result['corpus'] = corpus_summary(corpus_dir)
+    # Builds must start from scratch, or build_full would measure a rewrite of an old build.
+    for stale in ['build_manifest.json', 'analysis_log_checkpoint.json']:
+        path = os.path.join(corpus_dir, 'output', 'cache', stale)
+        if os.path.isfile(path): os.remove(path)
+
+    public_dir = os.path.join(corpus_dir, 'public')
+    for name, script, arguments, layout in STAGES:
+        stage = run_stage(script, arguments, corpus_dir, os.path.join(logs_dir, f"{name}.log"))
+        if not report_stage(result, name, stage, logs_dir): continue
+        if layout: result['outputs'][name] = measure_outputs(public_dir)
+        if name == QUERY_STAGE:
+            queries_path = os.path.join(logs_dir, 'queries.json')
+            stage = run_stage(os.path.abspath(__file__), ['--query-benchmark', public_dir, '--queries', str(query_count),
+                                                          '--output', queries_path], BASE_DIR,
+                              os.path.join(logs_dir, 'queries.log'))
+            if not report_stage(result, 'queries', stage, logs_dir): continue
+            with open(queries_path, 'r', encoding='utf-8') as f: result['queries'] = json.load(f)
+            word, pattern = result['queries']['word'], result['queries']['pattern']
+            print(f"[INFO]   word search        p50 {word['p50_ms']:.3f} ms, p95 {word['p95_ms']:.3f} ms; "
+                  f"pattern search p50 {pattern['p50_ms']:.3f} ms, p95 {pattern['p95_ms']:.3f} ms")
+    return result
+
+def flatten_metrics(node, prefix=''):
+    """Yields (dotted path, value) for every comparable number: times, latencies and sizes."""
+    if isinstance(node, dict):
+        for key, value in node.items():
+            yield from flatten_metrics(value, f"{prefix}.{key}" if prefix else key)
+    elif isinstance(node, (int, float)) and not isinstance(node, bool):
+        unit = next((unit for unit in COMPARE_FLOORS if prefix.endswith(unit)), None)
+        if unit and not prefix.endswith(COMPARE_SKIP_SUFFIXES): yield prefix, unit, node
+
+def compare_results(current, baseline, threshold):
+    """Prints every metric that grew by more than threshold; returns the number of regressions."""
+    previous = {path: value for path, _, value in flatten_metrics(baseline.get('scales', {}))}
+    regressions = 0
+    for path, unit, value in flatten_metrics(current['scales']):
+        old = previous.get(path)
+        if old is None or max(old, value) < COMPARE_FLOORS[unit]: continue
+        change = (value - old) / old if old else float('inf')
+        if change > threshold:
+            regressions += 1
+            print(f"[WARNING] REGRESSION {path}: {old:,} -> {value:,} ({change:+.0%})")
+        elif change < -threshold:
+            print(f"[INFO] Improved {path}: {old:,} -> {value:,} ({change:+.0%})")
+    if regressions == 0:
+        print(f"[SUCCESS] No metric regressed by more than {threshold:.0%}.")
+    return regressions
+
+def git_commit():
+    """Returns the current git commit of the project, or None outside a git checkout."""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=SRC_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the thortStream pipeline on synthetic corpora.")
+    parser.add_argument('--scales', default='1000',
+                        help="Comma-separated corpus sizes in chats, e.g. '1000,10000,100000' (default: 1000).")
+    parser.add_argument('--queries', type=int, default=DEFAULT_QUERY_COUNT,
+                        help="Word and pattern queries timed per scale (default: 200).")
+    parser.add_argument('--output', help="Results file (default: output/bench/results/bench_<timestamp>.json).")
+    parser.add_argument('--compare', help="An earlier results file to check for regressions.")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="Relative growth that counts as a regression (default: 0.20).")
+    parser.add_argument('--query-benchmark', metavar='PUBLIC_DIR', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.query_benchmark:
+        # Internal: the query stage, run in its own process by benchmark_scale().
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(benchmark_queries(args.query_benchmark, args.queries), f, indent=2)
+        return
+
+    scales = [int(scale) for scale in args.scales.split(',') if scale.strip()]
+    print("--- Starting thortStream Benchmarks ---")
+    results = {
+        'version': RESULTS_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'scales': {}
+    }
+    for chat_count in scales:
+        print(f"[INFO] Scale: {chat_count:,} chats")
+        results['scales'][str(chat_count)] = benchmark_scale(chat_count, args.queries)
+
+    output_path = args.output or os.path.join(RESULTS_DIR, f"bench_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"[SUCCESS] Benchmark results written to: {output_path}")
+
+    failed = any(stage['exit_code'] != 0 for scale in results['scales'].values() for stage in scale['stages'].values())
+    regressions = 0
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            regressions = compare_results(results, json.load(f), args.threshold)
+    if failed or regressions: sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+Filename:   atomic_write.py
+Author:     Simon C, assisted by Dora
+Version:    1.1
+Date:       2026-10-17
+Description:
+    atomic_open() is open() for output files that something else may read at
+    any moment: the search API server, a browser fetching public/, or the
+    next stage of run_pipeline.py --watch. The data is written to a temporary
+    file next to the target, which is renamed over the target only once it is
+    complete, so a reader sees either the old file or the new one in full:
+
+        with atomic_open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+
+    If the block raises, the target is left as it was. The temporary file is
+    hidden and named after the writing process, '.<name>.<pid>.tmp', so a
+    folder scanner never takes a file left behind by a killed writer for a
+    real one; remove_stale_temp_files() clears such leftovers.
+"""
+
+import os
+import contextlib
+
+# --- CONFIGURATION ---
+TEMP_SUFFIX = '.tmp'
+
+# --- SCRIPT ---
+
+def temp_path_for(path):
+    """Returns the hidden temporary name atomic_open() writes path under."""
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f'.{name}.{os.getpid()}{TEMP_SUFFIX}')
+
+def remove_stale_temp_files(directory, suffixes=(TEMP_SUFFIX,)):
+    """Removes the temporary files that interrupted writers left anywhere under directory. Returns how many."""
+    removed = 0
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            if filename.endswith(tuple(suffixes)):
+                os.remove(os.path.join(root, filename))
+                removed += 1
+    return removed
+
+@contextlib.contextmanager
+def atomic_open(path, mode='w', **kwargs):
+    temp_path = temp_path_for(path)
+    try:
+        with open(temp_path, mode, **kwargs) as f:
+            yield f
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path): os.remove(temp_path)
+        raise
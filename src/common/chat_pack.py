@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+"""
+Filename:   chat_pack.py
+Author:     Simon C, assisted by Dora
+Version:    1.2
+Date:       2026-10-17
+Description:
+    The chat pack: every chat file of data/allchats/ copied into one
+    append-only data file, next to an index keyed by chat ID. Once the pack
+    is up to date, a pipeline stage reads the whole archive from one memory
+    map instead of opening tens of thousands of small files:
+
+        pack = open_chat_pack()
+        entry = pack.current(chat_id, rel_path, os.stat(filepath))
+        if entry is not None:
+            content = decode_chat(pack.get(entry))   # zero-copy slice of the map
+
+    analyze_gemini_chats.py --pack writes it (update_pack() only reads the
+    files that are new or changed since the last run); build_database.py,
+    build_search_db.py and build_website_content.py read from it whenever it
+    holds the current copy of a chat and fall back to the loose file if not.
+
+    Layout (all integers little-endian), in output/cache/chat_pack/:
+        chats.pack  DATA_HEADER (magic, version, pack id), then the raw bytes
+                    of each chat file, back to back. New or changed chats are
+                    appended; the bytes of replaced copies stay behind until
+                    the pack is compacted.
+        chats.idx   INDEX_HEADER (magic, version, pack id, entry count,
+                    boundary count, path bytes, committed data bytes), then
+                    one INDEX_ENTRY per chat in ID order (chat ID, offset,
+                    length, source mtime, sha256, first boundary, boundary
+                    count), the message boundaries as uint32 values (byte
+                    offset of a marker << 1 | role), and the '/'-separated
+                    source paths, NUL-terminated, in entry order.
+    The index is replaced atomically after the appended bytes are synced, and
+    only the committed data bytes it names are ever read, so a run that dies
+    half way leaves the previous pack readable. The pack id ties an index to
+    the data file it was written for.
+"""
+
+import os
+import sys
+import mmap
+import struct
+import hashlib
+import secrets
+from array import array
+from collections import namedtuple
+
+from instrumentation import count
+
+# --- CONFIGURATION ---
+BASE_DIR = os.getcwd()
+PACK_DIR = os.path.join(BASE_DIR, 'output', 'cache', 'chat_pack')
+DATA_FILE_NAME = 'chats.pack'
+INDEX_FILE_NAME = 'chats.idx'
+
+PACK_VERSION = 1
+DATA_MAGIC = b'TSCP'
+INDEX_MAGIC = b'TSCX'
+DATA_HEADER = struct.Struct('<4sIQ')  # magic, version, pack id
+INDEX_HEADER = struct.Struct('<4sIQIIIQ')  # magic, version, pack id, entries, boundaries, path bytes, data bytes
+INDEX_ENTRY = struct.Struct('<IQIq32sII')  # chat id, offset, length, mtime_ns, sha256, first boundary, boundaries
+
+# Message markers written by the scraper (the same as in analyze_gemini_chats.py and build_database.py).
+# Each is found independently, non-overlapping, so len(boundaries) is the analysis message count.
+MESSAGE_MARKERS = [(b'## PROMPT ##', 'prompt'), (b'## RESPONSE ##', 'response')]
+# Boundary values keep the role in the low bit, which limits a single chat file to 2 GiB.
+MAX_CHAT_BYTES = (1 << 31) - 1
+
+# update_pack() rewrites the data file once the bytes of replaced copies outweigh the live ones.
+COMPACT_DEAD_RATIO = 0.5
+
+# --- SCRIPT ---
+
+PackEntry = namedtuple('PackEntry', 'chat_id path offset length mtime_ns sha256 first_boundary boundary_count')
+
+def decode_chat(raw):
+    """
+    Decodes chat file bytes (bytes or a memoryview) exactly as a text-mode read
+    with errors='ignore' would: invalid UTF-8 is dropped, newlines become '\\n'.
+    """
+    return str(raw, 'utf-8', 'ignore').replace('\r\n', '\n').replace('\r', '\n')
+
+def pack_path(rel_path):
+    """The path of a chat file relative to data/allchats/, '/'-separated as the index stores it."""
+    return rel_path.replace(os.sep, '/')
+
+def find_boundaries(raw):
+    """Returns the encoded message boundaries (offset << 1 | role) of chat file bytes, in file order."""
+    boundaries = []
+    for role, (marker, _) in enumerate(MESSAGE_MARKERS):
+        position = raw.find(marker)
+        while position != -1:
+            boundaries.append(position << 1 | role)
+            position = raw.find(marker, position + len(marker))
+    boundaries.sort()
+    return boundaries
+
+def read_index(pack_dir):
+    """
+    Reads chats.idx. Returns (pack id, data bytes, {chat_id: PackEntry}, boundaries
+    array), or None when there is no index or it is not one this version wrote.
+    """
+    try:
+        with open(os.path.join(pack_dir, INDEX_FILE_NAME), 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    count(bytes_read=len(data), files_read=1)
+    if len(data) < INDEX_HEADER.size: return None
+    magic, version, pack_id, entry_count, boundary_count, path_bytes, data_bytes = INDEX_HEADER.unpack_from(data)
+    boundaries_start = INDEX_HEADER.size + entry_count * INDEX_ENTRY.size
+    paths_start = boundaries_start + boundary_count * 4
+    if magic != INDEX_MAGIC or version != PACK_VERSION or len(data) != paths_start + path_bytes:
+        return None
+    boundaries = array('I', data[boundaries_start:paths_start])
+    if sys.byteorder == 'big': boundaries.byteswap()
+    paths = data[paths_start:].split(b'\0')
+    entries = {}
+    for i, fields in enumerate(INDEX_ENTRY.iter_unpack(data[INDEX_HEADER.size:boundaries_start])):
+        chat_id, offset, length, mtime_ns, digest, first, boundary_total = fields
+        entries[chat_id] = PackEntry(chat_id, paths[i].decode('utf-8'), offset, length, mtime_ns, digest.hex(),
+                                     first, boundary_total)
+    return pack_id, data_bytes, entries, boundaries
+
+def write_index(pack_dir, pack_id, data_bytes, entries, boundaries):
+    """Writes chats.idx for entries (in chat ID order) whose boundary ranges point into boundaries."""
+    ordered = [entries[chat_id] for chat_id in sorted(entries)]
+    table, packed_boundaries = [], array('I')
+    for entry in ordered:
+        first = len(packed_boundaries)
+        packed_boundaries.extend(boundaries[entry.first_boundary:entry.first_boundary + entry.boundary_count])
+        table.append(INDEX_ENTRY.pack(entry.chat_id, entry.offset, entry.length, entry.mtime_ns,
+                                      bytes.fromhex(entry.sha256), first, entry.boundary_count))
+    if sys.byteorder == 'big': packed_boundaries.byteswap()
+    paths = b''.join(entry.path.encode('utf-8') + b'\0' for entry in ordered)
+    index_path = os.path.join(pack_dir, INDEX_FILE_NAME)
+    temp_path = index_path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(INDEX_HEADER.pack(INDEX_MAGIC, PACK_VERSION, pack_id, len(ordered), len(packed_boundaries),
+                                  len(paths), data_bytes))
+        f.write(b''.join(table))
+        f.write(packed_boundaries.tobytes())
+        f.write(paths)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, index_path)
+
+def read_data_header(data_path):
+    """Returns the pack id of a data file, or None if it is missing or not a pack."""
+    try:
+        with open(data_path, 'rb') as f:
+            header = f.read(DATA_HEADER.size)
+    except FileNotFoundError:
+        return None
+    if len(header) != DATA_HEADER.size: return None
+    magic, version, pack_id = DATA_HEADER.unpack(header)
+    return pack_id if magic == DATA_MAGIC and version == PACK_VERSION else None
+
+def new_data_file(data_path):
+    """Starts an empty data file with a fresh pack id and returns the id."""
+    pack_id = secrets.randbits(64)
+    with open(data_path, 'wb') as f:
+        f.write(DATA_HEADER.pack(DATA_MAGIC, PACK_VERSION, pack_id))
+    return pack_id
+
+def update_pack(sources, pack_dir=PACK_DIR, changed_ids=None):
+    """
+    Brings the pack in line with sources, {chat_id: (rel_path, full_path)}. A
+    chat is only read when its path, size or mtime differs from the pack's copy;
+    if its bytes turn out to be the same, only its index entry is updated, else
+    the file is appended. With changed_ids, only those chats are looked at on
+    disk; the others keep their entry if it has the same path. Chats not in
+    sources are dropped from the index. The pack is compacted when replaced
+    copies take up too much of the data file.
+    A run that changes nothing writes nothing, so both files keep their mtime.
+    Returns a dict of counts.
+    """
+    os.makedirs(pack_dir, exist_ok=True)
+    data_path = os.path.join(pack_dir, DATA_FILE_NAME)
+    index = read_index(pack_dir)
+    if index is not None and read_data_header(data_path) == index[0] and os.path.getsize(data_path) >= index[1]:
+        pack_id, data_bytes, old_entries, old_boundaries = index
+    else:
+        pack_id, data_bytes, old_entries, old_boundaries = new_data_file(data_path), DATA_HEADER.size, {}, array('I')
+
+    stats = {'appended': 0, 'relinked': 0, 'unchanged': 0, 'removed': 0, 'failed': 0, 'bytes_appended': 0}
+    entries, boundaries = {}, array('I')
+
+    def keep(old, **changes):
+        entries[old.chat_id] = old._replace(first_boundary=len(boundaries), **changes)
+        boundaries.extend(old_boundaries[old.first_boundary:old.first_boundary + old.boundary_count])
+    with open(data_path, 'r+b') as data:
+        # Anything past the committed bytes was appended by a run that never wrote its index.
+        if os.fstat(data.fileno()).st_size > data_bytes: data.truncate(data_bytes)
+        data.seek(data_bytes)
+        for chat_id in sorted(sources):
+            rel_path, full_path = sources[chat_id]
+            rel_path = pack_path(rel_path)
+            old = old_entries.get(chat_id)
+            if changed_ids is not None and chat_id not in changed_ids and old is not None and old.path == rel_path:
+                keep(old)
+                stats['unchanged'] += 1
+                continue
+            try:
+                stat = os.stat(full_path)
+                if old is not None and old.path == rel_path and old.length == stat.st_size and old.mtime_ns == stat.st_mtime_ns:
+                    keep(old)
+                    stats['unchanged'] += 1
+                    continue
+                with open(full_path, 'rb') as f:
+                    stat = os.fstat(f.fileno())
+                    raw = f.read()
+                count(bytes_read=len(raw), files_read=1)
+            except OSError as e:
+                print(f"[ERROR] Could not read {full_path} into the chat pack: {e}")
+                stats['failed'] += 1
+                continue
+            if len(raw) > MAX_CHAT_BYTES:
+                print(f"[WARNING] {full_path} is too large for the chat pack ({len(raw):,} bytes), leaving it out.")
+                stats['failed'] += 1
+                continue
+            digest = hashlib.sha256(raw).hexdigest()
+            if old is not None and old.sha256 == digest:
+                # Touched or moved, but the bytes are the same: point at the copy already packed.
+                keep(old, path=rel_path, mtime_ns=stat.st_mtime_ns)
+                stats['relinked'] += 1
+                continue
+            found = find_boundaries(raw)
+            entries[chat_id] = PackEntry(chat_id, rel_path, data_bytes, len(raw), stat.st_mtime_ns, digest,
+                                         len(boundaries), len(found))
+            boundaries.extend(found)
+            data.write(raw)
+            data_bytes += len(raw)
+            stats['appended'] += 1
+            stats['bytes_appended'] += len(raw)
+        if stats['appended']:
+            data.flush()
+            os.fsync(data.fileno())
+    stats['removed'] = len(old_entries.keys() - entries.keys())
+    if stats['appended'] or stats['relinked'] or stats['removed'] or not old_entries:
+        write_index(pack_dir, pack_id, data_bytes, entries, boundaries)
+
+    live_bytes = sum(entry.length for entry in entries.values())
+    dead_bytes = data_bytes - DATA_HEADER.size - live_bytes
+    if dead_bytes > COMPACT_DEAD_RATIO * (data_bytes - DATA_HEADER.size):
+        compact_pack(pack_dir, entries, boundaries)
+        stats['compacted_bytes'] = dead_bytes
+    return stats
+
+def compact_pack(pack_dir, entries, boundaries):
+    """
+    Rewrites the data file with only the chats in entries, in chat ID order, under
+    a new pack id. The old index stops matching the new data file the moment the
+    data file is replaced, so a crash in between only costs a full repack.
+    """
+    data_path = os.path.join(pack_dir, DATA_FILE_NAME)
+    temp_path = data_path + '.tmp'
+    pack_id = new_data_file(temp_path)
+    compacted = {}
+    with open(data_path, 'rb') as old, open(temp_path, 'r+b') as new:
+        new.seek(DATA_HEADER.size)
+        for chat_id in sorted(entries):
+            entry = entries[chat_id]
+            old.seek(entry.offset)
+            compacted[chat_id] = entry._replace(offset=new.tell())
+            new.write(old.read(entry.length))
+        data_bytes = new.tell()
+        new.flush()
+        os.fsync(new.fileno())
+    os.replace(temp_path, data_path)
+    write_index(pack_dir, pack_id, data_bytes, compacted, boundaries)
+
+class ChatPack:
+    """
+    Read access to a chat pack through one read-only memory map of the data
+    file. get() hands out memoryview slices of the map, so nothing is copied
+    until the caller decodes them.
+    """
+
+    def __init__(self, pack_dir=PACK_DIR):
+        index = read_index(pack_dir)
+        if index is None:
+            raise ValueError(f"no usable chat pack index in {pack_dir}")
+        pack_id, data_bytes, self.entries, self.boundary_values = index
+        data_path = os.path.join(pack_dir, DATA_FILE_NAME)
+        if read_data_header(data_path) != pack_id or os.path.getsize(data_path) < data_bytes:
+            raise ValueError(f"the chat pack index in {pack_dir} does not match its data file")
+        with open(data_path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), data_bytes, access=mmap.ACCESS_READ)
+        if hasattr(mmap, 'MADV_WILLNEED'):
+            # Ask for the whole file up front: the kernel reads it in large sequential chunks.
+            self.map.madvise(mmap.MADV_WILLNEED)
+        count(files_read=1)
+        self.view = memoryview(self.map)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, chat_id):
+        return chat_id in self.entries
+
+    def entry(self, chat_id):
+        """Returns the PackEntry of a chat, or None."""
+        return self.entries.get(chat_id)
+
+    def current(self, chat_id, rel_path, stat):
+        """Returns the PackEntry of a chat if the pack holds exactly the file at rel_path described by stat."""
+        entry = self.entries.get(chat_id)
+        if (entry is None or entry.path != pack_path(rel_path) or entry.length != stat.st_size
+                or entry.mtime_ns != stat.st_mtime_ns):
+            return None
+        return entry
+
+    def get(self, entry):
+        """Returns the bytes of a chat (a PackEntry or chat ID) as a memoryview of the map."""
+        if not isinstance(entry, PackEntry): entry = self.entries[entry]
+        return self.view[entry.offset:entry.offset + entry.length]
+
+    def boundaries(self, entry):
+        """Returns [(role, byte offset)] for every message marker of a chat, in file order."""
+        if not isinstance(entry, PackEntry): entry = self.entries[entry]
+        values = self.boundary_values[entry.first_boundary:entry.first_boundary + entry.boundary_count]
+        return [(MESSAGE_MARKERS[value & 1][1], value >> 1) for value in values]
+
+    def message_count(self, entry):
+        """Returns the number of message markers in a chat, as analyze_gemini_chats.py counts them."""
+        if not isinstance(entry, PackEntry): entry = self.entries[entry]
+        return entry.boundary_count
+
+    def close(self):
+        self.view.release()
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+def open_chat_pack(pack_dir=PACK_DIR):
+    """Opens the chat pack if there is a usable one, else returns None (the caller reads loose files)."""
+    if not os.path.isfile(os.path.join(pack_dir, INDEX_FILE_NAME)): return None
+    try:
+        pack = ChatPack(pack_dir)
+    except (OSError, ValueError) as e:
+        print(f"[WARNING] Ignoring the chat pack: {e}. Chat files are read from disk instead.")
+        return None
+    print(f"[INFO] Reading chat content from the chat pack ({len(pack):,} chats): {pack_dir}")
+    return pack
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+Filename:   file_watcher.py
+Author:     Simon C, assisted by Dora
+Version:    1.0
+Date:       2026-10-17
+Description:
+    Change notification for long-running scripts (run_pipeline.py --watch).
+    open_watcher() returns an inotify watcher on Linux and a polling one
+    anywhere else, or when inotify cannot be set up (the per-user watch limit
+    is reached, say). Both have the same interface:
+
+        watcher = open_watcher([chats_folder, log_file])
+        changes = wait_for_batch(watcher)    # a set of changed file paths, or RESCAN
+
+    Folders are watched recursively and files through their parent folder,
+    so a file that is created later, or replaced by a rename, is still seen.
+    RESCAN means the watcher lost track (a folder appeared or went away, or
+    the kernel queue overflowed) and the caller should look at everything.
+    wait_for_batch() debounces: a burst of changes, such as a scraper saving
+    a chat and appending to its log, comes back as one batch once the burst
+    has been quiet for a moment.
+"""
+
+import os
+import sys
+import time
+import select
+import struct
+import ctypes
+import ctypes.util
+
+# --- CONFIGURATION ---
+POLL_INTERVAL = 2.0  # seconds between scans of the polling watcher
+DEBOUNCE_SECONDS = 0.5  # a batch ends once no change arrived for this long...
+MAX_BATCH_SECONDS = 5.0  # ...or once it has been collecting for this long
+INOTIFY_BUFFER_SIZE = 64 * 1024
+
+# inotify(7) event bits
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF)
+LOST_TRACK_MASK = IN_Q_OVERFLOW | IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF
+INOTIFY_EVENT = struct.Struct('iIII')  # watch descriptor, mask, cookie, name length
+
+# --- SCRIPT ---
+
+class Rescan:
+    """The 'look at everything' result; it absorbs whatever it is merged with."""
+    def __repr__(self): return 'RESCAN'
+
+RESCAN = Rescan()
+
+def merge_changes(first, second):
+    if first is RESCAN or second is RESCAN: return RESCAN
+    return first | second
+
+def watch_targets(paths):
+    """Splits watched paths into folders watched as whole trees and {parent folder: {file names}}."""
+    trees, files = [], {}
+    for path in paths:
+        path = os.path.abspath(path)
+        if os.path.isdir(path): trees.append(path)
+        else: files.setdefault(os.path.dirname(path), set()).add(os.path.basename(path))
+    return trees, files
+
+class InotifyWatcher:
+    """Watches through the Linux inotify API, called with ctypes."""
+
+    def __init__(self, paths):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0: raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.trees, self.files = watch_targets(paths)
+        self.watches = {}  # watch descriptor -> (folder, file names or None for every file)
+        try:
+            for tree in self.trees: self.add_tree(tree)
+            for folder, names in self.files.items(): self.add_watch(folder, names)
+        except OSError:
+            self.close()
+            raise
+
+    def add_watch(self, folder, names=None):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(folder), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, f"inotify_add_watch failed for {folder}: {os.strerror(error)}")
+        self.watches[wd] = (folder, names)
+
+    def add_tree(self, tree):
+        for folder, subfolders, _ in os.walk(tree):
+            subfolders[:] = [name for name in subfolders if name != '__pycache__']
+            self.add_watch(folder)
+
+    def wait(self, timeout=None):
+        """Returns the changed file paths (an empty set on timeout), or RESCAN."""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable: return set()
+        changes = set()
+        while True:
+            try:
+                data = os.read(self.fd, INOTIFY_BUFFER_SIZE)
+            except BlockingIOError:
+                return changes
+            position = 0
+            while position < len(data):
+                wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, position)
+                name = data[position + INOTIFY_EVENT.size:position + INOTIFY_EVENT.size + length].rstrip(b'\0')
+                position += INOTIFY_EVENT.size + length
+                if mask & LOST_TRACK_MASK or wd not in self.watches:
+                    changes = RESCAN
+                    continue
+                folder, names = self.watches[wd]
+                name = os.fsdecode(name)
+                if mask & IN_ISDIR:
+                    if names is None and mask & (IN_CREATE | IN_MOVED_TO):
+                        # A new folder may already hold files by the time its watch is added.
+                        self.add_tree(os.path.join(folder, name))
+                        changes = RESCAN
+                    continue
+                if changes is not RESCAN and (names is None or name in names):
+                    changes.add(os.path.join(folder, name))
+
+    def close(self):
+        if self.fd >= 0: os.close(self.fd)
+        self.fd = -1
+
+class PollingWatcher:
+    """Watches by comparing the sizes and mtimes of every watched file every POLL_INTERVAL seconds."""
+
+    def __init__(self, paths, interval=POLL_INTERVAL):
+        self.trees, self.files = watch_targets(paths)
+        self.interval = interval
+        self.snapshot = self.scan()
+        self.next_poll = time.monotonic() + interval
+
+    def scan(self):
+        snapshot = {}
+        for tree in self.trees:
+            for folder, subfolders, names in os.walk(tree):
+                subfolders[:] = [name for name in subfolders if name != '__pycache__']
+                for name in names: self.stat_into(snapshot, os.path.join(folder, name))
+        for folder, names in self.files.items():
+            for name in names: self.stat_into(snapshot, os.path.join(folder, name))
+        return snapshot
+
+    @staticmethod
+    def stat_into(snapshot, path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return
+        snapshot[path] = (stat.st_size, stat.st_mtime_ns)
+
+    def wait(self, timeout=None):
+        """Returns the changed file paths (an empty set on timeout)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if deadline is not None and deadline < self.next_poll:
+                time.sleep(max(0.0, deadline - time.monotonic()))
+                return set()
+            time.sleep(max(0.0, self.next_poll - time.monotonic()))
+            snapshot = self.scan()
+            self.next_poll = time.monotonic() + self.interval
+            changes = {path for path in snapshot.keys() | self.snapshot.keys()
+                       if snapshot.get(path) != self.snapshot.get(path)}
+            self.snapshot = snapshot
+            if changes: return changes
+
+    def close(self):
+        pass
+
+def open_watcher(paths, polling=False):
+    """Returns an InotifyWatcher where inotify is available (unless polling is set), else a PollingWatcher."""
+    if not polling and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(paths)
+        except (OSError, AttributeError) as e:
+            print(f"[WARNING] inotify is not available ({e}). Polling every {POLL_INTERVAL:g} s instead.")
+    return PollingWatcher(paths)
+
+def wait_for_batch(watcher, quiet=DEBOUNCE_SECONDS, longest=MAX_BATCH_SECONDS):
+    """
+    Blocks until something changes, then keeps collecting until nothing more
+    arrived for quiet seconds (or longest seconds have passed) and returns
+    everything that changed as one batch.
+    """
+    changes = set()
+    while not changes: changes = watcher.wait(None)
+    deadline = time.monotonic() + longest
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0: return changes
+        more = watcher.wait(min(quiet, remaining))
+        if not more: return changes
+        changes = merge_changes(changes, more)
@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+"""
+Filename:   instrumentation.py
+Author:     Simon C, assisted by Dora
+Version:    1.0
+Date:       2026-10-17
+Description:
+    Shared instrumentation for the pipeline scripts. A script wraps each of its
+    phases in a span and adds counters to whichever span is open:
+
+        with span('load_inputs'):
+            ...
+            count(bytes_read=len(data), files_read=1)
+
+    A span records its wall and CPU time, the counters added while it was open
+    (those of its child spans included) and the process's peak RSS when it
+    closed. Work repeated per chat is timed with phase() instead, which only
+    adds to a per-name total on the enclosing span, so a 100k-chat build does
+    not produce 100k trace events.
+
+    Spans are always recorded (the cost is a few clock reads), but nothing is
+    written unless tracing is switched on, either with the flags that
+    add_trace_arguments() adds or, without touching the command line, from the
+    environment:
+        THORTSTREAM_TRACE=output/traces/build.json   (or 1 for a timestamped name)
+        THORTSTREAM_PROFILE=<span name>
+    The trace is written in the Chrome trace-event JSON format, so it opens in
+    chrome://tracing or https://ui.perfetto.dev, and a per-span summary is
+    printed at exit. A profile stage runs cProfile while spans of that name are
+    open; the stats are saved as a .prof file and the hottest functions printed.
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import cProfile
+import pstats
+import threading
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# --- CONFIGURATION ---
+BASE_DIR = os.getcwd()
+TRACE_DIR = os.path.join(BASE_DIR, 'output', 'traces')
+TRACE_ENV = 'THORTSTREAM_TRACE'
+PROFILE_ENV = 'THORTSTREAM_PROFILE'
+TRACE_VERSION = 1
+PROFILE_TOP_FUNCTIONS = 15
+
+# --- SCRIPT ---
+
+def peak_rss_bytes():
+    """Returns the peak resident set size of this process so far, or None if it cannot be read."""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+        return peak if sys.platform == 'darwin' else peak * 1024
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss)  # peak_wset is the Windows equivalent
+    return None
+
+def add_counters(span, amounts):
+    for key, value in amounts.items():
+        span.counters[key] = span.counters.get(key, 0) + value
+
+def add_phase(span, name, wall, cpu):
+    totals = span.phases.setdefault(name, [0, 0.0, 0.0])
+    totals[0] += 1
+    totals[1] += wall
+    totals[2] += cpu
+
+class Span:
+    """One timed phase of a run. Counters and phase totals roll up into the parent span on close."""
+
+    def __init__(self, name, parent, attrs):
+        self.name = name
+        self.parent = parent
+        self.attrs = attrs
+        self.thread_id = threading.get_ident()
+        self.counters = {}
+        self.phases = {}
+        self.error = None
+        self.start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        self.wall_seconds = self.cpu_seconds = None
+        self.peak_rss_bytes = None
+
+    def close(self):
+        self.wall_seconds = time.perf_counter() - self.start
+        self.cpu_seconds = time.process_time() - self.cpu_start
+        self.peak_rss_bytes = peak_rss_bytes()
+
+class NullSpan:
+    """Stands in for a span when no script has configured tracing (e.g. a module imported by another)."""
+
+    def __enter__(self): return self
+    def __exit__(self, *exc_info): return False
+
+NULL_SPAN = NullSpan()
+
+class SpanContext:
+    def __init__(self, tracer, name, attrs):
+        self.tracer, self.name, self.attrs = tracer, name, attrs
+        self.span = None
+
+    def __enter__(self):
+        self.span = self.tracer.open_span(self.name, self.attrs)
+        return self.span
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None: self.span.error = exc_type.__name__
+        self.tracer.close_span(self.span)
+        return False
+
+class PhaseContext:
+    def __init__(self, tracer, name):
+        self.tracer, self.name = tracer, name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.cpu_start = time.process_time()
+
+    def __exit__(self, *exc_info):
+        wall, cpu = time.perf_counter() - self.start, time.process_time() - self.cpu_start
+        span = self.tracer.current_span()
+        with self.tracer.lock: add_phase(span, self.name, wall, cpu)
+        return False
+
+class Tracer:
+    """Records the spans of one script run and writes them out when the run ends."""
+
+    def __init__(self, script_name, trace_path=None, profile_stage=None):
+        self.script_name = script_name
+        self.trace_path = trace_path
+        self.profile_stage = profile_stage
+        self.started_at = time.time()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.closed = []
+        self.profiler = None
+        self.profiler_owner = None
+        self.profiled_calls = 0
+        self.finished = False
+        self.root = Span(script_name, None, {'argv': sys.argv[1:]})
+        self.main_stack = self.stack()
+
+    def stack(self):
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def current_span(self):
+        # A worker thread with no span of its own nests under whatever the main thread has open.
+        try:
+            return (self.stack() or self.main_stack)[-1]
+        except IndexError:
+            return self.root
+
+    def open_span(self, name, attrs):
+        span = Span(name, self.current_span(), attrs)
+        self.stack().append(span)
+        if name == self.profile_stage:
+            with self.lock:
+                if self.profiler_owner is None:
+                    if self.profiler is None: self.profiler = cProfile.Profile()
+                    self.profiler_owner = span
+                    self.profiled_calls += 1
+                    self.profiler.enable()
+        return span
+
+    def close_span(self, span):
+        if self.profiler_owner is span:
+            self.profiler.disable()
+            self.profiler_owner = None
+        span.close()
+        self.stack().pop()
+        with self.lock:
+            add_counters(span.parent, span.counters)
+            self.closed.append(span)
+
+    def count(self, amounts):
+        span = self.current_span()
+        with self.lock: add_counters(span, amounts)
+
+    def trace_events(self):
+        """Returns the recorded spans as Chrome trace 'complete' events (timestamps in microseconds)."""
+        events = []
+        pid = os.getpid()
+        for span in [self.root] + self.closed:
+            args = dict(span.attrs)
+            args.update(span.counters)
+            args['cpu_seconds'] = round(span.cpu_seconds, 6)
+            args['peak_rss_bytes'] = span.peak_rss_bytes
+            if span.phases:
+                args['phases'] = {name: {'calls': calls, 'wall_seconds': round(wall, 6), 'cpu_seconds': round(cpu, 6)}
+                                  for name, (calls, wall, cpu) in span.phases.items()}
+            if span.error: args['error'] = span.error
+            events.append({'name': span.name, 'cat': self.script_name, 'ph': 'X', 'pid': pid, 'tid': span.thread_id,
+                           'ts': round((span.start - self.root.start) * 1e6, 1),
+                           'dur': round(span.wall_seconds * 1e6, 1), 'args': args})
+        return events
+
+    def summary_lines(self):
+        """Returns one line per span name: calls, wall and CPU time, peak RSS and counters."""
+        totals = {}
+        for span in self.closed:
+            entry = totals.setdefault(span.name, {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'peak': 0, 'counters': {}})
+            entry['calls'] += 1
+            entry['wall'] += span.wall_seconds
+            entry['cpu'] += span.cpu_seconds
+            entry['peak'] = max(entry['peak'], span.peak_rss_bytes or 0)
+            for key, value in span.counters.items():
+                entry['counters'][key] = entry['counters'].get(key, 0) + value
+            for name, (calls, wall, cpu) in span.phases.items():
+                phase = totals.setdefault(f"{span.name}/{name}", {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'peak': 0,
+                                                                   'counters': {}})
+                phase['calls'] += calls
+                phase['wall'] += wall
+                phase['cpu'] += cpu
+        lines = [f"{'span':<32} {'calls':>7} {'wall s':>9} {'cpu s':>9} {'peak MiB':>9}  counters"]
+        for name, entry in sorted(totals.items(), key=lambda item: -item[1]['wall']):
+            counters = ', '.join(f"{key}={value:,}" for key, value in sorted(entry['counters'].items()))
+            peak = f"{entry['peak'] / 2**20:,.0f}" if entry['peak'] else '-'
+            lines.append(f"{name:<32} {entry['calls']:>7,} {entry['wall']:>9.3f} {entry['cpu']:>9.3f} {peak:>9}  {counters}")
+        return lines
+
+    def finish(self):
+        """Closes the root span, then writes the trace and profile if they were asked for."""
+        if self.finished: return
+        self.finished = True
+        if self.profiler_owner is not None:
+            self.profiler.disable()
+        self.root.close()
+        if not self.trace_path and not self.profile_stage: return
+
+        print(f"\n--- Trace summary: {self.script_name} ({self.root.wall_seconds:.2f} s wall, "
+              f"{self.root.cpu_seconds:.2f} s CPU) ---")
+        for line in self.summary_lines(): print(line)
+        if self.trace_path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.trace_path)), exist_ok=True)
+            with open(self.trace_path, 'w', encoding='utf-8') as f:
+                json.dump({'traceEvents': self.trace_events(), 'displayTimeUnit': 'ms',
+                           'otherData': {'version': TRACE_VERSION, 'script': self.script_name, 'argv': sys.argv[1:],
+                                         'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started_at)),
+                                         'python': sys.version.split()[0]}}, f)
+            print(f"[INFO] Trace written to: {self.trace_path}")
+        if self.profile_stage:
+            if self.profiler is None:
+                print(f"[WARNING] Profile stage '{self.profile_stage}' never ran; no profile written.")
+                return
+            profile_path = (os.path.splitext(self.trace_path)[0] if self.trace_path
+                            else default_trace_path(self.script_name, self.started_at)[:-len('.json')])
+            profile_path += f".{self.profile_stage}.prof"
+            os.makedirs(os.path.dirname(os.path.abspath(profile_path)), exist_ok=True)
+            self.profiler.dump_stats(profile_path)
+            print(f"[INFO] Profile of '{self.profile_stage}' ({self.profiled_calls} spans) written to: {profile_path}")
+            pstats.Stats(self.profiler).sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+
+_active = None
+
+def default_trace_path(script_name, started_at=None):
+    """Returns output/traces/<script>_<timestamp>.json."""
+    stamp = time.strftime('%Y%m%d_%H%M%S', time.localtime(started_at if started_at is not None else time.time()))
+    return os.path.join(TRACE_DIR, f"{script_name}_{stamp}.json")
+
+def add_trace_arguments(parser):
+    """Adds --trace and --profile-stage to a script's argument parser."""
+    parser.add_argument('--trace', nargs='?', const='', default=None, metavar='PATH',
+                        help=f"Write a JSON trace of every stage (default path: output/traces/). Also: {TRACE_ENV}.")
+    parser.add_argument('--profile-stage', metavar='SPAN',
+                        help=f"Run cProfile while the named stage runs and save its stats. Also: {PROFILE_ENV}.")
+
+def configure(script_name, trace=None, profile_stage=None):
+    """
+    Starts recording for this run and returns the tracer. trace is a path, ''
+    for a timestamped path under output/traces/, or None to fall back to the
+    THORTSTREAM_TRACE environment variable. The trace is written at exit.
+    """
+    global _active
+    if trace is None:
+        trace = os.environ.get(TRACE_ENV)
+        if trace in ('1', 'true', 'yes'): trace = ''
+    if trace == '':
+        trace = default_trace_path(script_name)
+    profile_stage = profile_stage or os.environ.get(PROFILE_ENV) or None
+    _active = Tracer(script_name, trace, profile_stage)
+    atexit.register(_active.finish)
+    return _active
+
+def configure_from_args(script_name, args):
+    """configure() from the values of add_trace_arguments()' flags."""
+    return configure(script_name, args.trace, args.profile_stage)
+
+def span(name, **attrs):
+    """Context manager that records a span around a phase; a no-op until configure() is called."""
+    if _active is None: return NULL_SPAN
+    return SpanContext(_active, name, attrs)
+
+def phase(name):
+    """Context manager that adds a repeated piece of work to a per-name total on the current span."""
+    if _active is None: return NULL_SPAN
+    return PhaseContext(_active, name)
+
+def count(**amounts):
+    """Adds to the counters of the current span, e.g. count(bytes_read=n, files_read=1)."""
+    if _active is not None: _active.count(amounts)
+
+def count_written(*paths):
+    """Counts files a script has just written (files_written, bytes_written); missing paths are skipped."""
+    if _active is None: return
+    sizes = [os.path.getsize(path) for path in paths if os.path.isfile(path)]
+    _active.count({'files_written': len(sizes), 'bytes_written': sum(sizes)})
+
+def finish():
+    """Writes the trace now instead of at exit (safe to call more than once)."""
+    if _active is not None: _active.finish()
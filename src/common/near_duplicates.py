@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Filename:   near_duplicates.py
+Author:     Simon C, assisted by Dora
+Version:    1.1
+Date:       2026-10-17
+Description:
+    Finds chats that hold the same conversation, or nearly the same one,
+    without comparing every chat with every other. analyze_gemini_chats.py
+    --dedup uses it to mark the redundant copies in the master report.
+
+    Every chat gets a MinHash signature of the word shingles of its messages
+    (SHINGLE_WORDS consecutive words inside one message, lower-cased). It is
+    a one-permutation MinHash: each shingle is hashed once with CRC-32, the
+    low bits pick one of SIGNATURE_BINS bins and the bin keeps the smallest
+    of the remaining bits, so a chat costs one hash per shingle. The share of
+    bins in which two signatures agree estimates the Jaccard similarity of
+    their shingle sets.
+
+    Locality-sensitive hashing then splits each signature into LSH_BANDS
+    bands of rows; chats whose signatures are equal in at least one band
+    become candidate pairs, and only those pairs are compared. With 32 bands
+    of 4 rows, a pair at 80% similarity is a candidate with a probability of
+    1 - (1 - 0.8^4)^32, more than 99.9999%. Chats with byte-identical files
+    (the same content hash) are always grouped together.
+
+    Groups joined pair by pair can chain chats that are not alike (1~2 and
+    2~3 similar, 1~3 not), so a group only holds candidates. The copies are
+    assigned around a keeper: a chat is a redundant copy only if its file is
+    identical to the keeper's, or it is at least NEAR_DUPLICATE_THRESHOLD
+    similar to the keeper and the keeper holds at least that share of its
+    shingles. Whatever is left forms the next star around its best chat.
+
+        signatures = {chat_id: (sha256, chat_signature(text)) ...}
+        for members in find_duplicate_clusters(signatures):
+            copies = assign_copies(members, signatures, rank)   # [(keeper, copy, similarity), ...]
+
+    Signatures depend only on the bytes of a chat, so they are cached by
+    content hash in output/cache/dedup_signatures.json.
+"""
+
+import os
+import re
+import json
+import zlib
+from collections import defaultdict
+
+from atomic_write import atomic_open
+
+# --- CONFIGURATION ---
+BASE_DIR = os.getcwd()
+SIGNATURE_CACHE_PATH = os.path.join(BASE_DIR, 'output', 'cache', 'dedup_signatures.json')
+SIGNATURE_CACHE_VERSION = 1
+
+SHINGLE_WORDS = 5
+SIGNATURE_BINS = 128  # a power of two: the low bits of a shingle hash pick its bin
+LSH_BANDS = 32
+LSH_ROWS = SIGNATURE_BINS // LSH_BANDS
+EMPTY_BIN = 1 << 32  # larger than any value a bin can hold
+BIN_BITS = SIGNATURE_BINS.bit_length() - 1
+
+NEAR_DUPLICATE_THRESHOLD = 0.8  # estimated Jaccard similarity at which two chats count as copies
+MIN_SHINGLES = 10  # chats with fewer shingles (empty or failed scrapes) are never grouped
+
+MESSAGE_SPLIT_PATTERN = re.compile(r'## (?:PROMPT|RESPONSE) ##')
+WORD_PATTERN = re.compile(r'\w+')
+
+# --- SCRIPT ---
+
+def message_shingles(text):
+    """Returns the set of CRC-32 hashes of the word shingles of every message in a chat's text."""
+    shingles = set()
+    for message in MESSAGE_SPLIT_PATTERN.split(text.lower()):
+        words = WORD_PATTERN.findall(message)
+        if not words: continue
+        if len(words) <= SHINGLE_WORDS:
+            shingles.add(zlib.crc32(' '.join(words).encode('utf-8')))
+            continue
+        for i in range(len(words) - SHINGLE_WORDS + 1):
+            shingles.add(zlib.crc32(' '.join(words[i:i + SHINGLE_WORDS]).encode('utf-8')))
+    return shingles
+
+def chat_signature(text):
+    """Returns (shingle count, MinHash signature) of a chat's text."""
+    shingles = message_shingles(text)
+    signature = [EMPTY_BIN] * SIGNATURE_BINS
+    mask = SIGNATURE_BINS - 1
+    for shingle in shingles:
+        slot, value = shingle & mask, shingle >> BIN_BITS
+        if value < signature[slot]: signature[slot] = value
+    return len(shingles), signature
+
+def similarity(first, second):
+    """Estimates the Jaccard similarity of two chats from their signatures (bins empty in both are left out)."""
+    agree = used = 0
+    for a, b in zip(first, second):
+        if a == EMPTY_BIN and b == EMPTY_BIN: continue
+        used += 1
+        if a == b: agree += 1
+    return agree / used if used else 0.0
+
+def candidate_pairs(signatures):
+    """Returns the pairs of chat IDs whose signatures agree in at least one LSH band."""
+    pairs = set()
+    for band in range(LSH_BANDS):
+        buckets = defaultdict(list)
+        start = band * LSH_ROWS
+        for chat_id, signature in signatures.items():
+            rows = tuple(signature[start:start + LSH_ROWS])
+            if all(row == EMPTY_BIN for row in rows): continue
+            buckets[rows].append(chat_id)
+        for members in buckets.values():
+            for i, first in enumerate(members):
+                for second in members[i + 1:]:
+                    pairs.add((first, second) if first < second else (second, first))
+    return pairs
+
+def containment(kept, copy, score):
+    """
+    Estimates the share of copy's shingles that kept also has, from the shingle
+    counts of both and their estimated Jaccard similarity score:
+    |K & C| = score * (|K| + |C|) / (1 + score).
+    """
+    if copy == 0: return 0.0
+    return min(1.0, score * (kept + copy) / ((1 + score) * copy))
+
+def is_redundant_copy(kept, copy, threshold=NEAR_DUPLICATE_THRESHOLD):
+    """
+    Decides whether copy is a redundant copy of kept, both (sha256, (shingle
+    count, signature)). Returns the estimated similarity, or None if it is not.
+    """
+    if kept[0] == copy[0]: return 1.0
+    score = similarity(kept[1][1], copy[1][1])
+    if score < threshold or containment(kept[1][0], copy[1][0], score) < threshold: return None
+    return score
+
+def assign_copies(members, chats, rank, threshold=NEAR_DUPLICATE_THRESHOLD):
+    """
+    Splits a candidate group from find_duplicate_clusters() into stars: the best
+    chat by rank (a sort key, lowest first) keeps every member that is a
+    redundant copy of it, and the rest are grouped the same way. Returns
+    [(keeper, copy, similarity)] for every redundant copy.
+    """
+    copies = []
+    remaining = sorted(members, key=rank)
+    while len(remaining) > 1:
+        keeper, rest = remaining[0], []
+        for chat_id in remaining[1:]:
+            score = is_redundant_copy(chats[keeper], chats[chat_id], threshold)
+            if score is None: rest.append(chat_id)
+            else: copies.append((keeper, chat_id, score))
+        remaining = rest
+    return copies
+
+def find_duplicate_clusters(chats, threshold=NEAR_DUPLICATE_THRESHOLD):
+    """
+    Groups chats, {chat_id: (sha256, (shingle count, signature))}, whose
+    files are identical or whose signatures are at least threshold similar,
+    directly or through other chats. Returns the groups of two or more chats
+    as sorted lists of chat IDs; they are candidates for assign_copies().
+    """
+    parents = {}
+    def root(chat_id):
+        while parents.get(chat_id, chat_id) != chat_id: chat_id = parents[chat_id]
+        return chat_id
+    def join(first, second):
+        first, second = root(first), root(second)
+        if first != second: parents[max(first, second)] = min(first, second)
+
+    eligible = {chat_id: value for chat_id, value in chats.items() if value[1][0] >= MIN_SHINGLES}
+    by_hash = defaultdict(list)
+    for chat_id, (digest, _) in eligible.items(): by_hash[digest].append(chat_id)
+    for members in by_hash.values():
+        for chat_id in members[1:]: join(members[0], chat_id)
+    signatures = {chat_id: signature for chat_id, (_, (_, signature)) in eligible.items()}
+    for first, second in candidate_pairs(signatures):
+        if root(first) != root(second) and similarity(signatures[first], signatures[second]) >= threshold:
+            join(first, second)
+
+    clusters = defaultdict(list)
+    for chat_id in sorted(eligible): clusters[root(chat_id)].append(chat_id)
+    return [members for members in clusters.values() if len(members) > 1]
+
+def load_signature_cache(cache_path=SIGNATURE_CACHE_PATH):
+    """Returns {sha256: (shingle count, signature)} from the cache, or {} if it is missing or stale."""
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    if cache.get('version') != SIGNATURE_CACHE_VERSION or cache.get('bins') != SIGNATURE_BINS:
+        return {}
+    return {digest: (value[0], value[1]) for digest, value in cache['signatures'].items()}
+
+def save_signature_cache(signatures, cache_path=SIGNATURE_CACHE_PATH):
+    """Replaces the cache with signatures, {sha256: (shingle count, signature)}."""
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    with atomic_open(cache_path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps({'version': SIGNATURE_CACHE_VERSION, 'bins': SIGNATURE_BINS,
+                            'signatures': {digest: list(value) for digest, value in signatures.items()}}))
@@ -0,0 +1,457 @@
+# -*- coding: utf-8 -*-
+"""
+Filename:   run_pipeline.py
+Author:     Simon C, assisted by Dora
+Version:    1.5
+Date:       2026-10-17
+Description:
+    One entry point for the analysis and build scripts. Each stage is declared
+    below with the files and folders it reads and writes, and a stage depends
+    on every stage that writes one of its inputs, which makes a DAG:
+
+        analyze     analyze_gemini_chats.py --pack --dedup
+        database    build_database.py --incremental                      (after analyze)
+        site        build_website_content.py --incremental --parallel
+                    --output-dir output/site           (after analyze; only when asked for)
+        search_db   build_search_db.py                 (after analyze; only when asked for)
+
+    A stage can also name files it cannot run without (the site stage needs
+    its page templates); when one is missing the stage is skipped with a
+    warning instead of failing.
+
+    A stage is fingerprinted when it becomes ready to run: its script and
+    arguments, the code it imports, and its inputs, files by a SHA-256 of
+    their content (remembered against size and mtime, so an unchanged file is
+    not read again) and folders by the names, sizes and mtimes of the files
+    in them. A stage whose fingerprint, and whose outputs, still match what
+    its last successful run recorded in output/cache/pipeline_state.json is
+    skipped. Since the fingerprint is only taken once the stages before it
+    are done, a stage that rewrote an output with the same bytes (analysis
+    rewrites its report on every run) does not make the later stages run.
+    Stages whose dependencies are done run at the same time, each as its own
+    process from the project root, logging to output/logs/pipeline/<stage>.log.
+
+    --watch keeps going after the first run. It watches data/allchats/, the
+    analysis log and chats.json (with inotify, or by polling with --poll or
+    where inotify is unavailable), and for each debounced burst of changes
+    updates the analysis in memory (LiveAnalysis in analyze_gemini_chats.py),
+    re-deriving only the chats that changed, then runs the later stages,
+    which pick up just those chats incrementally. A newly scraped chat is
+    searchable a few seconds after its file lands.
+
+    Example:
+        python src/pipeline/run_pipeline.py                     (analyze and database)
+        python src/pipeline/run_pipeline.py database --dry-run
+        python src/pipeline/run_pipeline.py site --force
+        python src/pipeline/run_pipeline.py --watch
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import subprocess
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'common'))
+from instrumentation import span, count, add_trace_arguments, configure_from_args
+from file_watcher import open_watcher, wait_for_batch, RESCAN
+
+# --- CONFIGURATION ---
+BASE_DIR = os.getcwd()
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COMMON_DIR = os.path.join(SRC_DIR, 'common')
+ANALYSIS_DIR = os.path.join(SRC_DIR, '02_analysis')
+ANALYZE_SCRIPT = os.path.join(ANALYSIS_DIR, 'analyze_gemini_chats.py')
+BUILD_SCRIPT = os.path.join(SRC_DIR, '03_website_generation', 'build_database.py')
+SITE_SCRIPT = os.path.join(SRC_DIR, '03_website_generation', 'build_website_content.py')
+SEARCH_DB_SCRIPT = os.path.join(SRC_DIR, '03_website_generation', 'build_search_db.py')
+
+# Inputs
+ANALYSIS_LOG_PATH = os.path.join(BASE_DIR, 'output', 'logs', 'chatAnalysis.txt')
+CHATS_JSON_PATH = os.path.join(BASE_DIR, 'data', 'metadata', 'chats.json')
+ALL_CHATS_DIR = os.path.join(BASE_DIR, 'data', 'allchats')
+# build_website_content.py reads these from the project root, not from next to itself.
+TEMPLATES_DIR = os.path.join(BASE_DIR, 'src', '03_website_generation', 'templates')
+DOCS_DIR = os.path.join(BASE_DIR, 'src', 'docs')
+SITE_TEMPLATE_NAMES = ['index_template.html', 'chat_page_template.html', 'search.js', 'chat_page.js', 'search_worker.js']
+
+# Outputs
+CSV_REPORT_PATH = os.path.join(BASE_DIR, 'output', 'reports', 'chat_analysis_report.csv')
+RESCAPE_CONFIG_PATH = os.path.join(BASE_DIR, 'output', 'configs', 'rescraping_config.json')
+MISPLACED_FILES_REPORT_PATH = os.path.join(BASE_DIR, 'output', 'reports', 'misplaced_files_report.txt')
+PACK_DIR = os.path.join(BASE_DIR, 'output', 'cache', 'chat_pack')
+DEDUP_CACHE_PATH = os.path.join(BASE_DIR, 'output', 'cache', 'dedup_signatures.json')
+WEBSITE_DATA_DIR = os.path.join(BASE_DIR, 'public')
+BUILD_MANIFEST_PATH = os.path.join(BASE_DIR, 'output', 'cache', 'build_manifest.json')
+SITE_OUTPUT_DIR = os.path.join(BASE_DIR, 'output', 'site')
+SITE_MANIFEST_PATH = os.path.join(BASE_DIR, 'output', 'cache', 'site_manifest.json')
+SEARCH_DB_PATH = os.path.join(BASE_DIR, 'output', 'search', 'archive.sqlite3')
+
+# Pipeline state and logs
+STATE_PATH = os.path.join(BASE_DIR, 'output', 'cache', 'pipeline_state.json')
+STATE_VERSION = 1
+LOG_DIR = os.path.join(BASE_DIR, 'output', 'logs', 'pipeline')
+LOG_TAIL_LINES = 15
+
+# Files up to this size are fingerprinted by content; larger ones (the chat pack, a big
+# database.json) by size and mtime only. Folders are always fingerprinted by size and mtime.
+HASH_MAX_BYTES = 16 * 1024 * 1024
+HASH_CHUNK_SIZE = 1024 * 1024
+SKIPPED_DIR_NAMES = {'__pycache__'}
+MISSING = 'missing'
+
+# --- SCRIPT ---
+
+# default: whether the stage runs when no stages are named on the command line.
+# requires: files the script cannot run without; the stage is skipped while one is missing.
+Stage = namedtuple('Stage', 'name script arguments inputs outputs default requires', defaults=((),))
+
+def pipeline_stages(layout='single', word_index_format='json'):
+    """Declares the pipeline. The code a stage runs counts as one of its inputs."""
+    build_outputs = [
+        os.path.join(WEBSITE_DATA_DIR, 'database.json' if layout == 'single' else 'catalog.json'),
+        os.path.join(WEBSITE_DATA_DIR, 'search_index_word.json' if word_index_format == 'json' else 'search_index_word.bin'),
+        os.path.join(WEBSITE_DATA_DIR, 'asset_manifest.json'),
+        BUILD_MANIFEST_PATH
+    ]
+    chat_inputs = [CSV_REPORT_PATH, ALL_CHATS_DIR, PACK_DIR]
+    return [
+        Stage('analyze', ANALYZE_SCRIPT, ['--pack', '--dedup'],
+              [ANALYZE_SCRIPT, COMMON_DIR, ANALYSIS_LOG_PATH, CHATS_JSON_PATH, ALL_CHATS_DIR],
+              [CSV_REPORT_PATH, RESCAPE_CONFIG_PATH, MISPLACED_FILES_REPORT_PATH, PACK_DIR, DEDUP_CACHE_PATH], True),
+        Stage('database', BUILD_SCRIPT, ['--incremental', '--layout', layout, '--word-index-format', word_index_format],
+              [BUILD_SCRIPT, COMMON_DIR] + chat_inputs, build_outputs, True),
+        Stage('site', SITE_SCRIPT, ['--incremental', '--parallel', '--output-dir', SITE_OUTPUT_DIR],
+              [SITE_SCRIPT, BUILD_SCRIPT, COMMON_DIR, TEMPLATES_DIR, DOCS_DIR] + chat_inputs,
+              [SITE_OUTPUT_DIR, SITE_MANIFEST_PATH], False,
+              [os.path.join(TEMPLATES_DIR, name) for name in SITE_TEMPLATE_NAMES]),
+        Stage('search_db', SEARCH_DB_SCRIPT, [],
+              [SEARCH_DB_SCRIPT, BUILD_SCRIPT, COMMON_DIR] + chat_inputs, [SEARCH_DB_PATH], False),
+    ]
+
+def paths_overlap(a, b):
+    """True if two paths are the same, or one is inside the other."""
+    return a == b or a.startswith(b + os.sep) or b.startswith(a + os.sep)
+
+def stage_dependencies(stages):
+    """
+    Returns {stage name: [names of the stages it depends on]}. Raises ValueError
+    if two stages write the same path, or if the dependencies form a cycle.
+    """
+    for i, first in enumerate(stages):
+        for second in stages[i + 1:]:
+            if any(paths_overlap(a, b) for a in first.outputs for b in second.outputs):
+                raise ValueError(f"stages '{first.name}' and '{second.name}' write the same output")
+    dependencies = {stage.name: [other.name for other in stages if other is not stage and any(
+        paths_overlap(path, output) for path in stage.inputs for output in other.outputs)] for stage in stages}
+    visiting, done = set(), set()
+    def visit(name):
+        if name in done: return
+        if name in visiting: raise ValueError(f"the pipeline has a dependency cycle through '{name}'")
+        visiting.add(name)
+        for dependency in dependencies[name]: visit(dependency)
+        visiting.discard(name)
+        done.add(name)
+    for name in dependencies: visit(name)
+    return dependencies
+
+def select_stages(dependencies, targets):
+    """Returns the targets plus every stage they depend on, directly or not."""
+    selected, stack = set(), list(targets)
+    while stack:
+        name = stack.pop()
+        if name in selected: continue
+        selected.add(name)
+        stack.extend(dependencies[name])
+    return selected
+
+def relative(path):
+    return os.path.relpath(path, BASE_DIR)
+
+class Fingerprinter:
+    """
+    Fingerprints files and folders. Results are kept for the rest of the run,
+    except for the outputs of a stage that has just run (see forget()); content
+    hashes are also kept across runs in hashes, {path: [size, mtime_ns, sha256]}.
+    """
+
+    def __init__(self, hashes):
+        self.hashes = hashes
+        self.known = {}
+
+    def __call__(self, path):
+        if path not in self.known: self.known[path] = self.fingerprint(path)
+        return self.known[path]
+
+    def forget(self, paths):
+        for known in list(self.known):
+            if any(paths_overlap(known, path) for path in paths): del self.known[known]
+
+    def fingerprint(self, path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return MISSING
+        if os.path.isdir(path):
+            return 'tree:' + self.tree_digest(path)
+        if stat.st_size > HASH_MAX_BYTES:
+            return f'stat:{stat.st_size}:{stat.st_mtime_ns}'
+        key = relative(path)
+        cached = self.hashes.get(key)
+        if cached is None or cached[:2] != [stat.st_size, stat.st_mtime_ns]:
+            digest = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''): digest.update(chunk)
+            count(bytes_read=stat.st_size, files_read=1)
+            cached = self.hashes[key] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return 'sha256:' + cached[2]
+
+    def tree_digest(self, folder):
+        """Hashes the relative path, size and mtime of every file under folder."""
+        digest = hashlib.sha256()
+        stack = [folder]
+        while stack:
+            current = stack.pop()
+            with os.scandir(current) as entries:
+                entries = sorted(entries, key=lambda entry: entry.name)
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in SKIPPED_DIR_NAMES: stack.append(entry.path)
+                    continue
+                stat = entry.stat()
+                digest.update(f'{os.path.relpath(entry.path, folder)}\0{stat.st_size}\0{stat.st_mtime_ns}\n'
+                              .encode('utf-8', errors='surrogateescape'))
+        return digest.hexdigest()
+
+def load_state(state_path):
+    """Returns the recorded pipeline state, or an empty one."""
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        if state.get('version') == STATE_VERSION: return state
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+    return {'version': STATE_VERSION, 'hashes': {}, 'stages': {}}
+
+def save_state(state_path, state):
+    os.makedirs(os.path.dirname(state_path), exist_ok=True)
+    temp_path = state_path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(temp_path, state_path)
+
+def stage_command(stage):
+    return [relative(stage.script)] + [relative(argument) if os.path.isabs(argument) else argument
+                                       for argument in stage.arguments]
+
+def stale_reasons(stage, record, inputs, fingerprint):
+    """Returns why a stage has to run (an empty list if it is up to date)."""
+    if record is None: return ['no previous run']
+    if record['command'] != stage_command(stage): return ['arguments changed']
+    reasons = [f"input changed: {path}" for path, value in inputs.items() if record['inputs'].get(path) != value]
+    for output in stage.outputs:
+        current = fingerprint(output)
+        if current == MISSING: reasons.append(f"output missing: {relative(output)}")
+        elif record['outputs'].get(relative(output)) != current: reasons.append(f"output changed: {relative(output)}")
+    return reasons
+
+def run_stage(stage, log_path):
+    """Runs one stage script from the project root. Returns (exit code, seconds)."""
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+    started = time.perf_counter()
+    with open(log_path, 'w', encoding='utf-8') as log:
+        process = subprocess.run([sys.executable, stage.script] + stage.arguments, cwd=BASE_DIR,
+                                 stdout=log, stderr=subprocess.STDOUT)
+    return process.returncode, time.perf_counter() - started
+
+def print_log_tail(log_path, lines=LOG_TAIL_LINES):
+    with open(log_path, 'r', encoding='utf-8', errors='replace') as f:
+        tail = f.read().splitlines()[-lines:]
+    for line in tail: print(f"    {line}")
+
+def record_stage(state, stage, inputs, seconds, fingerprint):
+    """Records a successful run of a stage: its command, the input fingerprints it ran on and its outputs now."""
+    state['stages'][stage.name] = {
+        'command': stage_command(stage), 'inputs': inputs, 'seconds': round(seconds, 3),
+        'outputs': {relative(output): fingerprint(output) for output in stage.outputs}
+    }
+
+def run_pipeline(stages, targets, state, force=(), dry_run=False, jobs=None):
+    """
+    Runs the targets and the stages they depend on, each as soon as its
+    dependencies are done, and records every successful run in state.
+    Returns {stage name: outcome}, an outcome being 'ran', 'up to date',
+    'failed', 'skipped' (a required file is missing), 'blocked' (a dependency
+    failed or was skipped) or, with dry_run, 'would run'.
+    """
+    dependencies = stage_dependencies(stages)
+    by_name = {stage.name: stage for stage in stages}
+    pending = select_stages(dependencies, targets)
+    fingerprint = Fingerprinter(state['hashes'])
+    outcomes, running = {}, {}
+
+    with ThreadPoolExecutor(max_workers=jobs or len(stages)) as executor:
+        while pending or running:
+            for name in sorted(pending):
+                if any(dependency not in outcomes for dependency in dependencies[name]): continue
+                pending.discard(name)
+                stage = by_name[name]
+                upstream = [outcomes[dependency] for dependency in dependencies[name]]
+                if any(outcome in ('failed', 'skipped', 'blocked') for outcome in upstream):
+                    outcomes[name] = 'blocked'
+                    print(f"[WARNING] {name}: not run, a stage it depends on failed or was skipped.")
+                    continue
+                missing = [relative(path) for path in stage.requires if not os.path.exists(path)]
+                if missing:
+                    outcomes[name] = 'skipped'
+                    print(f"[WARNING] {name}: skipped, it needs {', '.join(missing)}, which "
+                          f"{'does' if len(missing) == 1 else 'do'} not exist.")
+                    continue
+                inputs = {relative(path): fingerprint(path) for path in stage.inputs}
+                reasons = (['forced'] if name in force else
+                           stale_reasons(stage, state['stages'].get(name), inputs, fingerprint))
+                if dry_run:
+                    if reasons or 'would run' in upstream:
+                        outcomes[name] = 'would run'
+                        print(f"[INFO] {name}: would run ({'; '.join(reasons) or 'if its inputs change upstream'})")
+                    else:
+                        outcomes[name] = 'up to date'
+                        print(f"[INFO] {name}: up to date")
+                    continue
+                if not reasons:
+                    outcomes[name] = 'up to date'
+                    print(f"[INFO] {name}: up to date")
+                    continue
+                print(f"[INFO] {name}: running {' '.join(stage_command(stage))} ({'; '.join(reasons[:3])}"
+                      f"{f'; {len(reasons) - 3} more' if len(reasons) > 3 else ''})")
+                log_path = os.path.join(LOG_DIR, f'{name}.log')
+                running[executor.submit(run_stage, stage, log_path)] = (stage, inputs, log_path)
+            if not running: continue
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage, inputs, log_path = running.pop(future)
+                exit_code, seconds = future.result()
+                fingerprint.forget(stage.outputs)
+                if exit_code != 0:
+                    outcomes[stage.name] = 'failed'
+                    state['stages'].pop(stage.name, None)
+                    print(f"[ERROR] {stage.name} failed (exit code {exit_code}) after {seconds:.1f} s. "
+                          f"Last lines of {relative(log_path)}:")
+                    print_log_tail(log_path)
+                    continue
+                outcomes[stage.name] = 'ran'
+                record_stage(state, stage, inputs, seconds, fingerprint)
+                count(stages_run=1)
+                print(f"[SUCCESS] {stage.name} finished in {seconds:.1f} s (log: {relative(log_path)})")
+    return outcomes
+
+def describe_changes(changes):
+    if changes is RESCAN: return "changes the watcher lost track of, rescanning everything"
+    shown = sorted(relative(path) for path in changes)
+    return f"{len(shown)} changed file(s): {', '.join(shown[:3])}{', ...' if len(shown) > 3 else ''}"
+
+def watch_pipeline(stages, targets, state, polling=False, jobs=None):
+    """
+    Runs the pipeline once, then keeps it up to date as files change until
+    interrupted. The analyze stage is replaced by in-memory updates and then
+    recorded as up to date, so the later stages see a normal fingerprinted run.
+    """
+    sys.path.insert(0, ANALYSIS_DIR)
+    from analyze_gemini_chats import LiveAnalysis
+    by_name = {stage.name: stage for stage in stages}
+    analyze = by_name['analyze']
+    run_pipeline(stages, targets, state, jobs=jobs)
+    save_state(STATE_PATH, state)
+    with span('load_analysis'):
+        live = LiveAnalysis(dedup='--dedup' in analyze.arguments)
+    watcher = open_watcher([ALL_CHATS_DIR, ANALYSIS_LOG_PATH, CHATS_JSON_PATH], polling)
+    print(f"--- Watching {relative(ALL_CHATS_DIR)}, {relative(ANALYSIS_LOG_PATH)} and {relative(CHATS_JSON_PATH)} "
+          f"({type(watcher).__name__}). Press Ctrl+C to stop. ---")
+    try:
+        while True:
+            changes = wait_for_batch(watcher)
+            started = time.perf_counter()
+            print(f"[INFO] {describe_changes(changes)}")
+            with span('watch_batch'):
+                fingerprint = Fingerprinter(state['hashes'])
+                # Fingerprinted before the update, so a change that lands during it makes analyze stale, not lost.
+                inputs = {relative(path): fingerprint(path) for path in analyze.inputs}
+                with span('live_analysis'):
+                    changed = live.update(changes)
+                fingerprint.forget(analyze.outputs)
+                record_stage(state, analyze, inputs, time.perf_counter() - started, fingerprint)
+                print(f"[INFO] analyze: updated in memory ("
+                      f"{'all chats' if changed is None else f'{len(changed)} report row(s) changed'}).")
+                outcomes = run_pipeline(stages, targets, state, jobs=jobs)
+                save_state(STATE_PATH, state)
+            summary = ', '.join(f"{name}: {outcome}" for name, outcome in sorted(outcomes.items()))
+            print(f"--- Up to date in {time.perf_counter() - started:.2f} s ({summary}) ---")
+    except KeyboardInterrupt:
+        print("\n--- Stopped watching ---")
+    finally:
+        watcher.close()
+        save_state(STATE_PATH, state)
+
+def main():
+    stages = pipeline_stages()
+    parser = argparse.ArgumentParser(description="Runs the stages of the pipeline that are out of date, "
+                                                 "independent ones in parallel.")
+    parser.add_argument('stages', nargs='*', metavar='stage',
+                        help=f"Stages to bring up to date, with the stages they depend on "
+                             f"({', '.join(stage.name for stage in stages)}; default: "
+                             f"{', '.join(stage.name for stage in stages if stage.default)}).")
+    parser.add_argument('--force', action='store_true', help="Run the named stages (the default ones if none are named) even if up to date.")
+    parser.add_argument('--dry-run', action='store_true', help="Only print which stages would run, and why.")
+    parser.add_argument('--watch', action='store_true',
+                        help="After running, keep the stages up to date as chat files, the analysis log or chats.json change.")
+    parser.add_argument('--poll', action='store_true', help="With --watch, poll for changes instead of using inotify.")
+    parser.add_argument('--jobs', type=int, default=None, help="Stages run at the same time (default: as many as are ready).")
+    parser.add_argument('--layout', choices=['single', 'sharded'], default='single',
+                        help="Output layout passed to build_database.py.")
+    parser.add_argument('--word-index-format', choices=['json', 'binary'], default='json',
+                        help="Word index format passed to build_database.py.")
+    add_trace_arguments(parser)
+    args = parser.parse_args()
+    configure_from_args('run_pipeline', args)
+    unknown = [name for name in args.stages if name not in {stage.name for stage in stages}]
+    if unknown: parser.error(f"unknown stage(s): {', '.join(unknown)}")
+    if args.watch and args.dry_run: parser.error("--watch cannot be combined with --dry-run")
+    if args.poll and not args.watch: parser.error("--poll only applies with --watch")
+
+    started = time.perf_counter()
+    stages = pipeline_stages(args.layout, args.word_index_format)
+    targets = args.stages or [stage.name for stage in stages if stage.default]
+    state = load_state(STATE_PATH)
+    print(f"--- Running pipeline: {', '.join(targets)} ---")
+    if args.watch:
+        try:
+            stage_dependencies(stages)
+        except ValueError as e:
+            print(f"[FATAL] {e}")
+            sys.exit(1)
+        watch_pipeline(stages, targets, state, polling=args.poll, jobs=args.jobs and max(1, args.jobs))
+        return
+    try:
+        with span('pipeline', dry_run=args.dry_run):
+            outcomes = run_pipeline(stages, targets, state, force=set(targets) if args.force else set(),
+                                    dry_run=args.dry_run, jobs=args.jobs and max(1, args.jobs))
+    except ValueError as e:
+        print(f"[FATAL] {e}")
+        sys.exit(1)
+    finally:
+        if not args.dry_run: save_state(STATE_PATH, state)
+
+    summary = ', '.join(f"{name}: {outcome}" for name, outcome in sorted(outcomes.items()))
+    print(f"--- Pipeline finished in {time.perf_counter() - started:.2f} s ({summary}) ---")
+    # A default stage that cannot run is only reported; one asked for by name is an error.
+    if any(outcome in ('failed', 'blocked') or (outcome == 'skipped' and name in args.stages)
+           for name, outcome in outcomes.items()):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()